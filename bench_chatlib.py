@@ -0,0 +1,62 @@
+##############################################################################
+# bench_chatlib.py
+# Microbenchmark of the chatlib message building and parsing, in messages per second.
+# Usage: python bench_chatlib.py [number of messages]
+##############################################################################
+
+import sys
+import time
+import chatlib
+
+DEFAULT_MESSAGES = 200000
+READ_SIZE = 4096  # bytes handed to the decoders at a time, like a socket read
+
+SAMPLE_MESSAGES = [
+    (chatlib.PROTOCOL_CLIENT["login_msg"], "player1#secret1"),
+    (chatlib.PROTOCOL_CLIENT["question"], ""),
+    (chatlib.PROTOCOL_CLIENT["send_answer"], "0a0ea0a674de957b#" + "ab" * 32),
+    (chatlib.PROTOCOL_SERVER["question"], "0a0ea0a674de957b#Which planet is known as the Red Planet?#Venus#Mars#"
+                                          "Jupiter#Saturn"),
+    (chatlib.PROTOCOL_SERVER["correct_answer"], ""),
+    (chatlib.PROTOCOL_SERVER["logged_users"], "player1,player2,player3"),
+]
+
+
+def measure(name, count, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print("{:<28}{:>12,.0f} msg/s".format(name, count / elapsed))
+
+
+def bench_build(messages):
+    for cmd, data in messages:
+        chatlib.build_message(cmd, data)
+
+
+def bench_parse(frames):
+    for frame in frames:
+        chatlib.parse_message(frame)
+
+
+def bench_decoder(decoder, stream):
+    for start in range(0, len(stream), READ_SIZE):
+        decoder.feed(stream[start:start + READ_SIZE])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MESSAGES
+    messages = (SAMPLE_MESSAGES * (count // len(SAMPLE_MESSAGES) + 1))[:count]
+    frames = [chatlib.build_message(cmd, data) for cmd, data in messages]
+    stream = "".join(frames).encode()
+    measure("build_message", count, lambda: bench_build(messages))
+    measure("parse_message", count, lambda: bench_parse(frames))
+    measure("MessageDecoder.feed", count, lambda: bench_decoder(chatlib.MessageDecoder(), stream))
+    if hasattr(chatlib, "CompactMessageDecoder"):
+        compact_stream = b"".join(chatlib.build_compact_message(cmd, data) for cmd, data in messages)
+        measure("CompactMessageDecoder.feed", count,
+                lambda: bench_decoder(chatlib.CompactMessageDecoder(), compact_stream))
+
+
+if __name__ == '__main__':
+    main()
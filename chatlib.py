@@ -1,3 +1,5 @@
+import struct
+
 # Protocol Constants
 CMD_FIELD_LENGTH = 16  # Exact length of cmd field (in bytes)
 LENGTH_FIELD_LENGTH = 4  # Exact length of length field (in bytes)
@@ -6,6 +8,7 @@ MSG_HEADER_LENGTH = CMD_FIELD_LENGTH + 1 + LENGTH_FIELD_LENGTH + 1  # Exact size
 MAX_MSG_LENGTH = MSG_HEADER_LENGTH + MAX_DATA_LENGTH  # Max size of total message
 DELIMITER = "|"  # Delimiter character in protocol
 DATA_DELIMITER = "#"  # Delimiter in the data part of the message
+RECORD_DELIMITER = "\n"  # Delimiter between the records of a batch message, each record is joined with DATA_DELIMITER
 
 # Protocol Messages 
 # In this dictionary we will have all the client and server command names
@@ -18,7 +21,16 @@ PROTOCOL_CLIENT = {
     "highscore": "HIGHSCORE",
     "question": "GET_QUESTION",
     "send_answer": "SEND_ANSWER",
-    "logged_users": "LOGGED"
+    "logged_users": "LOGGED",
+    "protocol": "PROTOCOL",
+    "questions": "GET_QUESTIONS",
+    "send_answers": "SEND_ANSWERS",
+    "heartbeat": "PING",
+    "join_room": "JOIN_ROOM",
+    "leave_room": "LEAVE_ROOM",
+    "subscribe": "SUBSCRIBE",
+    "resume": "RESUME",
+    "highscore_page": "HIGHSCORE_PAGE"
 }  # .. Add more commands if needed
 
 PROTOCOL_SERVER = {
@@ -31,31 +43,79 @@ PROTOCOL_SERVER = {
     "wrong_answer": "WRONG_ANSWER",
     "logged_users": "LOGGED_ANSWER",
     "finished_game": "FINISHED_ANSWER",
-    "error_msg": "ERROR"
+    "error_msg": "ERROR",
+    "protocol_ok": "PROTOCOL_OK",
+    "questions": "YOUR_QUESTIONS",
+    "answers_results": "ANSWER_RESULTS",
+    "heartbeat": "PONG",
+    "room_state": "ROOM_STATE",
+    "room_question": "ROOM_QUESTION",
+    "answer_received": "ANSWER_RECEIVED",
+    "room_results": "ROOM_RESULTS",
+    "room_over": "ROOM_OVER",
+    "room_left": "ROOM_LEFT",
+    "room_joined": "ROOM_JOINED",
+    "subscribed": "SUBSCRIBED",
+    "highscore_push": "HIGHSCORE_PUSH",
+    "logged_push": "LOGGED_PUSH",
+    "score_push": "SCORE_PUSH",
+    "highscore_page": "SCORES_PAGE"
 
 }  # ..  Add more commands if needed
 
+# Server messages which aren't the reply to a request. Every other server message is the reply to the request the
+# server got before it (LOGOUT has no reply), and the server replies to the requests in the order they were sent.
+PUSH_COMMANDS = frozenset(PROTOCOL_SERVER[name] for name in ("room_state", "room_question", "room_results",
+                                                             "room_over", "highscore_push", "logged_push",
+                                                             "score_push"))
+PUSH_TOPICS = ("highscore", "logged", "score")  # what a client can SUBSCRIBE to
+HIGHSCORE_WINDOWS = ("all", "daily", "weekly")  # rankings of a HIGHSCORE_PAGE: all the time, today and this week (UTC)
+AROUND_ME = "me"  # start of the HIGHSCORE_PAGE around the user
+MIN_USERNAME_LENGTH = 4  # of a username chosen at SIGNUP, which has only letters and digits
+MAX_USERNAME_LENGTH = 20
+
 # Other constants
 
 ERROR_RETURN = None  # What is returned in case of an error
 
+# Compact framing, negotiated with a PROTOCOL message: 1 byte opcode, 4 bytes data length in bytes, UTF-8 data.
+# The PROTOCOL message and its PROTOCOL_OK answer are sent in text framing, everything after them is compact.
+TEXT_FORMAT = "text"
+COMPACT_FORMAT = "compact"
+MESSAGE_FORMATS = (TEXT_FORMAT, COMPACT_FORMAT)
+FORMAT_SWITCH_COMMANDS = (PROTOCOL_CLIENT["protocol"], PROTOCOL_SERVER["protocol_ok"])
+COMPACT_HEADER = struct.Struct("!BI")
+COMPACT_MAX_DATA_LENGTH = 16 * 1024 * 1024  # Max size of the data field of a compact message (in bytes)
+# Client commands get opcodes from 1 and server commands from 128, in the order of the dictionaries above,
+# so commands added at the end of a dictionary don't change the opcodes of the others
+COMMAND_OPCODES = {cmd: opcode for opcode, cmd in enumerate(PROTOCOL_CLIENT.values(), 1)}
+COMMAND_OPCODES.update({cmd: opcode for opcode, cmd in enumerate(PROTOCOL_SERVER.values(), 128)})
+OPCODE_COMMANDS = {opcode: cmd for cmd, opcode in COMMAND_OPCODES.items()}
+
+# Lookup tables built once, instead of scanning the dictionaries above for every message
+CLIENT_COMMANDS = frozenset(PROTOCOL_CLIENT.values())
+SERVER_COMMANDS = frozenset(PROTOCOL_SERVER.values())
+ALL_COMMANDS = CLIENT_COMMANDS | SERVER_COMMANDS
+PADDED_COMMANDS = {cmd: cmd.ljust(CMD_FIELD_LENGTH) for cmd in ALL_COMMANDS}  # command -> its cmd field
+_COMMANDS_BY_FIELD = {padded.encode(): cmd for cmd, padded in PADDED_COMMANDS.items()}  # cmd field bytes -> command
+_DELIMITER_BYTE = ord(DELIMITER)
+
 
 def build_message(cmd, data):
     """
     Gets command name (str) and data field (str) and creates a valid protocol message
     Returns: str, or None if error occured
     """
-    if not type(cmd) == str:
+    if type(cmd) is not str:
         raise ValueError("cmd must be a string")
-    if not type(data) == str:
+    if type(data) is not str:
         raise ValueError("data must be a string")
-    if cmd not in PROTOCOL_CLIENT.values() and cmd not in PROTOCOL_SERVER.values():
+    padded_cmd = PADDED_COMMANDS.get(cmd)
+    if padded_cmd is None:
         return None
     if len(data) > MAX_DATA_LENGTH:
         return None
-    data_len = str(len(data))
-    full_msg = cmd + " " * (16 - len(cmd)) + "|" + "0" * (4 - len(data_len)) + data_len + "|" + data
-    return full_msg
+    return f"{padded_cmd}|{len(data):04d}|{data}"
 
 
 def parse_message(data: str):
@@ -63,8 +123,18 @@ def parse_message(data: str):
     Parses protocol message and returns command name and data field
     Returns: cmd (str), data (str). If some error occured, returns None, None
     """
-    if not type(data) == str:
+    if type(data) is not str:
         raise ValueError("data must be a string")
+    # Fast path for a well formed header, which is what build_message creates
+    if len(data) >= MSG_HEADER_LENGTH and data[CMD_FIELD_LENGTH] == DELIMITER \
+            and data[MSG_HEADER_LENGTH - 1] == DELIMITER:
+        padded_cmd = data[:CMD_FIELD_LENGTH]
+        cmd = padded_cmd.rstrip()
+        field_size = data[CMD_FIELD_LENGTH + 1:MSG_HEADER_LENGTH - 1]
+        msg = data[MSG_HEADER_LENGTH:]
+        if PADDED_COMMANDS.get(cmd) == padded_cmd and field_size.isdigit() and int(field_size) == len(msg) \
+                and DELIMITER not in msg:
+            return cmd, msg
     data_split = data.split("|")
     if not len(data_split) == 3:
         return None, None
@@ -73,7 +143,7 @@ def parse_message(data: str):
     if not field_size.isdigit():
         return None, None
     field_size = int(field_size)
-    if cmd not in PROTOCOL_CLIENT.values() and cmd not in PROTOCOL_SERVER.values():
+    if cmd not in ALL_COMMANDS:
         return None, None
     msg = data_split[2]
     if not field_size == len(msg):
@@ -82,6 +152,201 @@ def parse_message(data: str):
     return cmd, msg
 
 
+def _utf8_end(buffer, start, char_count):
+    """
+    Finds where a run of char_count UTF-8 encoded characters that begins at start ends in buffer.
+    Returns: index right after the last byte, or None if the buffer does not hold all of them yet
+    """
+    end = start + char_count
+    if end > len(buffer):
+        return None
+    if buffer[start:end].isascii():
+        return end
+    index = start
+    while char_count:
+        if index >= len(buffer):
+            return None
+        lead = buffer[index]
+        if lead < 0x80:
+            index += 1
+        elif lead >= 0xF0:
+            index += 4
+        elif lead >= 0xE0:
+            index += 3
+        else:
+            index += 2
+        char_count -= 1
+    if index > len(buffer):
+        return None
+    return index
+
+
+class MessageDecoder:
+    """
+    Incremental decoder for one connection. Bytes are fed in as they arrive from the socket and every
+    complete CMD|LLLL|data frame is parsed out of them, no matter how TCP split or merged the frames.
+    The header is parsed from the bytes and only the data field is decoded. The length field counts
+    characters, so multi byte UTF-8 data is measured accordingly. Since frames are found by their length,
+    the data field may contain the delimiter.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0  # start of the first frame that wasn't parsed yet
+
+    def feed(self, data):
+        """
+        Adds received bytes and parses all the frames completed by them
+        Returns: list of (cmd, data) tuples, possibly empty. A broken frame is returned as (None, None)
+        and everything after it is dropped, since the stream can't be resynchronized.
+        """
+        buffer = self._buffer
+        buffer += data
+        messages = []
+        pos = self._pos
+        with memoryview(buffer) as view:
+            while len(buffer) - pos >= MSG_HEADER_LENGTH:
+                header_end = pos + MSG_HEADER_LENGTH
+                cmd = _COMMANDS_BY_FIELD.get(bytes(view[pos:pos + CMD_FIELD_LENGTH]))
+                length_field = bytes(view[header_end - LENGTH_FIELD_LENGTH - 1:header_end - 1])
+                if cmd is None or not length_field.isdigit() or buffer[pos + CMD_FIELD_LENGTH] != _DELIMITER_BYTE \
+                        or buffer[header_end - 1] != _DELIMITER_BYTE:
+                    messages.append((None, None))
+                    break
+                frame_end = _utf8_end(buffer, header_end, int(length_field))
+                if frame_end is None:
+                    break
+                try:
+                    msg = str(view[header_end:frame_end], "utf-8")
+                except UnicodeDecodeError:
+                    messages.append((None, None))
+                    break
+                pos = frame_end
+                messages.append((cmd, msg))
+                if cmd in FORMAT_SWITCH_COMMANDS:
+                    break  # what follows is in the negotiated format, see take_remaining
+        self._pos = pos
+        if messages and messages[-1][0] is None:
+            self.reset()
+        elif self._pos:
+            # Drop the consumed frames in one go instead of after each one
+            del buffer[:self._pos]
+            self._pos = 0
+        return messages
+
+    def take_remaining(self):
+        """
+        Returns the bytes that weren't parsed yet and empties the decoder, used when switching message format
+        """
+        remaining = bytes(self._buffer[self._pos:])
+        self.reset()
+        return remaining
+
+    def reset(self):
+        self._buffer.clear()
+        self._pos = 0
+
+
+def build_compact_message(cmd, data):
+    """
+    Gets command name (str) and data field (str) and creates a compact protocol message
+    Returns: bytes, or None if error occured
+    """
+    opcode = COMMAND_OPCODES.get(cmd)
+    if opcode is None:
+        return None
+    encoded_data = data.encode()
+    if len(encoded_data) > COMPACT_MAX_DATA_LENGTH:
+        return None
+    return COMPACT_HEADER.pack(opcode, len(encoded_data)) + encoded_data
+
+
+def build_frame(cmd, data, message_format=TEXT_FORMAT):
+    """
+    Creates the encoded message to send in the given message format
+    Returns: bytes, or None if error occured
+    """
+    if message_format == COMPACT_FORMAT:
+        return build_compact_message(cmd, data)
+    full_msg = build_message(cmd, data)
+    if full_msg is None:
+        return None
+    return full_msg.encode()
+
+
+def build_frame_header(cmd, char_count, byte_count, message_format=TEXT_FORMAT):
+    """
+    Creates the encoded header of a message whose data is encoded separately, so data shared by many
+    messages is encoded only once. The text format counts the data in characters, the compact one in bytes.
+    Returns: bytes, or None if error occured
+    """
+    if message_format == COMPACT_FORMAT:
+        opcode = COMMAND_OPCODES.get(cmd)
+        if opcode is None or byte_count > COMPACT_MAX_DATA_LENGTH:
+            return None
+        return COMPACT_HEADER.pack(opcode, byte_count)
+    padded_cmd = PADDED_COMMANDS.get(cmd)
+    if padded_cmd is None or char_count > MAX_DATA_LENGTH:
+        return None
+    return f"{padded_cmd}|{char_count:04d}|".encode()
+
+
+class CompactMessageDecoder(MessageDecoder):
+    """
+    Incremental decoder of compact messages, see MessageDecoder
+    """
+
+    def __init__(self, max_data_length=COMPACT_MAX_DATA_LENGTH):
+        """
+        :param max_data_length: max bytes of the data of a message, a longer one is a broken frame. It's found from
+        the header, so the data of a message that is too long is never buffered.
+        """
+        super().__init__()
+        self.max_data_length = max_data_length
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        messages = []
+        pos = self._pos
+        with memoryview(buffer) as view:
+            while len(buffer) - pos >= COMPACT_HEADER.size:
+                opcode, data_length = COMPACT_HEADER.unpack_from(buffer, pos)
+                cmd = OPCODE_COMMANDS.get(opcode)
+                if cmd is None or data_length > self.max_data_length:
+                    messages.append((None, None))
+                    break
+                frame_end = pos + COMPACT_HEADER.size + data_length
+                if frame_end > len(buffer):
+                    break
+                try:
+                    msg = str(view[pos + COMPACT_HEADER.size:frame_end], "utf-8")
+                except UnicodeDecodeError:
+                    messages.append((None, None))
+                    break
+                pos = frame_end
+                messages.append((cmd, msg))
+                if cmd in FORMAT_SWITCH_COMMANDS:
+                    break
+        self._pos = pos
+        if messages and messages[-1][0] is None:
+            self.reset()
+        elif self._pos:
+            del buffer[:self._pos]
+            self._pos = 0
+        return messages
+
+
+def make_decoder(message_format=TEXT_FORMAT, max_data_length=COMPACT_MAX_DATA_LENGTH):
+    """
+    :param max_data_length: see CompactMessageDecoder, text messages are limited by their length field
+    Returns: a new decoder of the given message format
+    """
+    if message_format == COMPACT_FORMAT:
+        return CompactMessageDecoder(max_data_length)
+    return MessageDecoder()
+
+
 def split_data(msg, expected_fields):
     if not type(msg) == str:
         raise ValueError("msg must be a string")
@@ -106,3 +371,37 @@ def join_data(msg_fields):
     if not type(msg_fields) == list:
         raise ValueError("msg_fields must be a list")
     return "#".join(msg_fields)
+
+
+def join_records(records):
+    """
+    Helper method. Gets a list of records, each one a list of fields, and joins them to the data of a batch message.
+    Returns: string that looks like cell1#cell2\ncell1#cell2
+    """
+    if not type(records) == list:
+        raise ValueError("records must be a list")
+    return RECORD_DELIMITER.join(join_data(record) for record in records)
+
+
+def split_records(msg, expected_fields=None):
+    """
+    Helper method. Splits the data of a batch message to its records and every record to its fields.
+    expected_fields is checked like in split_data, unless it's None.
+    Returns: list of records, where a record that doesn't have the expected number of fields is [None]
+    """
+    if not type(msg) == str:
+        raise ValueError("msg must be a string")
+    if not msg:
+        return []
+    if expected_fields is None:
+        return [record.split(DATA_DELIMITER) for record in msg.split(RECORD_DELIMITER)]
+    return [split_data(record, expected_fields) for record in msg.split(RECORD_DELIMITER)]
+
+
+def is_valid_username(username):
+    """
+    Helper method. Checks a username a user chose to sign up with: letters and digits only, so it never holds a
+    delimiter, and MIN_USERNAME_LENGTH to MAX_USERNAME_LENGTH characters long.
+    Returns: True if the username can be used
+    """
+    return username.isalnum() and MIN_USERNAME_LENGTH <= len(username) <= MAX_USERNAME_LENGTH
@@ -1,9 +1,33 @@
 import socket
 import chatlib  # To use chatlib functions or consts, use chatlib.****
 import hashlib
+import queue
+import threading
 
 SERVER_IP = "127.0.0.1"  # Our server will run on same computer as client
 SERVER_PORT = 5678
+MESSAGE_FORMAT = chatlib.TEXT_FORMAT  # chatlib.COMPACT_FORMAT to negotiate compact messages with the server
+RECV_BUFFER_SIZE = 4096
+QUESTIONS_BATCH_SIZE = 5  # questions played in one round of the batch game
+HIGHSCORE_PAGE_SIZE = 10  # players shown on a page of the high scores
+HEARTBEAT_INTERVAL = 60  # seconds between the PINGs keeping the connection from timing out while the user thinks
+message_decoders = {}  # socket -> chatlib.MessageDecoder
+message_formats = {}  # socket -> negotiated message format, if it isn't chatlib.TEXT_FORMAT
+received_messages = {}  # socket -> list of messages which were parsed but not returned yet
+receivers = {}  # socket -> MessageReceiver receiving its messages on a background thread
+room_events = queue.Queue()  # (code, data) of the room messages pushed by the server, for play_room
+ROOM_PUSHES = frozenset(chatlib.PROTOCOL_SERVER[name] for name in ("room_state", "room_question", "room_results",
+                                                                   "room_over"))
+ROOM_POLL_INTERVAL = 1  # seconds between checks of the connection while waiting for a room message
+ROOM_WAIT_PROMPT_INTERVAL = 30  # seconds of waiting for a room's players before the user can choose to leave
+SUBSCRIBED_TOPICS = "highscore#logged#score"  # live updates the user can turn on
+resume_token = None  # token of the last login, to log in again with if the connection is lost
+
+
+class ConnectionLost(ConnectionError):
+    """
+    Raised by build_send_recv_parse when the connection closed before the reply came
+    """
 
 
 # HELPER SOCKET METHODS
@@ -15,8 +39,7 @@ def build_and_send_message(conn: socket.socket, code: str, data: str):
     Paramaters: conn (socket object), code (str), data (str)
     Returns: Nothing
     """
-    full_msg = chatlib.build_message(code, data)
-    conn.send(full_msg.encode())
+    conn.sendall(chatlib.build_frame(code, data, message_formats.get(conn, chatlib.TEXT_FORMAT)))
 
 
 def recv_message_and_parse(conn: socket.socket):
@@ -27,9 +50,120 @@ def recv_message_and_parse(conn: socket.socket):
     Returns: cmd (str) and data (str) of the received message.
     If error occured, will return None, None
     """
-    full_msg = conn.recv(1024).decode()
-    cmd, data = chatlib.parse_message(full_msg)
-    return cmd, data
+    pending = received_messages.setdefault(conn, [])
+    decoder = message_decoders.get(conn)
+    if decoder is None:
+        decoder = message_decoders[conn] = chatlib.make_decoder(message_formats.get(conn, chatlib.TEXT_FORMAT))
+    while not pending:
+        received = conn.recv(RECV_BUFFER_SIZE)
+        if not received:
+            return None, None
+        pending.extend(decoder.feed(received))
+    return pending.pop(0)
+
+
+def negotiate_message_format(conn: socket.socket, message_format: str):
+    """
+    Asks the server to switch the connection to another message format (see chatlib.MESSAGE_FORMATS)
+    :return: True if the server agreed and the connection was switched
+    """
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["protocol"], message_format)
+    if code != chatlib.PROTOCOL_SERVER["protocol_ok"]:
+        return False
+    message_formats[conn] = message_format
+    old_decoder = message_decoders[conn]
+    message_decoders[conn] = chatlib.make_decoder(message_format)
+    received_messages[conn].extend(message_decoders[conn].feed(old_decoder.take_remaining()))
+    return True
+
+
+class MessageReceiver:
+    """
+    Receives the messages of a connection on a background thread, so the server can send messages at any time.
+    Pushes (chatlib.PUSH_COMMANDS) are passed to a handler as they arrive, and the other messages are the
+    replies of the requests. The server replies in the order the requests were sent, so the replies are
+    matched to the requests in order.
+    """
+
+    def __init__(self, conn: socket.socket, on_push):
+        """
+        :param on_push: function called with the code and data of every push, on the receiver thread.
+        It's called with None, None when the connection is closed.
+        """
+        self.conn = conn
+        self.on_push = on_push
+        self.replies = queue.Queue()
+        self.closed = False
+        self._requests_lock = threading.Lock()  # a request waits for its reply before the next one is sent
+        self._stopped = threading.Event()  # set when the connection is closed
+        self._thread = threading.Thread(target=self._receive_loop, name="receiver", daemon=True)
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="heartbeat", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._heartbeat_thread.start()
+
+    def _receive_loop(self):
+        try:
+            while True:
+                code, data = recv_message_and_parse(self.conn)
+                if code is None:
+                    break
+                if code in chatlib.PUSH_COMMANDS:
+                    self.on_push(code, data)
+                else:
+                    self.replies.put((code, data))
+        except OSError:
+            pass
+        self.closed = True
+        self._stopped.set()
+        self.replies.put((None, None))
+        self.on_push(None, None)
+
+    def _heartbeat_loop(self):
+        """
+        Sends a PING every HEARTBEAT_INTERVAL seconds, so the server doesn't disconnect a logged in user who
+        takes long to choose an action or an answer
+        """
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            code, data = self.request(chatlib.PROTOCOL_CLIENT["heartbeat"], "")
+            if code is None:
+                break
+
+    def request(self, code: str, data: str):
+        """
+        Sends a request and waits for its reply
+        :return: code and data of the reply, None, None if the connection was closed
+        """
+        with self._requests_lock:
+            if self.closed:
+                return None, None
+            try:
+                build_and_send_message(self.conn, code, data)
+            except OSError:
+                return None, None  # closed, the receiver thread finds out too
+            return self.replies.get()
+
+
+def start_receiver(conn: socket.socket, on_push):
+    """
+    Receives the messages of a connection on a background thread from now on, see MessageReceiver.
+    A message format must be negotiated before.
+    """
+    receivers[conn] = MessageReceiver(conn, on_push)
+    receivers[conn].start()
+
+
+def disconnect(conn: socket.socket):
+    """
+    Closes a connection and drops the messages received on it
+    :param conn: A connection socket of the client with the server.
+    """
+    receivers.pop(conn, None)
+    message_decoders.pop(conn, None)
+    message_formats.pop(conn, None)
+    received_messages.pop(conn, None)
+    conn.close()
 
 
 def build_send_recv_parse(conn: socket.socket, code: str, data: str):
@@ -39,7 +173,14 @@ def build_send_recv_parse(conn: socket.socket, code: str, data: str):
     :param code: A string which indicates of what function the server should use
     :param data: relevant data to bo joined with the request. May be an empty string
     :return: Returned a parsed response of the server containing code and data
+    :raise ConnectionLost: if the connection has a MessageReceiver and was closed
     """
+    receiver = receivers.get(conn)
+    if receiver is not None:
+        code, data = receiver.request(code, data)
+        if code is None:
+            raise ConnectionLost()
+        return code, data
     build_and_send_message(conn, code, data)
     return recv_message_and_parse(conn)
 
@@ -67,6 +208,44 @@ def get_highscore(conn: socket.socket):
         error_and_exit(code)
 
 
+def get_highscore_page(conn: socket.socket, window: str, start: str):
+    """
+    Prints a page of the high scores of all the time, today or this week
+    :param conn: A connection socket of the client with the server.
+    :param window: one of chatlib.HIGHSCORE_WINDOWS
+    :param start: position of the first player of the page from 0, or chatlib.AROUND_ME for the page around the user
+    """
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["highscore_page"],
+                                       chatlib.join_data([window, start, str(HIGHSCORE_PAGE_SIZE)]))
+    if code != chatlib.PROTOCOL_SERVER["highscore_page"]:
+        print(data)
+        return
+    records = chatlib.split_records(data)
+    window, total, rank = records[0]
+    print("High scores (" + window + "), " + total + " players, your rank: " + (rank or "none"))
+    for place, username, score in records[1:]:
+        print(place + ". " + username + ": " + score)
+
+
+def ask_highscore_page(conn: socket.socket):
+    """
+    Asks the user which page of which high scores to show, and shows it
+    """
+    window = input("Which high scores? (" + "/".join(chatlib.HIGHSCORE_WINDOWS) + ")\n")
+    if window not in chatlib.HIGHSCORE_WINDOWS:
+        print("Invalid choice")
+        return
+    start = input("From which place? (a number, or Enter for the players around you)\n")
+    if not start:
+        start = chatlib.AROUND_ME
+    elif start.isdigit() and int(start) > 0:
+        start = str(int(start) - 1)
+    else:
+        print("Invalid place")
+        return
+    get_highscore_page(conn, window, start)
+
+
 def play_question(conn):
     """
     Requesting a random questions from the server and play it to the user
@@ -75,6 +254,9 @@ def play_question(conn):
     question_id = -1
     while question_id == -1:
         code, question = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["question"], "")
+        if code == chatlib.PROTOCOL_SERVER["finished_game"]:
+            print("Well done, you've answered all the questions")
+            return
         if code == chatlib.PROTOCOL_SERVER["question"]:
             question = question.split("#")
             question_id = question[0]
@@ -108,6 +290,188 @@ def play_question(conn):
             continue
 
 
+def get_questions(conn: socket.socket, count: int):
+    """
+    Requesting a batch of questions in one message
+    :param conn: A connection socket of the client with the server.
+    :param count: number of questions requested, the server may send less
+    :return: list of questions, each one a list of question id, question text and answers.
+    An empty list if the user was asked all the questions
+    """
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["questions"], str(count))
+    if code == chatlib.PROTOCOL_SERVER["finished_game"]:
+        return []
+    if code != chatlib.PROTOCOL_SERVER["questions"]:
+        error_and_exit("Error occurred :" + str(code))
+    return chatlib.split_records(data)
+
+
+def send_answers(conn: socket.socket, answers: list):
+    """
+    Sending a batch of answers in one message
+    :param conn: A connection socket of the client with the server.
+    :param answers: list of (question id, text of the selected answer)
+    :return: list of (code, data) of the result of every answer, like the answer to a single SEND_ANSWER
+    """
+    records = [[question_id, hashlib.sha256(answer.encode()).hexdigest()] for question_id, answer in answers]
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["send_answers"], chatlib.join_records(records))
+    if code != chatlib.PROTOCOL_SERVER["answers_results"]:
+        error_and_exit("Error occurred :" + str(code))
+    return [(result[0], result[1] if len(result) > 1 else "") for result in chatlib.split_records(data)]
+
+
+def play_questions_batch(conn):
+    """
+    Playing a round of several questions, which are fetched together and answered together,
+    so the round takes two round trips to the server no matter how many questions it has
+    :param conn: A connection socket of the client with the server.
+    """
+    questions = get_questions(conn, QUESTIONS_BATCH_SIZE)
+    if not questions:
+        print("Well done, you've answered all the questions")
+        return
+    answers = []
+    for question in questions:
+        print(question[1] + "\n")
+        for i in range(2, len(question)):
+            print(str(i - 1) + ". " + question[i])
+        answer = input("Select your answer")
+        while not (answer.isdigit() and 1 <= int(answer) <= len(question) - 2):
+            answer = input("please enter a valid answer number")
+        answers.append((question[0], question[int(answer) + 1]))
+    for question, (code, correct_answer) in zip(questions, send_answers(conn, answers)):
+        if code == chatlib.PROTOCOL_SERVER["correct_answer"]:
+            print(question[1] + " - that's correct")
+        elif code == chatlib.PROTOCOL_SERVER["wrong_answer"]:
+            print(question[1] + " - wrong answer, correct answer is: " + correct_answer)
+        else:
+            print(question[1] + " - " + correct_answer)
+
+
+def print_room_scoreboard(records):
+    for record in records:
+        print(record[0] + ": " + record[1])
+
+
+def answer_room_question(conn, data):
+    """
+    Asks the user a question of the room's game and sends the answer. The result comes with everyone else's,
+    when the question ends.
+    :param data: data of the ROOM_QUESTION message
+    """
+    header, question = chatlib.split_records(data)
+    print("Question " + header[0] + " of " + header[1] + ", you have " + header[2] + " seconds to answer")
+    print(question[1] + "\n")
+    for i in range(2, len(question)):
+        print(str(i - 1) + ". " + question[i])
+    answer = input("Select your answer")
+    while not (answer.isdigit() and 1 <= int(answer) <= len(question) - 2):
+        answer = input("please enter a valid answer number")
+    answer_id = hashlib.sha256(question[int(answer) + 1].encode()).hexdigest()
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["send_answer"], question[0] + "#" + answer_id)
+    if code == chatlib.PROTOCOL_SERVER["answer_received"]:
+        print("Waiting for the other players...")
+    else:
+        print(data)
+
+
+def play_room(conn):
+    """
+    Joining a room and playing its game with the other players in it. The server pushes the room's
+    messages as the game goes on, and handle_push passes them here until the game is over. While the room
+    waits for its players, the user is asked every ROOM_WAIT_PROMPT_INTERVAL seconds whether to leave it.
+    :param conn: A connection socket of the client with the server, with a MessageReceiver.
+    """
+    name = input("Please enter the room name: \n")
+    players = input("Players to wait for, if you open the room (Enter for 2): \n")
+    if players:
+        name += "#" + players
+    clear_room_events()
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["join_room"], name)
+    if code != chatlib.PROTOCOL_SERVER["room_joined"]:
+        print(data)
+        return
+    started = False
+    code, data = wait_room_event(conn, ROOM_WAIT_PROMPT_INTERVAL)
+    while code != chatlib.PROTOCOL_SERVER["room_over"]:
+        if code is None:
+            if input("Still waiting for players, leave the room? (y/n)\n") == "y":
+                code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["leave_room"], "")
+                print("You left the room" if code == chatlib.PROTOCOL_SERVER["room_left"] else data)
+                return
+        elif code == chatlib.PROTOCOL_SERVER["room_state"]:
+            records = chatlib.split_records(data)
+            print("Room " + records[0][0] + ", " + str(len(records) - 1) + " of " + records[0][1] + " players")
+        elif code == chatlib.PROTOCOL_SERVER["room_question"]:
+            started = True
+            answer_room_question(conn, data)
+        elif code == chatlib.PROTOCOL_SERVER["room_results"]:
+            records = chatlib.split_records(data)
+            print("The correct answer is: " + records[0][1])
+            print_room_scoreboard(records[1:])
+        code, data = wait_room_event(conn, None if started else ROOM_WAIT_PROMPT_INTERVAL)
+    print("Game over")
+    print_room_scoreboard(chatlib.split_records(data)[1:])
+
+
+def clear_room_events():
+    """
+    Drops the room messages left from an earlier room, like the ones that came after its game was left
+    """
+    while True:
+        try:
+            room_events.get_nowait()
+        except queue.Empty:
+            return
+
+
+def wait_room_event(conn, timeout=None):
+    """
+    Waits for the next room message pushed by the server
+    :param conn: A connection socket of the client with the server, with a MessageReceiver.
+    :param timeout: about how many seconds to wait, None to wait until a message comes
+    :return: code and data of the message, None, None if the timeout passed first
+    :raise ConnectionLost: if the connection closed
+    """
+    waited = 0
+    while True:
+        try:
+            return room_events.get(timeout=ROOM_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+        if receivers[conn].closed:
+            raise ConnectionLost()
+        waited += ROOM_POLL_INTERVAL
+        if timeout is not None and waited >= timeout:
+            return None, None
+
+
+def handle_push(code, data):
+    """
+    Handles a message pushed by the server, on the receiver thread. The live updates the user subscribed to
+    are printed, and the room messages are passed to play_room. Other pushes, and the None, None of a closed
+    connection, are ignored: play_room finds out the connection closed from its MessageReceiver.
+    """
+    if code == chatlib.PROTOCOL_SERVER["highscore_push"]:
+        print("\nHigh scores changed:\n" + data)
+    elif code == chatlib.PROTOCOL_SERVER["logged_push"]:
+        print("\nLogged users: " + data)
+    elif code == chatlib.PROTOCOL_SERVER["score_push"]:
+        print("\nYour score is now " + data)
+    elif code in ROOM_PUSHES:
+        room_events.put((code, data))
+
+
+def subscribe(conn: socket.socket, topics: str):
+    """
+    Asks the server to push the changes of the given topics (see chatlib.PUSH_TOPICS), instead of polling
+    for them. An empty string turns the pushes off.
+    """
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["subscribe"], topics)
+    if code != chatlib.PROTOCOL_SERVER["subscribed"]:
+        error_and_exit("error subscribing to live updates")
+
+
 def connect():
     """
     Establishing a connection with the server
@@ -118,6 +482,45 @@ def connect():
     return client_socket
 
 
+def open_session():
+    """
+    Connects to the server and switches to the message format of the client
+    :return: A socket of the established connection between the client and server.
+    """
+    conn = connect()
+    if MESSAGE_FORMAT != chatlib.TEXT_FORMAT and not negotiate_message_format(conn, MESSAGE_FORMAT):
+        print("The server doesn't support " + MESSAGE_FORMAT + " messages, using text messages")
+    start_receiver(conn, handle_push)
+    return conn
+
+
+def reconnect(conn: socket.socket):
+    """
+    Connects to the server again after the connection was lost. The session is resumed with the token of the
+    last login, and the user is asked to log in if the server doesn't know the token anymore.
+    :return: the new connection
+    """
+    disconnect(conn)
+    conn = open_session()
+    if resume(conn):
+        print("Session resumed")
+    else:
+        conn = auth_user(conn)
+    return conn
+
+
+def reopen_if_closed(conn: socket.socket):
+    """
+    The server closes a connection that doesn't log in within its login timeout, so a new one is opened if the
+    user took longer than that to type their details
+    :return: the connection, or the new one
+    """
+    if not receivers[conn].closed:
+        return conn
+    disconnect(conn)
+    return open_session()
+
+
 def error_and_exit(error_msg):
     """
     Triggered when an error occurred. An error message is printed and the client's execution stops.
@@ -131,15 +534,16 @@ def auth_user(conn: socket.socket):
     """
     Allowing the user to authenticate to the software by signing in or signing up.
     :param conn:  A connection socket of the client with the server.
+    :return: the connection, a new one if it was opened again meanwhile
     """
     action = input("Please enter your choice:\n"
                    "l               Login\n"
                    "s               Sign Up\n"
                    "q               Quit\n")
     if action == "l":
-        login(conn)
+        return login(conn)
     elif action == "s":
-        signup(conn)
+        return signup(conn)
     else:
         exit()
 
@@ -148,15 +552,37 @@ def login(conn):
     """
     Signing in a user to the game
     :param conn:   A connection socket of the client with the server.
+    :return: the connection, a new one if it was opened again meanwhile
     """
+    global resume_token
     cmd = ""
     while cmd != chatlib.PROTOCOL_SERVER["login_ok_msg"]:
         username = input("Please enter username: \n")
         password = input("Please enter password: \n")
-        build_and_send_message(conn, chatlib.PROTOCOL_CLIENT["login_msg"], username + "#" + password)
-        cmd, data = recv_message_and_parse(conn)
-        print(data)
+        conn = reopen_if_closed(conn)
+        cmd, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["login_msg"], username + "#" + password)
+        if cmd != chatlib.PROTOCOL_SERVER["login_ok_msg"]:
+            print(data)
+    resume_token = data
     print("Login success")
+    return conn
+
+
+def resume(conn: socket.socket):
+    """
+    Logs in again with the token of the last login instead of the username and password
+    :param conn: A connection socket of the client with the server.
+    :return: True if the session was resumed
+    """
+    global resume_token
+    if resume_token is None:
+        return False
+    code, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["resume"], resume_token)
+    resume_token = None  # replaced by the one the server sends, or of no use anymore
+    if code != chatlib.PROTOCOL_SERVER["login_ok_msg"]:
+        return False
+    resume_token = data
+    return True
 
 
 def logout(conn):
@@ -173,6 +599,7 @@ def signup(conn: socket.socket):
     Signing up a user to the game
     :param conn:   A connection socket of the client with the server.
     :param conn: A connection socket of the client with the server.
+    :return: the connection, a new one if it was opened again meanwhile
     """
     cmd = ""
     while cmd != chatlib.PROTOCOL_SERVER["signup_ok_msg"]:
@@ -183,9 +610,10 @@ def signup(conn: socket.socket):
                 is_valid = True
             else:
                 print("User can contain only letters and digits")
-            if not len(username) >= 4:
+            if not chatlib.MIN_USERNAME_LENGTH <= len(username) <= chatlib.MAX_USERNAME_LENGTH:
                 is_valid = False
-                print("User must contains at least 4 characters")
+                print("User must contains " + str(chatlib.MIN_USERNAME_LENGTH) + " to "
+                      + str(chatlib.MAX_USERNAME_LENGTH) + " characters")
         is_valid = False
         while not is_valid:
             password = input("enter password\n")
@@ -196,8 +624,10 @@ def signup(conn: socket.socket):
             if not password.isalnum():
                 is_valid = False
                 print("Password can contain only letters and digits")
+        conn = reopen_if_closed(conn)
         cmd, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT["signup_msg"], username + "#" + password)
         print(data)
+    return conn
 
 
 def get_logged_users(conn: socket.socket):
@@ -214,28 +644,49 @@ def get_logged_users(conn: socket.socket):
 
 def main():
     try:
-        conn = connect()
-        auth_user(conn)
+        conn = open_session()
+        conn = auth_user(conn)
+        subscribed = False
         while True:
+            if receivers[conn].closed:
+                print("Connection lost, reconnecting")
+                conn = reconnect(conn)
+                subscribed = False
             action = input("Please enter your choice:\n"
                            "s               Get my score\n"
                            "h               Get high score\n"
+                           "t               Get the high scores of today, this week or all time, page by page\n"
                            "p               Play a trivia question\n"
+                           "b               Play a batch of trivia questions\n"
+                           "r               Play in a room with other players\n"
+                           "u               Turn live updates " + ("off" if subscribed else "on") + "\n"
                            "l               Get logged users\n"
                            "q               Quit\n")
 
-            if action == "s":
-                get_score(conn)
-            elif action == "p":
-                play_question(conn)
-            elif action == "h":
-                get_highscore(conn)
-            elif action == "l":
-                get_logged_users(conn)
-            elif action == "q":
-                break
-            else:
-                print("Invalid choice please press one of the keys above")
+            try:
+                if action == "s":
+                    get_score(conn)
+                elif action == "p":
+                    play_question(conn)
+                elif action == "b":
+                    play_questions_batch(conn)
+                elif action == "r":
+                    play_room(conn)
+                elif action == "u":
+                    subscribed = not subscribed
+                    subscribe(conn, SUBSCRIBED_TOPICS if subscribed else "")
+                elif action == "h":
+                    get_highscore(conn)
+                elif action == "t":
+                    ask_highscore_page(conn)
+                elif action == "l":
+                    get_logged_users(conn)
+                elif action == "q":
+                    break
+                else:
+                    print("Invalid choice please press one of the keys above")
+            except ConnectionLost:
+                print("The connection with the server was lost")
         logout(conn)
         conn.close()
     except Exception as ex:
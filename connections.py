@@ -0,0 +1,205 @@
+##############################################################################
+# connections.py
+##############################################################################
+
+import heapq
+import itertools
+
+MAX_CONNECTIONS = 10000
+LOGIN_TIMEOUT = 30  # seconds a new connection has to log in
+IDLE_TIMEOUT = 300  # seconds a logged in client may send nothing (not even a PING) before it's disconnected
+OUTGOING_PAUSE_BYTES = 256 * 1024  # unsent bytes of a client above which its requests aren't read
+MAX_OUTGOING_BYTES = 4 * 1024 * 1024  # unsent bytes of a client above which it's disconnected as too slow
+READ_RATE = 100  # messages per second a client may send on average
+READ_BURST = 200  # messages a client may send at once
+
+
+class DeadlineHeap:
+    """
+    Deadlines of keys (connections, rooms) in a heap, so finding the expired ones doesn't scan every key.
+    Moving a deadline later only changes a dictionary entry. The heap keeps the old deadline, which is pushed
+    again with the current one when it comes up, so a busy connection costs a heap operation per timeout
+    at most, not per message. Moving a deadline earlier pushes a new entry, and the old one is dropped
+    when it comes up.
+    """
+
+    def __init__(self):
+        self._deadlines = {}  # key -> [its current deadline, sequence number of its live heap entry]
+        self._heap = []  # (deadline, sequence number, key), deadlines may be earlier than the current ones
+        self._sequence = itertools.count()  # breaks ties, since keys can't be compared
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _push(self, key, deadline):
+        sequence = next(self._sequence)
+        heapq.heappush(self._heap, (deadline, sequence, key))
+        return sequence
+
+    def set(self, key, deadline):
+        entry = self._deadlines.get(key)
+        if entry is None or deadline < entry[0]:
+            self._deadlines[key] = [deadline, self._push(key, deadline)]
+        else:
+            entry[0] = deadline
+
+    def remove(self, key):
+        self._deadlines.pop(key, None)  # its heap entry is dropped when it comes up
+
+    def next_deadline(self):
+        """
+        :return: the earliest deadline, or None if there are none. It may be earlier than the current one of its
+        key, which only makes the caller check again sooner.
+        """
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now):
+        """
+        Removes the keys whose deadline passed
+        :return: list of the keys
+        """
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, sequence, key = heapq.heappop(self._heap)
+            entry = self._deadlines.get(key)
+            if entry is None or entry[1] != sequence:
+                continue  # removed, or its deadline was moved earlier
+            if entry[0] > now:
+                entry[1] = self._push(key, entry[0])
+            else:
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+
+class TokenBucket:
+    """
+    Allows rate events per second on average, and bursts of up to burst events
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, amount, now):
+        """
+        Takes tokens for events that already happened
+        :return: seconds to wait before more events are allowed, 0 if they are allowed now
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - amount
+        self.updated = now
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class ConnectionManager:
+    """
+    Keeps the client connections within their limits: how many there are, how long they may stay idle, how much
+    output may wait for them and how fast they may send requests. The server asks it what to do, and the
+    connections are closed or paused by the server engines.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, login_timeout=LOGIN_TIMEOUT, idle_timeout=IDLE_TIMEOUT,
+                 read_rate=READ_RATE, read_burst=READ_BURST, outgoing_pause_bytes=OUTGOING_PAUSE_BYTES,
+                 max_outgoing_bytes=MAX_OUTGOING_BYTES):
+        self.max_connections = max_connections
+        self.login_timeout = login_timeout
+        self.idle_timeout = idle_timeout
+        self.read_rate = read_rate
+        self.read_burst = read_burst
+        self.outgoing_pause_bytes = outgoing_pause_bytes
+        self.max_outgoing_bytes = max_outgoing_bytes
+        self.connections = 0
+        self._timeouts = DeadlineHeap()
+        self._logged_in = set()  # connections the idle timeout applies to, instead of the login timeout
+        self._read_limits = {}  # connection -> TokenBucket of its requests
+        self._throttled = DeadlineHeap()  # connections whose reading is paused by the rate limit, until when
+        self.paused = set()  # connections which shouldn't be read from, by the rate limit or the output limit
+        self._output_paused = set()
+
+    def can_accept(self):
+        return self.connections < self.max_connections
+
+    def add(self, conn, now):
+        """
+        Starts managing a new connection, which has login_timeout seconds to log in
+        """
+        self.connections += 1
+        self._timeouts.set(conn, now + self.login_timeout)
+        self._read_limits[conn] = TokenBucket(self.read_rate, self.read_burst, now)
+
+    def remove(self, conn):
+        if self._read_limits.pop(conn, None) is None:
+            return
+        self.connections -= 1
+        self._timeouts.remove(conn)
+        self._throttled.remove(conn)
+        self._logged_in.discard(conn)
+        self.paused.discard(conn)
+        self._output_paused.discard(conn)
+
+    def logged_in(self, conn, now):
+        """
+        Replaces the login timeout of a connection with the idle timeout, which restarts whenever it sends something
+        """
+        if conn in self._read_limits:
+            self._logged_in.add(conn)
+            self._timeouts.set(conn, now + self.idle_timeout)
+
+    def received(self, conn, message_count, now):
+        """
+        Counts the requests of a connection against its rate limit, pausing it if it's over the limit, and restarts
+        its idle timeout
+        :return: seconds the connection is paused for, 0 if it isn't
+        """
+        bucket = self._read_limits.get(conn)
+        if bucket is None or not message_count:
+            return 0
+        wait = bucket.take(message_count, now)
+        if conn in self._logged_in:
+            self._timeouts.set(conn, now + wait + self.idle_timeout)  # it isn't idle while paused
+        if wait:
+            self._throttled.set(conn, now + wait)
+            self.paused.add(conn)
+        return wait
+
+    def resume_throttled(self, now):
+        """
+        Resumes reading from the connections whose rate limit pause ended
+        """
+        for conn in self._throttled.pop_expired(now):
+            if conn not in self._output_paused:
+                self.paused.discard(conn)
+
+    def next_resume(self):
+        """
+        :return: when resume_throttled should be called next, None if no connection is paused by the rate limit
+        """
+        return self._throttled.next_deadline()
+
+    def expired(self, now):
+        """
+        :return: list of the connections whose login or idle timeout passed, to be disconnected
+        """
+        return self._timeouts.pop_expired(now)
+
+    def output_changed(self, conn, outgoing_bytes):
+        """
+        Pauses reading from a connection while too much output waits for it, so a client that doesn't read
+        can't make the server build more
+        :return: False if the connection has more output waiting than allowed and should be disconnected
+        """
+        if outgoing_bytes > self.max_outgoing_bytes:
+            return False
+        if outgoing_bytes > self.outgoing_pause_bytes:
+            self._output_paused.add(conn)
+            self.paused.add(conn)
+        elif conn in self._output_paused:
+            self._output_paused.discard(conn)
+            if conn not in self._throttled:
+                self.paused.discard(conn)
+        return True
@@ -0,0 +1,76 @@
+##############################################################################
+# frame_cache.py
+##############################################################################
+
+import chatlib
+
+_static_frames = {}  # (command, message format) -> encoded frame of the command with no data
+
+
+def static_frame(cmd, message_format=chatlib.TEXT_FORMAT):
+    """
+    :return: the encoded frame of a reply without data (like LOGIN_OK), built on its first use only
+    """
+    frame = _static_frames.get((cmd, message_format))
+    if frame is None:
+        frame = _static_frames[cmd, message_format] = chatlib.build_frame(cmd, "", message_format)
+    return frame
+
+
+class CachedPayload:
+    """
+    A reply whose data is built from state that changes much less often than it is requested, like the
+    list of logged users. The data is rebuilt only when the version of that state changed since it was
+    last built, and until then every request shares the same encoded buffers.
+    """
+
+    def __init__(self, cmd, build_data, get_version):
+        """
+        :param build_data: function that returns the data of the reply (str)
+        :param get_version: function that returns the current version of the state the data is built from
+        """
+        self.cmd = cmd
+        self._build_data = build_data
+        self._get_version = get_version
+        self._version = None
+        self._data = ""
+        self._encoded_data = b""
+        self._frames = {}  # message format -> encoded frame of the data with no prefix
+
+    def _refresh(self):
+        version = self._get_version()
+        if version != self._version:
+            self._data = self._build_data()
+            self._encoded_data = self._data.encode()
+            self._frames = {}
+            self._version = version
+
+    @property
+    def version(self):
+        """
+        The current version of the state the data is built from
+        """
+        return self._get_version()
+
+    @property
+    def data(self):
+        self._refresh()
+        return self._data
+
+    def frame(self, message_format=chatlib.TEXT_FORMAT, prefix=""):
+        """
+        :param prefix: text put before the shared data for this request only, like the rank of the user
+        :return: the encoded frame of the reply, or None if it's too long for the message format
+        """
+        self._refresh()
+        if not prefix:
+            frame = self._frames.get(message_format)
+            if frame is None:
+                frame = self._frames[message_format] = chatlib.build_frame(self.cmd, self._data, message_format)
+            return frame
+        encoded_prefix = prefix.encode()
+        header = chatlib.build_frame_header(self.cmd, len(prefix) + len(self._data),
+                                            len(encoded_prefix) + len(self._encoded_data), message_format)
+        if header is None:
+            return None
+        return header + encoded_prefix + self._encoded_data
@@ -0,0 +1,386 @@
+##############################################################################
+# leaderboard.py
+##############################################################################
+
+import random
+
+MAX_LEVEL = 24  # Enough levels for ~16M users with p=0.5
+DAY = 24 * 60 * 60  # seconds
+WEEK = 7 * DAY
+WEEK_START = 4 * DAY  # weeks start on Monday, the epoch (January 1st 1970, 00:00 UTC) was a Thursday
+PERIODS = {"daily": (DAY, 0), "weekly": (WEEK, WEEK_START)}  # name -> (length, offset from the epoch) in seconds
+
+
+class _Node:
+    __slots__ = ("key", "value", "next", "width")
+
+    def __init__(self, key, value, level):
+        self.key = key
+        self.value = value
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class IndexableSkipList:
+    """
+    A sorted skip list that also stores the width (number of positions skipped) of every link,
+    so finding the position of a key and the key at a position are both O(log n).
+    Keys must be unique and comparable.
+    """
+
+    def __init__(self):
+        self._head = _Node(None, None, MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _random_level():
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    @classmethod
+    def from_sorted(cls, items):
+        """
+        Builds a list from (key, value) pairs sorted by key, in one pass instead of an insert per key
+        :raise ValueError: if the keys aren't sorted or aren't unique
+        """
+        skip_list = cls()
+        tails = [skip_list._head] * MAX_LEVEL  # last node of every level so far
+        tail_positions = [0] * MAX_LEVEL  # 1 based position of every tail, the head's is 0
+        position = 0
+        for key, value in items:
+            if position and not tails[0].key < key:
+                raise ValueError("keys aren't sorted")
+            position += 1
+            node = _Node(key, value, cls._random_level())
+            for level in range(len(node.next)):
+                tails[level].next[level] = node
+                tails[level].width[level] = position - tail_positions[level]
+                tails[level] = node
+                tail_positions[level] = position
+        for level in range(MAX_LEVEL):
+            tails[level].width[level] = position + 1 - tail_positions[level]  # the link to the end
+        skip_list._size = position
+        return skip_list
+
+    def insert(self, key, value=None):
+        """
+        Adds a key (and the value attached to it) to the list
+        """
+        chain = [None] * MAX_LEVEL
+        steps_at_level = [0] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        new_level = self._random_level()
+        new_node = _Node(key, value, new_level)
+        steps = 0
+        for level in range(new_level):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(new_level, MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """
+        Removes a key from the list. Raises KeyError if the key is not in the list
+        """
+        chain = [None] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key):
+        """
+        Returns the 0 based position of the key in the list. Raises KeyError if it is missing
+        """
+        node = self._head
+        position = 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        node = node.next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return position
+
+    def __getitem__(self, i):
+        """
+        Returns (key, value) at the given 0 based position
+        """
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+        node = self._head
+        i += 1
+        for level in reversed(range(MAX_LEVEL)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        return node.key, node.value
+
+    def items(self, start=0, stop=None):
+        """
+        Yields (key, value) pairs from position start (inclusive) to stop (exclusive)
+        """
+        if stop is None or stop > self._size:
+            stop = self._size
+        if start >= stop:
+            return
+        node = self._head
+        i = start + 1
+        for level in reversed(range(MAX_LEVEL)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        for _ in range(stop - start):
+            yield node.key, node.value
+            node = node.next[0]
+
+
+class Leaderboard:
+    """
+    Ranking of users ordered by score (high to low), ties broken by who got to the score first.
+    Replaces sorting the whole users collection on every HIGHSCORE request.
+    """
+
+    def __init__(self):
+        self._ranking = IndexableSkipList()
+        self._entries = {}  # user id -> (ranking key, username)
+        self.version = 0  # grows on every change, so views of the ranking know when to rebuild
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    @staticmethod
+    def _make_key(user_id, score, timestamp):
+        return -score, timestamp or 0, user_id
+
+    def update(self, user_id, username, score, timestamp):
+        """
+        Adds a user to the ranking or moves it to the place matching its new score
+        :return: True if the ranking changed
+        """
+        key = self._make_key(user_id, score, timestamp)
+        old_entry = self._entries.get(user_id)
+        if old_entry is not None:
+            if old_entry == (key, username):
+                return False
+            self._ranking.remove(old_entry[0])
+        self._ranking.insert(key, username)
+        self._entries[user_id] = (key, username)
+        self.version += 1
+        return True
+
+    def add(self, user_id, username, score, timestamp):
+        """
+        Ranks a user that isn't ranked yet. A user that is already ranked is left as it is.
+        :return: True if the user was added
+        """
+        if user_id in self._entries:
+            return False
+        return self.update(user_id, username, score, timestamp)
+
+    def remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._ranking.remove(entry[0])
+            self.version += 1
+
+    def rank(self, user_id):
+        """
+        :return: the 0 based position of the user in the ranking, or None if the user is not ranked
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        return self._ranking.index(entry[0])
+
+    def score(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        return -entry[0][0]
+
+    def top(self, count, start=0):
+        """
+        :return: a list of (username, score) of the users ranked from start to start + count
+        """
+        return [(username, -key[0]) for key, username in self._ranking.items(start, start + count)]
+
+    def load(self, records):
+        """
+        Ranks the users of records in rank order, like the ones of records(), without searching for the place
+        of every user. Used to restore an empty leaderboard.
+        :raise ValueError: if the leaderboard isn't empty or the records aren't in rank order
+        """
+        if self._entries:
+            raise ValueError("the leaderboard isn't empty")
+        entries = {}
+        pairs = []
+        for user_id, username, score, timestamp in records:
+            key = self._make_key(user_id, score, timestamp)
+            entries[user_id] = (key, username)
+            pairs.append((key, username))
+        if len(entries) != len(pairs):
+            raise ValueError("a user is ranked twice")
+        self._ranking = IndexableSkipList.from_sorted(pairs)
+        self._entries = entries
+        self.version += 1
+
+    def page(self, user_id, count, start=None):
+        """
+        A page of the ranking, found in O(log n) like top
+        :param start: 0 based position of the first user of the page, None for the page with the user in its middle
+        (the top if the user isn't ranked)
+        :return: (the number of users ranked, the user's 0 based position or None if it isn't ranked, the position of
+        the first user of the page, list of (username, score) of the page)
+        """
+        rank = self.rank(user_id)
+        if start is None:
+            start = max(0, min(rank - count // 2, len(self) - count)) if rank is not None else 0
+        return len(self), rank, start, self.top(count, start)
+
+    def reconcile(self, records, skip=()):
+        """
+        Brings the ranking in line with the store. Only entries that differ are touched.
+        :param records: iterable of (user_id, username, score, timestamp) of every user in the store
+        :param skip: container of user ids whose entries are newer than the store and are left as they are
+        :return: number of entries that were added, moved or removed
+        """
+        changed = 0
+        seen = set()
+        for user_id, username, score, timestamp in records:
+            seen.add(user_id)
+            if user_id not in skip and self.update(user_id, username, score, timestamp):
+                changed += 1
+        for user_id in [user_id for user_id in self._entries if user_id not in seen and user_id not in skip]:
+            self.remove(user_id)
+            changed += 1
+        return changed
+
+    def records(self):
+        """
+        :return: list of (user_id, username, score, timestamp) of every ranked user in rank order, as taken by
+        reconcile
+        """
+        return [(key[2], username, -key[0], key[1]) for key, username in self._ranking.items()]
+
+
+class PeriodLeaderboard(Leaderboard):
+    """
+    Ranking of the points users scored in the current period (a UTC day or week), updated as they score and
+    started over when the period ends
+    """
+
+    def __init__(self, length, offset=0):
+        super().__init__()
+        self.length = length
+        self.offset = offset
+        self.period_start = None
+
+    def start_of_period(self, now):
+        return (now - self.offset) // self.length * self.length + self.offset
+
+    def roll(self, now):
+        """
+        Starts the ranking over if its period ended
+        :param now: time.time()
+        :return: True if it was started over
+        """
+        period_start = self.start_of_period(now)
+        if self.period_start is not None and period_start <= self.period_start:
+            return False
+        self.period_start = period_start
+        if self._entries:
+            self._ranking = IndexableSkipList()
+            self._entries = {}
+            self.version += 1
+        return True
+
+    def add_points(self, user_id, username, points, now):
+        self.roll(now)
+        self.update(user_id, username, (self.score(user_id) or 0) + points, now)
+
+    def snapshot(self):
+        """
+        :return: [start of the period, records of the ranking], as taken by restore
+        """
+        return [self.period_start, self.records()]
+
+    def restore(self, snapshot, now):
+        """
+        Loads a ranking saved by snapshot, unless its period is over
+        :return: True if it was loaded
+        """
+        period_start, records = snapshot
+        if period_start != self.start_of_period(now):
+            return False
+        self.roll(now)
+        if self._entries:
+            return False  # scores of this period were already ranked, they'd be overwritten
+        self.load(records)
+        return True
+
+
+class PeriodLeaderboards:
+    """
+    The PeriodLeaderboard of every period of PERIODS by name, updated together
+    """
+
+    def __init__(self, periods=PERIODS):
+        self.periods = {name: PeriodLeaderboard(length, offset) for name, (length, offset) in periods.items()}
+
+    def __getitem__(self, name):
+        return self.periods[name]
+
+    def roll(self, now):
+        for ranking in self.periods.values():
+            ranking.roll(now)
+
+    def add_points(self, user_id, username, points, now):
+        for ranking in self.periods.values():
+            ranking.add_points(user_id, username, points, now)
+
+    def page(self, name, user_id, count, start=None):
+        """
+        See Leaderboard.page
+        """
+        return self.periods[name].page(user_id, count, start)
+
+    def snapshot(self):
+        return {name: ranking.snapshot() for name, ranking in self.periods.items()}
+
+    def restore(self, snapshot, now):
+        """
+        :return: number of periods whose ranking was loaded
+        """
+        return sum(1 for name, ranking_snapshot in snapshot.items()
+                   if name in self.periods and self.periods[name].restore(ranking_snapshot, now))
@@ -0,0 +1,286 @@
+##############################################################################
+# loadgen.py
+# Headless load generator. Simulated players sign up, log in, play questions and ask for the
+# high scores and logged users, and the throughput and latency of every command is reported.
+# Usage: python loadgen.py --players 2000 --concurrency 200 --spawn-server
+##############################################################################
+
+import argparse
+import hashlib
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import chatlib
+import client
+
+DEFAULT_PLAYERS = 1000
+DEFAULT_CONCURRENCY = 100  # players playing at the same time, one thread each
+DEFAULT_ROUNDS = 10  # questions every player plays
+HIGHSCORE_CHANCE = 0.1  # chance a player asks for the high scores after a question
+LOGGED_CHANCE = 0.1  # chance a player asks for the logged users after a question
+SCORE_CHANCE = 0.2  # chance a player asks for its score after a question
+SERVER_START_TIMEOUT = 30  # seconds to wait for a spawned server to accept connections
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyStats:
+    """
+    Latencies of the requests of all the players, by command
+    """
+
+    def __init__(self):
+        self._latencies = defaultdict(list)  # command -> list of seconds
+        self._errors = defaultdict(int)  # command -> number of ERROR answers and failed requests
+        self._pushes = defaultdict(int)  # command -> number of pushes received
+        self._lock = threading.Lock()
+
+    def record(self, cmd, seconds, error=False):
+        with self._lock:
+            self._latencies[cmd].append(seconds)
+            if error:
+                self._errors[cmd] += 1
+
+    def record_failure(self, cmd):
+        with self._lock:
+            self._errors[cmd] += 1
+
+    def record_push(self, cmd, data):
+        if cmd is not None:
+            with self._lock:
+                self._pushes[cmd] += 1
+
+    def report(self, elapsed):
+        """
+        :param elapsed: seconds the load ran
+        :return: table of the requests per second and latency percentiles of every command, and of all of them
+        """
+        header = "{:<16}{:>10}{:>10}".format("command", "requests", "req/s")
+        header += "".join("{:>10}".format("p" + str(p) + " ms") for p in PERCENTILES) + "{:>8}".format("errors")
+        lines = [header]
+        all_latencies = []
+        with self._lock:
+            for cmd in sorted(self._latencies):
+                latencies = sorted(self._latencies[cmd])
+                all_latencies.extend(latencies)
+                lines.append(self._format_line(cmd, latencies, self._errors[cmd], elapsed))
+            all_latencies.sort()
+            lines.append(self._format_line("total", all_latencies, sum(self._errors.values()), elapsed))
+            for cmd in sorted(self._pushes):
+                lines.append("{:<16}{:>10}{:>10.0f}".format(cmd, self._pushes[cmd], self._pushes[cmd] / elapsed))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_line(name, latencies, errors, elapsed):
+        line = "{:<16}{:>10}{:>10.0f}".format(name, len(latencies), len(latencies) / elapsed)
+        line += "".join("{:>10.2f}".format(percentile(latencies, p) * 1000) for p in PERCENTILES)
+        return line + "{:>8}".format(errors)
+
+
+def percentile(sorted_values, percent):
+    """
+    :return: the value below which the given percent of the sorted values are (nearest rank), 0 if there are none
+    """
+    if not sorted_values:
+        return 0
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+
+class Player:
+    """
+    A scripted player. It talks to the server with the helpers of client.py, the same messages the
+    interactive client sends, and times every request.
+    """
+
+    def __init__(self, number, stats: LatencyStats, args):
+        self.username = "player" + str(number)
+        self.password = "password" + str(number)
+        self.stats = stats
+        self.args = args
+        self.random = random.Random(number)
+        self.conn = None
+
+    def request(self, cmd, data=""):
+        """
+        Sends a request and waits for its answer, timing the round trip
+        :return: code and data of the answer
+        """
+        start = time.perf_counter()
+        try:
+            code, answer = client.build_send_recv_parse(self.conn, cmd, data)
+        except client.ConnectionLost:
+            code, answer = None, None  # with a MessageReceiver
+        if code is None:
+            self.stats.record_failure(cmd)
+            raise ConnectionError("the server closed the connection")
+        self.stats.record(cmd, time.perf_counter() - start, code == chatlib.PROTOCOL_SERVER["error_msg"])
+        return code, answer
+
+    def play(self):
+        """
+        Plays a whole session: connects, signs up (the user may exist from an earlier run), logs in,
+        plays the questions and logs out
+        """
+        self.conn = socket.create_connection((self.args.host, self.args.port))
+        try:
+            if self.args.compact:
+                client.negotiate_message_format(self.conn, chatlib.COMPACT_FORMAT)
+            if self.args.subscribe:
+                client.start_receiver(self.conn, self.stats.record_push)
+            self.request(chatlib.PROTOCOL_CLIENT["signup_msg"], self.username + "#" + self.password)
+            code, answer = self.request(chatlib.PROTOCOL_CLIENT["login_msg"], self.username + "#" + self.password)
+            if code != chatlib.PROTOCOL_SERVER["login_ok_msg"]:
+                return
+            if self.args.subscribe:
+                self.request(chatlib.PROTOCOL_CLIENT["subscribe"], "highscore#logged")
+            rounds = 0
+            while rounds < self.args.rounds:
+                played = self.play_batch() if self.args.batch > 1 else self.play_question()
+                if not played:
+                    break  # the player was asked all the questions
+                rounds += played
+                self.browse()
+            client.build_and_send_message(self.conn, chatlib.PROTOCOL_CLIENT["logout_msg"], "")
+        finally:
+            client.disconnect(self.conn)
+
+    def choose_answer(self, question):
+        """
+        :return: question id and digest of a random answer of a question, as split from its message
+        """
+        return [question[0], hashlib.sha256(self.random.choice(question[2:]).encode()).hexdigest()]
+
+    def play_question(self):
+        """
+        :return: number of questions played, 0 if there are no more questions
+        """
+        code, question = self.request(chatlib.PROTOCOL_CLIENT["question"])
+        if code != chatlib.PROTOCOL_SERVER["question"]:
+            return 0
+        self.request(chatlib.PROTOCOL_CLIENT["send_answer"], chatlib.join_data(self.choose_answer(question.split("#"))))
+        return 1
+
+    def play_batch(self):
+        """
+        Plays a batch of questions with GET_QUESTIONS and SEND_ANSWERS
+        :return: number of questions played, 0 if there are no more questions
+        """
+        count = min(self.args.batch, self.args.rounds)
+        code, data = self.request(chatlib.PROTOCOL_CLIENT["questions"], str(count))
+        if code != chatlib.PROTOCOL_SERVER["questions"]:
+            return 0
+        questions = chatlib.split_records(data)
+        answers = [self.choose_answer(question) for question in questions]
+        self.request(chatlib.PROTOCOL_CLIENT["send_answers"], chatlib.join_records(answers))
+        return len(questions)
+
+    def browse(self):
+        """
+        Asks for the other information players look at between questions, at random. Subscribed players
+        get the high scores and the logged users pushed instead.
+        """
+        if self.random.random() < HIGHSCORE_CHANCE and not self.args.subscribe:
+            self.request(chatlib.PROTOCOL_CLIENT["highscore"])
+        if self.random.random() < LOGGED_CHANCE and not self.args.subscribe:
+            self.request(chatlib.PROTOCOL_CLIENT["logged_users"])
+        if self.random.random() < SCORE_CHANCE:
+            self.request(chatlib.PROTOCOL_CLIENT["user_score"])
+
+
+def run_player(number, stats, args):
+    try:
+        Player(number, stats, args).play()
+        return True
+    except OSError as err:
+        print("player " + str(number) + " failed:", err)
+        return False
+
+
+def spawn_server(args, directory):
+    """
+    Starts a server on a local SQLite database, so no remote storage is involved, and waits until it accepts
+    connections. Its question bank is kept in the temporary directory too and it takes no snapshots, so the run
+    leaves nothing behind and doesn't start from an earlier run's state. Its output is discarded, since printing
+    every message would be most of its work.
+    :return: the server process
+    """
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+               "--port", str(args.port), "--storage", "sqlite",
+               "--storage-location", os.path.join(directory, "loadgen.db"),
+               "--questions-file", os.path.join(directory, "questions.jsonl"),
+               "--snapshot-file", ""] + shlex.split(args.server_args)
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("the server exited with code " + str(server.returncode))
+        try:
+            socket.create_connection((args.host, args.port)).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("the server didn't start in " + str(SERVER_START_TIMEOUT) + " seconds")
+
+
+def run_load(args):
+    """
+    Runs all the players, at most args.concurrency at a time, and prints the report
+    """
+    stats = LatencyStats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(lambda number: run_player(number, stats, args), range(args.players)))
+    elapsed = time.perf_counter() - start
+    print(str(results.count(True)) + " of " + str(args.players) + " players finished in " +
+          str(round(elapsed, 2)) + " seconds")
+    print(stats.report(elapsed))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Load generator and benchmark of the trivia server")
+    parser.add_argument("--host", default=client.SERVER_IP)
+    parser.add_argument("--port", type=int, default=client.SERVER_PORT)
+    parser.add_argument("--players", type=int, default=DEFAULT_PLAYERS, help="default: %(default)s")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="players playing at the same time (default: %(default)s)")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS,
+                        help="questions every player plays (default: %(default)s)")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="questions fetched and answered per request, with GET_QUESTIONS and SEND_ANSWERS "
+                             "when more than 1 (default: %(default)s)")
+    parser.add_argument("--compact", action="store_true", help="negotiate compact messages")
+    parser.add_argument("--subscribe", action="store_true",
+                        help="subscribe to pushes of the high scores and the logged users instead of polling them")
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="start a server on a temporary SQLite database for the run")
+    parser.add_argument("--server-args", default="",
+                        help="more arguments for the spawned server, like \"--engine asyncio --questions-source "
+                             "questions.json\"")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if not args.spawn_server:
+        run_load(args)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        server = spawn_server(args, directory)
+        try:
+            run_load(args)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+##############################################################################
+# metrics.py
+##############################################################################
+
+import bisect
+import math
+import time
+from collections import defaultdict
+
+# Upper bounds (seconds) of the latency histogram buckets. Latencies above the last one go to an extra bucket.
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5)
+REPORT_PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in fixed buckets, so recording a latency is a binary search and an increment.
+    Percentiles are estimated as the upper bound of the bucket they fall in.
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """
+        :return: estimate of the latency (seconds) below which the given percent of the latencies are
+        """
+        rank = math.ceil(self.count * percent / 100)
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank and cumulative:
+                if index == len(LATENCY_BUCKETS):
+                    return self.max
+                return min(LATENCY_BUCKETS[index], self.max)
+        return 0.0
+
+
+class Metrics:
+    """
+    Counters, latency histograms and gauges of the server. Counters and histograms are updated on the
+    event loop thread as things happen. Gauges are functions which are only called when a report is made.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(LatencyHistogram)
+        self._gauges = {}  # name -> function returning the current value
+        self._started = time.monotonic()
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, seconds):
+        self.histograms[name].observe(seconds)
+
+    def add_gauge(self, name, read):
+        self._gauges[name] = read
+
+    def report(self):
+        """
+        :return: all the metrics as text, a "name value" line for every number. Latencies are in milliseconds
+        """
+        lines = ["uptime_seconds " + str(round(time.monotonic() - self._started))]
+        for name in sorted(self._gauges):
+            lines.append(name + " " + str(self._gauges[name]()))
+        for name in sorted(self.counters):
+            lines.append(name + " " + str(self.counters[name]))
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            lines.append(name + ".count " + str(histogram.count))
+            if histogram.count:
+                lines.append(name + ".mean_ms " + str(round(histogram.total / histogram.count * 1000, 3)))
+            for percent in REPORT_PERCENTILES:
+                lines.append(name + ".p" + str(percent) + "_ms " + str(round(histogram.percentile(percent) * 1000, 3)))
+            lines.append(name + ".max_ms " + str(round(histogram.max * 1000, 3)))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,50 @@
+##############################################################################
+# passwords.py
+##############################################################################
+
+import hashlib
+import hmac
+import os
+
+HASH_ALGORITHM = "pbkdf2_sha256"
+HASH_ITERATIONS = 600000  # OWASP's recommendation for PBKDF2-HMAC-SHA256
+SALT_SIZE = 16  # bytes
+
+
+def hash_password(password, iterations=HASH_ITERATIONS):
+    """
+    Hashes a password with a new random salt. Slow on purpose, so it's meant to run off the event loop.
+    :return: the hash in the format pbkdf2_sha256$iterations$salt$hash (salt and hash in hex), which is saved
+    instead of the password
+    """
+    salt = os.urandom(SALT_SIZE)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return HASH_ALGORITHM + "$" + str(iterations) + "$" + salt.hex() + "$" + digest.hex()
+
+
+def is_password_hash(stored):
+    return stored.startswith(HASH_ALGORITHM + "$")
+
+
+def check_password(password, stored, iterations=HASH_ITERATIONS):
+    """
+    Checks a password against what is saved for the user. Records saved before passwords were hashed have the
+    password itself, those are compared as is.
+    :param iterations: iterations of the hashes made now, a hash with less is made again
+    :return: (whether the password is right, new hash to save instead of stored or None if stored is up to date)
+    """
+    if not is_password_hash(stored):
+        if not hmac.compare_digest(password.encode(), stored.encode()):
+            return False, None
+        return True, hash_password(password, iterations)
+    try:
+        algorithm, stored_iterations, salt, digest = stored.split("$")
+        digest = bytes.fromhex(digest)
+        computed = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(stored_iterations))
+    except ValueError:
+        return False, None
+    if not hmac.compare_digest(computed, digest):
+        return False, None
+    if int(stored_iterations) < iterations:
+        return True, hash_password(password, iterations)
+    return True, None
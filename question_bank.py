@@ -0,0 +1,145 @@
+##############################################################################
+# question_bank.py
+##############################################################################
+
+import hashlib
+import random
+import chatlib
+
+QUESTION_ID_LENGTH = 16  # hex digits of the question text digest used as its id
+
+
+class Question:
+    """
+    A trivia question with everything the server sends and checks about it computed once,
+    except the order of the answers which is drawn every time the question is sent
+    """
+    __slots__ = ("index", "question_id", "text", "correct_answer", "answers", "answer_digest", "_payload_prefix")
+
+    def __init__(self, index, raw_question: dict):
+        self.index = index
+        self.text = raw_question["question"]
+        self.question_id = make_question_id(self.text)
+        self.correct_answer = raw_question["correct_answer"]
+        self.answers = raw_question["incorrect_answers"] + [self.correct_answer]
+        self.answer_digest = hashlib.sha256(self.correct_answer.encode()).hexdigest()
+        self._payload_prefix = chatlib.join_data([self.question_id, self.text]) + chatlib.DATA_DELIMITER
+
+    def payload(self):
+        """
+        :return: the question as sent to a client: id, text and the answers in a new random order
+        """
+        return self._payload_prefix + chatlib.join_data(random.sample(self.answers, len(self.answers)))
+
+
+def make_question_id(question_text):
+    """
+    :return: id of a question, which stays the same across server restarts (unlike hash())
+    """
+    return hashlib.sha256(question_text.encode()).hexdigest()[:QUESTION_ID_LENGTH]
+
+
+class QuestionBank:
+    """
+    All the questions of the game, built once at startup. Questions are found by id with a dictionary lookup,
+    and every question also has an index, its position in the bank.
+    """
+
+    def __init__(self, raw_questions=()):
+        self._questions = []
+        self._by_id = {}
+        self.extend(raw_questions)
+
+    def __len__(self):
+        return len(self._questions)
+
+    def __getitem__(self, index):
+        return self._questions[index]
+
+    def extend(self, raw_questions):
+        """
+        Adds questions to the bank, skipping questions it already has
+        :param raw_questions: iterable of question dictionaries in the trivia API format, with unescaped text
+        :return: number of questions added
+        """
+        added = 0
+        for raw_question in raw_questions:
+            question = Question(len(self._questions), raw_question)
+            if question.question_id in self._by_id:
+                continue
+            self._questions.append(question)
+            self._by_id[question.question_id] = question
+            added += 1
+        return added
+
+    def get(self, question_id):
+        """
+        :return: the question with the given id, or None if there is no such question
+        """
+        return self._by_id.get(question_id)
+
+    def random_question(self):
+        return random.choice(self._questions)
+
+
+class QuestionDeck:
+    """
+    The questions a user wasn't asked yet, in random order, so drawing an unseen question is O(1).
+    The questions the user was asked are kept as a bitmap of bank indexes (bit i of byte i // 8),
+    which is what gets saved in the user's record.
+    """
+
+    def __init__(self, bank: QuestionBank, seen=b"", asked_ids=()):
+        """
+        :param seen: bitmap of the questions the user was asked
+        :param asked_ids: ids of questions the user was asked, from records saved before the bitmap was used
+        """
+        self.seen = bytearray(seen)
+        for question_id in asked_ids:
+            question = bank.get(question_id)
+            if question:
+                self.mark_seen(question.index)
+        self._bank_size = 0
+        self._unseen = []
+        self.add_new_questions(bank)
+
+    def is_seen(self, index):
+        byte = index >> 3
+        return byte < len(self.seen) and self.seen[byte] & (1 << (index & 7))
+
+    def mark_seen(self, index):
+        byte = index >> 3
+        if byte >= len(self.seen):
+            self.seen.extend(bytes(byte + 1 - len(self.seen)))
+        self.seen[byte] |= 1 << (index & 7)
+
+    def add_new_questions(self, bank: QuestionBank):
+        """
+        Shuffles the questions added to the bank since the deck was built into the deck
+        """
+        for index in range(self._bank_size, len(bank)):
+            if not self.is_seen(index):
+                self._unseen.append(index)
+                position = random.randrange(len(self._unseen))
+                self._unseen[position], self._unseen[-1] = self._unseen[-1], self._unseen[position]
+        self._bank_size = len(bank)
+
+    def __len__(self):
+        return len(self._unseen)
+
+    def peek(self):
+        """
+        :return: index in the bank of the question the next draw() takes, or None if the deck is empty
+        """
+        return self._unseen[-1] if self._unseen else None
+
+    def draw(self):
+        """
+        Takes the next unseen question out of the deck and marks it as seen
+        :return: index of the question in the bank, or None if the user was asked all the questions
+        """
+        if not self._unseen:
+            return None
+        index = self._unseen.pop()
+        self.mark_seen(index)
+        return index
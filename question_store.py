@@ -0,0 +1,173 @@
+##############################################################################
+# question_store.py
+##############################################################################
+
+import html
+import json
+import os
+from question_bank import make_question_id
+
+QUESTIONS_FILE = "questions.jsonl"
+OPENTDB_URL = "https://opentdb.com/api.php"
+REFILL_BATCH_SIZE = 50  # Max questions the trivia API returns in one request
+REFILL_INTERVAL = 60  # seconds between refills while they keep finding new questions
+MAX_REFILL_INTERVAL = 3600  # refills that find nothing new back off up to this interval
+MAX_BANK_SIZE = 10000  # no refills once the bank has this many questions
+
+
+def unescape_question(raw_question: dict):
+    """
+    :return: copy of a question of the trivia API with the HTML entities of its texts unescaped
+    """
+    return {
+        "question": html.unescape(raw_question["question"]),
+        "correct_answer": html.unescape(raw_question["correct_answer"]),
+        "incorrect_answers": [html.unescape(answer) for answer in raw_question["incorrect_answers"]],
+        "category": raw_question.get("category", ""),
+        "difficulty": raw_question.get("difficulty", ""),
+    }
+
+
+class OpenTdbFetcher:
+    """
+    Gets questions from the Open Trivia DB API. A fetcher is a callable that gets an amount of
+    questions and returns a list of unescaped question dictionaries.
+    """
+
+    def __init__(self, url=OPENTDB_URL, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, amount):
+        import requests
+        response = requests.get(self.url, params={"amount": amount, "type": "multiple"}, timeout=self.timeout)
+        response.raise_for_status()
+        return [unescape_question(question) for question in response.json()["results"]]
+
+
+class FileFetcher:
+    """
+    Gets questions from a local JSON file in the format of the trivia API response (or a plain list
+    of questions), used instead of the API in tests and benchmarks
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, amount):
+        with open(self.path, encoding="utf-8") as questions_file:
+            data = json.load(questions_file)
+        if isinstance(data, dict):
+            data = data["results"]
+        return [unescape_question(question) for question in data]
+
+
+class QuestionStore:
+    """
+    The question bank saved on local disk as JSON lines, one unescaped question per line, in bank order.
+    New questions are only appended, so the bank indexes of saved questions never change.
+    """
+
+    def __init__(self, path=QUESTIONS_FILE):
+        self.path = path
+        self._ids = set()
+        self._loaded_size = 0  # bytes of the file read by load
+
+    def load(self):
+        """
+        Reads the saved questions which weren't read by an earlier call, so a process that doesn't refill
+        the store can follow the questions another process appends.
+        :return: list of the questions. Lines that can't be read (like a line cut by a crash) are skipped
+        """
+        questions = []
+        if not self.has_unloaded():
+            return questions
+        with open(self.path, "rb") as questions_file:
+            questions_file.seek(self._loaded_size)
+            for line in questions_file:
+                if not line.endswith(b"\n"):
+                    break  # still being written, read it next time
+                self._loaded_size += len(line)
+                try:
+                    question = json.loads(line)
+                except ValueError:
+                    continue
+                question_id = make_question_id(question["question"])
+                if question_id not in self._ids:
+                    self._ids.add(question_id)
+                    questions.append(question)
+        return questions
+
+    def has_unloaded(self):
+        """
+        :return: True if the file has data load didn't read yet
+        """
+        return os.path.exists(self.path) and os.path.getsize(self.path) > self._loaded_size
+
+    def append_new(self, questions):
+        """
+        Saves the questions the store doesn't have yet
+        :return: list of the questions that were saved
+        """
+        new_questions = []
+        for question in questions:
+            question_id = make_question_id(question["question"])
+            if question_id not in self._ids:
+                self._ids.add(question_id)
+                new_questions.append(question)
+        if new_questions:
+            lines = "".join(json.dumps(question, ensure_ascii=False) + "\n" for question in new_questions)
+            with open(self.path, "a+b") as questions_file:
+                if questions_file.tell() and not self._ends_with_newline(questions_file):
+                    lines = "\n" + lines  # keep a line cut by a crash apart from the new ones
+                questions_file.write(lines.encode())
+                questions_file.flush()
+                os.fsync(questions_file.fileno())
+        return new_questions
+
+    @staticmethod
+    def _ends_with_newline(questions_file):
+        questions_file.seek(-1, os.SEEK_END)
+        return questions_file.read(1) == b"\n"
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class QuestionRefiller:
+    """
+    Grows the question store in batches. refill() does the blocking work and is meant to run on a worker thread,
+    while due() and finish() keep the schedule on the event loop thread.
+    """
+
+    def __init__(self, store: QuestionStore, fetcher, batch_size=REFILL_BATCH_SIZE, interval=REFILL_INTERVAL,
+                 max_size=MAX_BANK_SIZE):
+        self.store = store
+        self.fetcher = fetcher
+        self.batch_size = batch_size
+        self.base_interval = interval
+        self.interval = interval
+        self.max_size = max_size
+        self.running = False
+        self._next_refill = 0
+
+    def due(self, now):
+        return not self.running and len(self.store) < self.max_size and now >= self._next_refill
+
+    def refill(self):
+        """
+        Fetches a batch of questions and saves the new ones
+        :return: list of the new questions
+        """
+        return self.store.append_new(self.fetcher(self.batch_size))
+
+    def finish(self, now, new_questions):
+        """
+        Schedules the next refill, backing off while refills find nothing new
+        """
+        self.running = False
+        if new_questions:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.interval * 2, MAX_REFILL_INTERVAL)
+        self._next_refill = now + self.interval
@@ -0,0 +1,146 @@
+##############################################################################
+# rooms.py
+##############################################################################
+
+import random
+from connections import DeadlineHeap
+
+ROOM_SIZE = 2  # players a room waits for before its game starts, 2 is a head-to-head game
+MAX_ROOM_SIZE = 64  # players of the biggest tournament room
+MAX_ROOM_NAME_LENGTH = 32
+ROOM_QUESTIONS = 5  # questions of a room's game
+ANSWER_TIME = 15  # seconds the players of a room have to answer a question
+RESULTS_TIME = 3  # seconds between the results of a question and the next question
+
+# States of a room
+WAITING = "waiting"  # for players to join
+ASKING = "asking"  # a question, until every player answered it or its deadline passed
+SHOWING_RESULTS = "results"  # of the last question, until the next one is asked
+
+
+class RoomPlayer:
+    __slots__ = ("username", "points", "answered", "correct")
+
+    def __init__(self, username):
+        self.username = username
+        self.points = 0
+        self.answered = False  # whether the player answered the current question
+        self.correct = False  # whether that answer was correct
+
+
+class Room:
+    """
+    A game several players play together: every player gets the same questions at the same time,
+    and has until the question's deadline to answer
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.members = {}  # socket -> RoomPlayer, in the order they joined
+        self.state = WAITING
+        self.question_indexes = []  # bank indexes of the questions of the game, in the order they're asked
+        self.question_number = 0  # of the current question, from 1
+        self.question = None  # the current question_bank.Question
+
+    def start(self, bank_size, question_count=ROOM_QUESTIONS):
+        """
+        Draws the questions of the game from the question bank, all different
+        """
+        self.question_indexes = random.sample(range(bank_size), min(question_count, bank_size))
+
+    def has_more_questions(self):
+        return self.question_number < len(self.question_indexes)
+
+    def next_question(self, bank):
+        """
+        Moves to the next question of the game, which no player answered yet
+        :return: the question
+        """
+        self.question = bank[self.question_indexes[self.question_number]]
+        self.question_number += 1
+        self.state = ASKING
+        for player in self.members.values():
+            player.answered = False
+            player.correct = False
+        return self.question
+
+    def everyone_answered(self):
+        return all(player.answered for player in self.members.values())
+
+    def scoreboard(self):
+        """
+        :return: list of the RoomPlayers, most points first
+        """
+        return sorted(self.members.values(), key=lambda player: player.points, reverse=True)
+
+
+class RoomRegistry:
+    """
+    The rooms of the server by name, and the room of every player by socket. Every room has at most one
+    deadline, kept in a single heap for all the rooms, so the server's event loop runs the room timers
+    without a thread or a timer per room. Rooms are only played by a server running in a single process.
+    """
+
+    def __init__(self):
+        self._rooms = {}  # name -> Room
+        self._room_of = {}  # socket -> Room it's a member of
+        self._deadlines = DeadlineHeap()
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def room_of(self, conn):
+        return self._room_of.get(conn)
+
+    def join(self, conn, username, name, size=ROOM_SIZE):
+        """
+        Adds a player to a room, creating the room if there is none with the name
+        :param size: players the room waits for, if it's created
+        :raise ValueError: if the player is already in a room, or the room's game already started
+        :return: the Room
+        """
+        if conn in self._room_of:
+            raise ValueError("already in a room")
+        room = self._rooms.get(name)
+        if room is None:
+            room = self._rooms[name] = Room(name, size)
+        elif room.state != WAITING:
+            raise ValueError("the game of the room already started")
+        room.members[conn] = RoomPlayer(username)
+        self._room_of[conn] = room
+        return room
+
+    def leave(self, conn):
+        """
+        Removes a player from its room. A room left with no players is closed.
+        :return: the Room the player left, None if it wasn't in a room
+        """
+        room = self._room_of.pop(conn, None)
+        if room is None:
+            return None
+        del room.members[conn]
+        if not room.members:
+            self.close(room)
+        return room
+
+    def close(self, room: Room):
+        """
+        Removes a room and all its players
+        """
+        self._rooms.pop(room.name, None)
+        self._deadlines.remove(room)
+        for conn in room.members:
+            self._room_of.pop(conn, None)
+
+    def set_deadline(self, room: Room, deadline):
+        self._deadlines.set(room, deadline)
+
+    def next_deadline(self):
+        return self._deadlines.next_deadline()
+
+    def expired(self, now):
+        """
+        :return: list of the rooms whose deadline passed
+        """
+        return self._deadlines.pop_expired(now)
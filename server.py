@@ -2,78 +2,405 @@
 # server.py
 ##############################################################################
 
+import os
+import hmac
+import hashlib
 import socket
+import signal
+import multiprocessing.connection
 import chatlib
 import select
+import asyncio
+import argparse
+import functools
+import logging
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from operator import getitem
-import random
-import firebase_admin
-from firebase_admin import credentials, firestore
-import requests
-import html
-import hashlib
 import time
+from leaderboard import Leaderboard, PeriodLeaderboards
+from user_cache import UserStateCache
+from question_bank import QuestionBank, QuestionDeck
+from question_store import QuestionStore, QuestionRefiller, OpenTdbFetcher, FileFetcher, QUESTIONS_FILE
+import storage as user_storage
+from worker_pool import WorkerPool, STORAGE_WORKERS
+from frame_cache import static_frame, CachedPayload
+from sessions import SessionRegistry, ResumeTokens
+from shared_state import (start_coordinator, connect_coordinator, SharedSessions, SharedLeaderboard,
+                          SharedPeriodLeaderboards, SharedResumeTokens)
+from snapshot import write_snapshot, read_snapshot, SNAPSHOT_FILE, SNAPSHOT_INTERVAL
+from metrics import Metrics
+from passwords import hash_password, check_password, HASH_ITERATIONS
+from rooms import (RoomRegistry, ROOM_SIZE, MAX_ROOM_SIZE, MAX_ROOM_NAME_LENGTH, ANSWER_TIME, RESULTS_TIME, ASKING,
+                   SHOWING_RESULTS)
+from connections import (ConnectionManager, MAX_CONNECTIONS, LOGIN_TIMEOUT, IDLE_TIMEOUT, READ_RATE,
+                         MAX_OUTGOING_BYTES, OUTGOING_PAUSE_BYTES)
 
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred, {"databaseURL": "https://python-trivia-mor-default-rtdb.firebaseio.com/"})
-# save data
-db = firestore.client()
-users_collection = db.collection('users')
 # GLOBALS
+storage = None  # user_storage.UserStorage the users are kept in, opened by main
+worker_pool = None  # WorkerPool running the storage calls, created by main
+USER_CACHE_FLUSH_KEY = "user cache flush"  # worker pool ordering key of the writes of the user cache
+SNAPSHOT_KEY = "snapshot"  # worker pool ordering key of the snapshot writes
+logins_in_progress = {}  # username -> number of logins of it waiting for the storage or the password check
+login_usernames = {}  # socket -> username of its login in progress
+password_pool = None  # ProcessPoolExecutor hashing and checking passwords, created by run_server
+password_iterations = HASH_ITERATIONS  # PBKDF2 iterations of new password hashes
+verified_credentials = OrderedDict()  # credential_digest -> True, the credentials verified lately, oldest first
+VERIFIED_CREDENTIALS_SIZE = 10000
+CREDENTIALS_KEY = os.urandom(32)  # key of the credential digests, never saved so they are useless outside this process
 users = {}
-questions = {}
-logged_users = {}  # a dictionary of client hostnames to usernames - will be used later
+questions = QuestionBank()
+question_store = None  # QuestionStore the question bank is saved in, created by main
+question_refiller = None  # QuestionRefiller growing the question bank, None in workers that only follow the store
+logged_users = SessionRegistry()  # the logged in users by socket, user id and username
+resume_tokens = ResumeTokens()  # tokens the users can log in again with after losing their connection
+question_decks = {}  # user id -> QuestionDeck of the questions the logged in user wasn't asked yet
+unanswered_questions = {}  # user id -> ids of the questions GET_QUESTIONS gave the logged in user, not answered yet
+rooms = RoomRegistry()  # the multiplayer rooms and their players
+subscribers = {topic: set() for topic in chatlib.PUSH_TOPICS}  # topic -> sockets subscribed to its pushes
+pushed_versions = {}  # topic -> version of the state last pushed to its subscribers
+PUSH_INTERVAL = 1  # seconds between pushes of the high scores and the logged users, however often they change
+LIST_MORE = "+%d more"  # ends a list too long for a message (logged users, high scores), with how many were left out
 client_sockets = []
 ERROR_MSG = "Error! "
 SERVER_PORT = 5678
 SERVER_IP = "0.0.0.0"
-MAX_MSG_LENGTH = 1204
-messages_to_send = []
+RECV_BUFFER_SIZE = 4096
+MAX_REQUEST_LENGTH = chatlib.MAX_DATA_LENGTH  # max data bytes of a compact request, a longer one disconnects the client
+outgoing_data = {}  # socket -> bytearray of the messages built for it and not sent yet
+sockets_to_write = set()  # sockets that have data waiting in outgoing_data
+slow_sockets = set()  # sockets whose outgoing data went over the limit, disconnected once the current work is done
+connection_manager = ConnectionManager()  # limits of the client connections, configured by run_server
+message_decoders = {}  # socket -> chatlib.MessageDecoder with the bytes received so far
+message_formats = {}  # socket -> message format negotiated by the client, if it isn't chatlib.TEXT_FORMAT
+async_client_tasks = set()  # reader tasks of the asyncio engine's clients, awaited when it stops
+leaderboard = Leaderboard()
+period_leaderboards = PeriodLeaderboards()  # rankings of the points scored today and this week
+LEADERBOARD_SIZE = 50
+HIGHSCORE_RANK_LINE = "You current rank: %s\n\n"  # put before the high score table of a HIGHSCORE reply
+MAX_RANK_LENGTH = 12  # characters of the biggest rank the high score table leaves room for
+QUESTIONS_BATCH_SIZE = 20  # max questions sent in one YOUR_QUESTIONS message
+CORRECT_ANSWER_POINTS = 5
+LEADERBOARD_RECONCILE_INTERVAL = 300  # seconds between full syncs of the leaderboard with the store
+SELECT_TIMEOUT = 1  # seconds, so periodic tasks run even when no client is active
+PERIODIC_TASKS_INTERVAL = 1  # seconds between checks of the periodic tasks in the asyncio engine
+PAUSE_CHECK_INTERVAL = 0.05  # seconds between checks whether a paused client of the asyncio engine may be read again
+ASYNC_STOP_TIMEOUT = 5  # seconds the asyncio engine waits for its client tasks to end when it stops
+POOL_STATS_INTERVAL = 60  # seconds between prints of the worker pool stats
+SERVER_ENGINES = ("select", "asyncio")
+WORKER_RESTART_DELAY = 1  # seconds before a worker process that exited is started again
+worker_index = 0  # index of this worker process, 0 when the server runs in a single process
+reuse_port = False  # whether the listening socket is shared with other worker processes (SO_REUSEPORT)
+ADMIN_IP = "127.0.0.1"  # the admin port is only reachable from this computer
+admin_port = None  # port serving the metrics report, None if disabled
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+log = logging.getLogger("server")
+metrics = Metrics()
+last_reconcile = 0
+last_pool_stats = 0
+last_push = 0
+snapshot_file = SNAPSHOT_FILE  # where the leaderboards and the resume tokens are saved, None if they aren't
+snapshot_interval = SNAPSHOT_INTERVAL
+snapshot_loaded = False  # whether the leaderboard was restored from a snapshot at startup
+last_snapshot = 0
 
 
-def get_questions():
+def load_questions(store: QuestionStore, fetcher):
     """
-     get from api the trivia questions
-    :return:  a list of 50 questions
+    Loads the question bank saved on disk. The first batch is fetched right away if nothing was saved yet,
+    since the game can't be played without questions.
+    :return: list of the questions
     """
-    global questions
-    response = requests.get("https://opentdb.com/api.php?amount=50&type=multiple")
-    return response.json()
+    saved_questions = store.load()
+    if not saved_questions:
+        saved_questions = store.append_new(fetcher(question_refiller.batch_size))
+    return saved_questions
+
+
+def load_new_questions():
+    """
+    Adds the questions another worker process saved to the store since they were last read
+    """
+    if question_store.has_unloaded():
+        added = questions.extend(question_store.load())
+        if added:
+            log.info("loaded %d questions, %d in the bank", added, len(questions))
+
+
+def start_question_refill():
+    """
+    Fetches more questions on the worker pool, they are added to the live bank by finish_question_refill
+    """
+    question_refiller.running = True
+    worker_pool.submit(None, question_refiller.refill, (), finish_question_refill)
+
+
+def finish_question_refill(new_questions, error):
+    if error is not None:
+        log.warning("failed fetching questions: %s", error)
+    elif new_questions:
+        questions.extend(new_questions)
+        log.info("added %d questions, %d in the bank", len(new_questions), len(questions))
+    question_refiller.finish(time.monotonic(), new_questions)
+
+
+def write_user_changes(changes: dict):
+    """
+    Writes changed fields of users to the store in a batch
+    :param changes: dictionary of user id -> dictionary of changed fields
+    """
+    storage.update_users(changes)
+
+
+user_cache = UserStateCache(write_user_changes)
+
+
+def flush_user_cache():
+    """
+    Writes the pending score and progress changes of the users to the store, blocking until they are written
+    """
+    try:
+        user_cache.flush()
+    except Exception as err:
+        log.error("failed writing user changes, will retry: %s", err)
+
+
+def flush_user_cache_in_background(user_ids=None):
+    """
+    Writes the pending score and progress changes of the users to the store on the worker pool
+    :param user_ids: write only the changes of these users. All changes are written if None
+    """
+    changes = user_cache.take_changes(user_ids)
+    if changes:
+        worker_pool.submit(USER_CACHE_FLUSH_KEY, storage.update_users, (changes,),
+                           functools.partial(finish_user_cache_flush, changes))
+
+
+def finish_user_cache_flush(changes, result, error):
+    if error is not None:
+        log.error("failed writing user changes, will retry: %s", error)
+        user_cache.restore_changes(changes)
+        return
+    for user_id in changes:
+        release_user_state(user_id)
+
+
+def release_user_state(user_id):
+    """
+    Removes a user that isn't logged in anymore from the user cache. The record is kept while a login
+    of the user waits for the storage, since the record it reads may be older than the cached one.
+    """
+    if user_id in user_cache and not logged_users.has_user(user_id) \
+            and user_cache.get(user_id, "username") not in logins_in_progress:
+        user_cache.discard(user_id)
+
+
+def reconcile_leaderboard():
+    """
+    Syncs the in memory leaderboard with the store, in case it was changed from outside this server.
+    Blocks until done, used at startup.
+    """
+    changed = leaderboard.reconcile(storage.leaderboard_records())
+    log.info("leaderboard reconciled, %d entries changed", changed)
+
+
+def reconcile_leaderboard_in_background():
+    """
+    Syncs the in memory leaderboard with the store, reading the store on the worker pool.
+    The users in the user cache are skipped since their cached score is newer than the stored one.
+    """
+    flush_user_cache_in_background()
+    worker_pool.submit(USER_CACHE_FLUSH_KEY, read_leaderboard_records, (), finish_leaderboard_reconcile)
+
+
+def read_leaderboard_records():
+    return list(storage.leaderboard_records())
+
+
+def finish_leaderboard_reconcile(records, error):
+    if error is not None:
+        log.error("failed reading the leaderboard: %s", error)
+        return
+    changed = leaderboard.reconcile(records, skip=user_cache)
+    log.info("leaderboard reconciled, %d entries changed", changed)
+
+
+def load_snapshot():
+    """
+    Restores the leaderboards and the resume tokens saved by an earlier run, so the server starts warm and the
+    clients of that run can resume their sessions. The leaderboard is reconciled with the store later, in the
+    background. The daily and weekly rankings are only kept in snapshots, those of periods that ended are dropped.
+    :return: True if a snapshot was loaded
+    """
+    snapshot = read_snapshot(snapshot_file)
+    if snapshot is None:
+        return False
+    start = time.perf_counter()
+    try:
+        leaderboard.load(snapshot["leaderboard"])
+    except (ValueError, TypeError) as err:
+        log.warning("ignoring the snapshot, its leaderboard can't be restored: %s", err)
+        return False
+    periods = period_leaderboards.restore(snapshot.get("periods", {}), time.time())
+    tokens = resume_tokens.load(snapshot["resume_tokens"], time.time())
+    log.info("snapshot restored in %.3f seconds: %d leaderboard entries, %d periods, %d resume tokens",
+             time.perf_counter() - start, len(snapshot["leaderboard"]), periods, tokens)
+    return True
+
+
+def take_snapshot():
+    """
+    Saves the leaderboards and the resume tokens. They're copied on the event loop, and written to the file on
+    the worker pool.
+    """
+    worker_pool.submit(SNAPSHOT_KEY, write_snapshot,
+                       (snapshot_file, leaderboard.records(), resume_tokens.records(), time.time(),
+                        period_leaderboards.snapshot()),
+                       finish_snapshot)
+
+
+def finish_snapshot(result, error):
+    if error is not None:
+        log.error("failed writing the snapshot: %s", error)
 
 
 # HELPER SOCKET METHODS
 def print_client_sockets(sockets: list):
-    for c in sockets:
-        print("\t", c.getpeername())
+    if log.isEnabledFor(logging.DEBUG):
+        for c in sockets:
+            log.debug("\t %s", c.getpeername())
 
 
 def build_and_send_message(conn: socket.socket, code, msg):
     """
-      Builds a new message using chatlib, wanted code and message.
-      Prints debug info, then sends it to the given socket.
+      Builds a new message using chatlib, wanted code and message, in the message format of the socket.
+      Prints debug info, then queues it in the outgoing data of the given socket.
       Paramaters: conn (socket object), code (str), data (str)
       Returns: Nothing
       """
-    global messages_to_send
-    full_msg = chatlib.build_message(code, msg)
-    messages_to_send.append((conn, full_msg))
+    message_format = message_formats.get(conn, chatlib.TEXT_FORMAT)
+    if msg:
+        frame = chatlib.build_frame(code, msg, message_format)
+    else:
+        frame = static_frame(code, message_format)
+    if frame is None:
+        handle_too_long_message(conn, code)
+        return
+    queue_data(conn, frame)
 
-    print("[SERVER] ", full_msg)  # Debug print
+    log.debug("[SERVER] %s %s", code, msg)
+
+
+def broadcast_message(conns, code, msg):
+    """
+    Queues the same message to many sockets. It's encoded once per message format, and the encoded frame
+    is shared by all the sockets using that format.
+    """
+    frames = {}  # message format -> frame
+    for conn in conns:
+        message_format = message_formats.get(conn, chatlib.TEXT_FORMAT)
+        if message_format not in frames:
+            frames[message_format] = chatlib.build_frame(code, msg, message_format)
+        frame = frames[message_format]
+        if frame is None:
+            handle_too_long_message(conn, code)
+        else:
+            queue_data(conn, frame)
+
+    log.debug("[SERVER] %s %s (to %d clients)", code, msg, len(conns))
+
+
+def send_cached_reply(conn: socket.socket, reply: CachedPayload, prefix=""):
+    """
+    Queues a reply whose data is cached, in the message format of the socket
+    :param prefix: text put before the cached data for this socket only
+    """
+    frame = reply.frame(message_formats.get(conn, chatlib.TEXT_FORMAT), prefix)
+    if frame is None:
+        handle_too_long_message(conn, reply.cmd)
+        return
+    queue_data(conn, frame)
+
+    log.debug("[SERVER] %s %s%s", reply.cmd, prefix, reply.data)
+
+
+def handle_too_long_message(conn, code):
+    """
+    Deals with a message whose data is longer than its message format allows. A reply is replaced by an error, so
+    the request still gets its answer. A push is only dropped, since the client would take an error it didn't ask
+    for as the reply to its next request.
+    """
+    log.warning("[SERVER] %s message too long to be sent", code)
+    metrics.count("messages_too_long")
+    if code not in chatlib.PUSH_COMMANDS:
+        send_error(conn, code + " reply too long")
 
 
-def recv_message_and_parse(conn):
+def queue_data(conn, data: bytes):
     """
-        Recieves a new message from given socket,
-        then parses the message using chatlib.
+    Adds encoded data to the outgoing data of the given socket and marks it as waiting to be written
+    :raise ValueError: if there is no data, which is what chatlib returns for a message that can't be encoded
+    """
+    if data is None:
+        raise ValueError("no data to queue")
+    buffer = outgoing_data.get(conn)
+    if buffer is None:
+        buffer = outgoing_data[conn] = bytearray()
+    buffer += data
+    sockets_to_write.add(conn)
+    if not connection_manager.output_changed(conn, len(buffer)):
+        slow_sockets.add(conn)
+
+
+def send_queued_data(conn: socket.socket):
+    """
+    Sends as much of the socket's outgoing data as the socket accepts in one send call.
+    What wasn't sent stays queued for the next time the socket is writable.
+    """
+    buffer = outgoing_data[conn]
+    try:
+        sent = conn.send(buffer)
+    except (BlockingIOError, InterruptedError):
+        return  # the socket's buffer filled up since it was reported writable
+    metrics.count("bytes_sent", sent)
+    del buffer[:sent]
+    if not buffer:
+        sockets_to_write.discard(conn)
+    if conn in connection_manager.paused:
+        connection_manager.output_changed(conn, len(buffer))
+
+
+def recv_messages_and_parse(conn):
+    """
+        Recieves the available bytes from given socket,
+        then parses every message they complete using the socket's chatlib decoder.
         Paramaters: conn (socket object)
-        Returns: cmd (str) and data (str) of the received message.
-        If error occured, will return None, None
+        Returns: list of cmd (str) and data (str) tuples, may be empty if only part of a message arrived.
+        If error occured or the connection was closed, the list will end with None, None
         """
-    full_msg = conn.recv(1024).decode()
-    cmd, data = chatlib.parse_message(full_msg)
-    print("[CLIENT] ", full_msg)  # Debug print
-    return cmd, data
+    try:
+        received = conn.recv(RECV_BUFFER_SIZE)
+    except (BlockingIOError, InterruptedError):
+        return []  # nothing to read after all
+    return parse_received(conn, received)
+
+
+def parse_received(conn, received: bytes):
+    """
+    Parses every message completed by bytes received from a client, see recv_messages_and_parse
+    """
+    if not received:
+        return [(None, None)]
+    metrics.count("bytes_received", len(received))
+    decoder = message_decoders.get(conn)
+    if decoder is None:
+        decoder = message_decoders[conn] = chatlib.make_decoder(message_formats.get(conn, chatlib.TEXT_FORMAT),
+                                                                MAX_REQUEST_LENGTH)
+    messages = decoder.feed(received)
+    if log.isEnabledFor(logging.DEBUG):
+        for cmd, data in messages:
+            log.debug("[CLIENT] %s %s", cmd, data)
+    return messages
 
 
 # SOCKET CREATOR
@@ -86,6 +413,9 @@ def setup_socket():
     """
     # Implement code ...
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # restarts don't wait for the old connections' TIME_WAIT
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     sock.bind((SERVER_IP, SERVER_PORT))
     sock.listen()
     return sock
@@ -97,6 +427,7 @@ def send_error(conn, error_msg):
     Recieves: socket, message error string from called function
     Returns: None
     """
+    metrics.count("errors_sent")
     build_and_send_message(conn, chatlib.PROTOCOL_SERVER["error_msg"], error_msg)
 
 
@@ -108,99 +439,310 @@ def handle_logout_message(conn: socket.socket):
     Recieves: socket
     Returns: None
     """
-    global logged_users
     client_sockets.remove(conn)
-    if conn in logged_users:
-        del logged_users[conn]
+    message_decoders.pop(conn, None)
+    message_formats.pop(conn, None)
+    outgoing_data.pop(conn, None)
+    sockets_to_write.discard(conn)
+    slow_sockets.discard(conn)
+    connection_manager.remove(conn)
+    worker_pool.cancel(conn)
+    end_login(conn)
+    leave_room(conn)
+    unsubscribe(conn)
+    user_id = logged_users.remove(conn)
+    if user_id is not None:
+        question_decks.pop(user_id, None)
+        unanswered_questions.pop(user_id, None)
+        if user_cache.has_changes():
+            flush_user_cache_in_background([user_id])
+        release_user_state(user_id)
     conn.close()
-    print("logout")
+    log.debug("logout")
     print_client_sockets(client_sockets)
 
 
 def handle_login_message(conn: socket.socket, data: str):
     """
     Gets socket and message data of login message. Checks  user and pass exists and match.
-    If not - sends error and finished. If all ok, sends OK message and adds user and address to logged_users
+    If not - sends error and finished. If all ok, sends OK message and adds user and address to logged_users.
+    The user is looked up on the worker pool and the answer is sent by finish_login.
     Recieves: socket, message code and data
     Returns: None (sends answer to client)
-    TODO: prevent login from user that is already connected
     """
     try:
-        global users  # This is needed to access the same users dictionary from all functions
-        global logged_users  # To be used later
-        global users_collection
         user_data = chatlib.split_data(data, 1)
-        if not user_data[0] in logged_users.values():
-            user = users_collection.where("username", "==", user_data[0]).get()[0]
-            if user:
-                if user.get("password") == user_data[1]:
-                    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["login_ok_msg"], "")
-                    logged_users[conn] = user.id
-                else:
-                    send_error(conn, "wrong password")
-            else:
-                send_error(conn, "user not found")
-        else:
+        if logged_users.has_username(user_data[0]):
             send_error(conn, "user already logged in")
+        elif worker_pool.is_full():
+            send_error(conn, "server is busy, try again")
+        else:
+            logins_in_progress[user_data[0]] = logins_in_progress.get(user_data[0], 0) + 1
+            login_usernames[conn] = user_data[0]
+            worker_pool.submit(conn, storage.find_user, (user_data[0],),
+                               functools.partial(finish_login, conn, user_data))
     except Exception as err:
-        print(err)
+        log.warning("failed handling a login: %s", err)
+
+
+def end_login(conn: socket.socket):
+    """
+    Marks the login of a socket as no longer waiting for the storage or the password check
+    """
+    username = login_usernames.pop(conn, None)
+    if username is None:
+        return
+    if logins_in_progress[username] == 1:
+        del logins_in_progress[username]
+    else:
+        logins_in_progress[username] -= 1
+
+
+def finish_login(conn: socket.socket, user_data: list, user, error):
+    """
+    Continues a login once the user was read from the storage. Credentials verified recently are accepted
+    from verified_credentials, others are checked on the password process pool.
+    :param user_data: the username and password sent by the client
+    :param user: (user_id, record) of the user, None if not found
+    :param error: exception raised while reading the user, or None
+    """
+    if error is not None:
+        end_login(conn)
+        log.error("failed reading a user: %s", error)
+        send_error(conn, "login failed, try again")
+    elif not user:
+        end_login(conn)
+        send_error(conn, "user not found")
+    else:
+        user_id, user_record = user
+        stored_password = user_record.get("password", "")
+        credential = credential_digest(stored_password, user_data[1])
+        if credential in verified_credentials:
+            verified_credentials.move_to_end(credential)
+            complete_login(conn, user_id, user_record, None)
+        else:
+            worker_pool.submit(conn, check_password, (user_data[1], stored_password, password_iterations),
+                               functools.partial(finish_password_check, conn, user_data, user_id, user_record),
+                               executor=password_pool)
+
+
+def finish_password_check(conn: socket.socket, user_data: list, user_id, user_record: dict, result, error):
+    """
+    Completes a login once the password was checked
+    :param result: (whether the password is right, new hash to save or None), see passwords.check_password
+    """
+    if error is not None:
+        end_login(conn)
+        log.error("failed checking a password: %s", error)
+        send_error(conn, "login failed, try again")
+        return
+    password_ok, new_hash = result
+    if not password_ok:
+        end_login(conn)
+        send_error(conn, "wrong password")
+        release_user_state(user_id)
+        return
+    remember_credential(credential_digest(new_hash or user_record.get("password", ""), user_data[1]))
+    complete_login(conn, user_id, user_record, new_hash)
+
+
+def complete_login(conn: socket.socket, user_id, user_record: dict, new_hash):
+    """
+    Logs in a user whose password was verified. The LOGIN_OK answer has a new resume token of the user.
+    :param new_hash: password hash to save instead of the one in the record (a plaintext password is migrated
+    this way), or None
+    """
+    end_login(conn)
+    try:
+        logged_users.add(conn, user_id, user_record.get("username"))
+    except ValueError:
+        send_error(conn, "user already logged in")  # logged in by another socket while this login waited
+        release_user_state(user_id)
+        return
+    token = resume_tokens.issue(user_id, user_record.get("username"), time.time())
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["login_ok_msg"], token)
+    connection_manager.logged_in(conn, time.monotonic())
+    user_cache.load(user_id, user_record)
+    if new_hash is not None:
+        user_cache.update(user_id, {"password": new_hash})
+    leaderboard.add(user_id, user_record.get("username"), user_record.get("score", 0),
+                    user_record.get("score_timestamp"))
+
+
+def handle_resume_message(conn: socket.socket, token: str):
+    """
+    Logs in the user of a resume token, given by an earlier login (maybe of a server run that saved it in its
+    snapshot), without checking the password again. A socket the user is still logged in from at this worker
+    is disconnected, since a client resumes when it lost that connection. The user is read from the storage
+    by its id, and the answer is sent by finish_resume.
+    """
+    if worker_pool.is_full():
+        send_error(conn, "server is busy, try again")
+        return
+    session = resume_tokens.find(token, time.time())
+    if session is None:
+        send_error(conn, "invalid or expired session")
+        return
+    user_id, username = session
+    old_conn = logged_users.socket_of(user_id)
+    if old_conn is None and logged_users.has_username(username):
+        # logged in at another worker process, the token works again once that connection is closed
+        send_error(conn, "user already logged in")
+        return
+    logins_in_progress[username] = logins_in_progress.get(username, 0) + 1
+    login_usernames[conn] = username
+    if old_conn is not None:
+        handle_logout_message(old_conn)
+    worker_pool.submit(conn, storage.get_user, (user_id,), functools.partial(finish_resume, conn, user_id))
+
+
+def finish_resume(conn: socket.socket, user_id, user_record, error):
+    """
+    Completes a resume once the user was read from the storage
+    :param user_record: the record of the user, None if it was deleted
+    """
+    if error is not None:
+        end_login(conn)
+        log.error("failed reading a user: %s", error)
+        send_error(conn, "login failed, try again")
+    elif user_record is None:
+        end_login(conn)
+        send_error(conn, "user not found")
+    else:
+        complete_login(conn, user_id, user_record, None)
+
+
+def handle_logout_request(conn: socket.socket):
+    """
+    LOGOUT: ends the session for good, so its resume token can't be used anymore. A connection that is just
+    closed keeps its token.
+    """
+    resume_tokens.revoke(logged_users[conn])
+    handle_logout_message(conn)
+
+
+def credential_digest(stored_password, password):
+    """
+    :return: keyed digest of a password together with what is saved for the user, the key of verified_credentials.
+    It changes whenever the saved hash does, so a changed password is checked again.
+    """
+    return hmac.new(CREDENTIALS_KEY, (stored_password + "\0" + password).encode(), hashlib.sha256).digest()
+
+
+def remember_credential(credential):
+    verified_credentials[credential] = True
+    verified_credentials.move_to_end(credential)
+    if len(verified_credentials) > VERIFIED_CREDENTIALS_SIZE:
+        verified_credentials.popitem(last=False)
 
 
 def handle_sign_up_message(conn: socket.socket, data: str):
     """
     The function saves data of user sent by a sign up request
+    The password is hashed on the password process pool, then the user is saved on the worker pool
+    and the answer is sent by finish_sign_up.
     :param conn: socket representing the client's connection
-    :param data: data sent by the user. should include a username and password
+    :param data: data sent by the user. should include a username and password, see chatlib.is_valid_username
     """
     try:
-        global users  # This is needed to access the same users dictionary from all functions
-        global logged_users  # To be used later
-        global users_collection
         user_data = chatlib.split_data(data, 1)
-        if users_collection.where("username", "==", user_data[0]).get():
-            send_error(conn, "Username is taken")
-        else:
-            doc_ref = users_collection.document()
-            doc_ref.set({
-                "username": user_data[0],
-                "password": user_data[1],
-                "score": 0,
-                "questions_asked": []
-            })
-            build_and_send_message(conn, chatlib.PROTOCOL_SERVER["signup_ok_msg"], "")
+        if len(user_data) != 2:
+            send_error(conn, "Error reading sign up data")
+            return
+        if not chatlib.is_valid_username(user_data[0]):
+            send_error(conn, "A username has " + str(chatlib.MIN_USERNAME_LENGTH) + " to "
+                       + str(chatlib.MAX_USERNAME_LENGTH) + " letters and digits")
+            return
+        if worker_pool.is_full():
+            send_error(conn, "server is busy, try again")
+            return
+        worker_pool.submit(conn, hash_password, (user_data[1], password_iterations),
+                           functools.partial(save_new_user, conn, user_data[0]), executor=password_pool)
     except Exception as err:
-        print(err)
+        log.warning("failed handling a sign up: %s", err)
+
+
+def save_new_user(conn: socket.socket, username, password_hash, error):
+    """
+    Saves a signing up user once its password was hashed
+    """
+    if error is not None:
+        log.error("failed hashing a password: %s", error)
+        send_error(conn, "sign up failed, try again")
+        return
+    user_record = {
+        "username": username,
+        "password": password_hash,
+        "score": 0,
+        "score_timestamp": time.time(),
+        "questions_seen": b""
+    }
+    worker_pool.submit(conn, storage.sign_up_user, (user_record,),
+                       functools.partial(finish_sign_up, conn, user_record))
+
+
+def finish_sign_up(conn: socket.socket, user_record: dict, user_id, error):
+    """
+    Completes a sign up once the storage saved the user
+    :param user_id: id of the new user, None if the username is taken
+    :param error: exception raised while saving the user, or None
+    """
+    if error is not None:
+        log.error("failed saving a user: %s", error)
+        send_error(conn, "sign up failed, try again")
+    elif user_id is None:
+        send_error(conn, "Username is taken")
+    else:
+        leaderboard.update(user_id, user_record["username"], 0, user_record["score_timestamp"])
+        build_and_send_message(conn, chatlib.PROTOCOL_SERVER["signup_ok_msg"], "")
+
+
+def handle_protocol_message(conn: socket.socket, data: str):
+    """
+    Switches the connection to the message format the client asked for. The answer is still sent in the
+    old format, and every message after it in the new one.
+    :param data: name of the message format, one of chatlib.MESSAGE_FORMATS
+    """
+    if data not in chatlib.MESSAGE_FORMATS:
+        send_error(conn, "unknown message format")
+        return
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["protocol_ok"], data)
+    message_formats[conn] = data
+    old_decoder = message_decoders.get(conn)
+    decoder = message_decoders[conn] = chatlib.make_decoder(data, MAX_REQUEST_LENGTH)
+    remaining = old_decoder.take_remaining() if old_decoder else b""
+    if remaining:
+        # The client didn't wait for the answer, its next messages were received with the PROTOCOL message
+        handle_received_messages(conn, decoder.feed(remaining))
 
 
 def handle_client_message(conn: socket.socket, cmd: str, data: str):
     """
-    Gets message code and data and calls the right function to handle command
+    Gets message code and data and calls the right function to handle command.
+    The time the handler takes is recorded in the metrics of the command.
     Recieves: socket, message code and data
     Returns: None
     """
-    global logged_users  # To be used later
-    if conn not in logged_users:
-        if cmd == chatlib.PROTOCOL_CLIENT["login_msg"]:
-            handle_login_message(conn, data)
-        elif cmd == chatlib.PROTOCOL_CLIENT["signup_msg"]:
-            handle_sign_up_message(conn, data)
-        else:
-            send_error(conn, "invalid command")
+    handlers = LOGGED_IN_HANDLERS if conn in logged_users else LOGGED_OUT_HANDLERS
+    handler = handlers.get(cmd)
+    if handler is None:
+        metrics.count("invalid_commands")
+        send_error(conn, "invalid command")
+        return
+    start = time.perf_counter()
+    function, takes_data = handler
+    if takes_data:
+        function(conn, data)
     else:
-        if cmd == chatlib.PROTOCOL_CLIENT["logout_msg"]:
-            handle_logout_message(conn)
-        elif cmd == chatlib.PROTOCOL_CLIENT["highscore"]:
-            handle_highscore_message(conn)
-        elif cmd == chatlib.PROTOCOL_CLIENT["user_score"]:
-            handle_getscore_message(conn)
-        elif cmd == chatlib.PROTOCOL_CLIENT["logged_users"]:
-            handle_logged_message(conn)
-        elif cmd == chatlib.PROTOCOL_CLIENT["question"]:
-            handle_question_message(conn)
-        elif cmd == chatlib.PROTOCOL_CLIENT["send_answer"]:
-            handle_answer_message(conn, data)
-        else:
-            send_error(conn, "invalid command")
+        function(conn)
+    metrics.observe("command." + cmd, time.perf_counter() - start)
+
+
+def handle_heartbeat_message(conn):
+    """
+    Answers a PING, which clients send to keep an idle connection from timing out
+    """
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["heartbeat"], "")
 
 
 def handle_getscore_message(conn):
@@ -208,136 +750,1075 @@ def handle_getscore_message(conn):
     Sending to the user it's current score
     :param conn: A socket instance of the connection with the user
     """
-    user = users_collection.document(logged_users[conn]).get()
-    score = user.get("score")
+    score = user_cache.get(logged_users[conn], "score")
     build_and_send_message(conn, chatlib.PROTOCOL_SERVER["user_score"], str(score))
 
 
 def handle_highscore_message(conn):
     """
-    Getting a lead users table, showing top 50.
+    Getting a lead users table, showing top 50. Served from the in memory leaderboard.
     :param conn: A socket instance of the connection with the user
     """
-    sorted_highs = users_collection.order_by("score", direction="DESCENDING").order_by("score_timestamp").get()
-    user_rank = sorted_highs.index(users_collection.document(logged_users[conn]).get())
-    top_list = sorted_highs[0:50]
-    score_msg = "You current rank: " + str(user_rank) + "\n\n"
-    rank_num = 1
-    for user in top_list:
-        score_msg += str(rank_num) + ". " + user.get("username") + ": " + str(user.get("score")) + "\n"
-        rank_num += 1
-    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["highscore"], score_msg)
+    user_rank = leaderboard.rank(logged_users[conn])
+    send_cached_reply(conn, highscore_reply, HIGHSCORE_RANK_LINE % user_rank)
+
+
+def build_highscore_table():
+    """
+    :return: the top of the leaderboard as the table sent after the rank of the user in ALL_SCORE. If it doesn't fit
+    in a message with the rank, the table ends with as many users as fit followed by "+N more".
+    """
+    lines = [str(rank_num) + ". " + username + ": " + str(score) + "\n"
+             for rank_num, (username, score) in enumerate(leaderboard.top(LEADERBOARD_SIZE), 1)]
+    max_length = chatlib.MAX_DATA_LENGTH - len(HIGHSCORE_RANK_LINE % ("9" * MAX_RANK_LENGTH))
+    score_msg = "".join(lines)
+    if len(score_msg) <= max_length:
+        return score_msg
+    length = len(LIST_MORE % len(lines)) + 1
+    for listed, line in enumerate(lines):
+        length += len(line)
+        if length > max_length:
+            break
+    return "".join(lines[:listed]) + LIST_MORE % (len(lines) - listed) + "\n"
+
+
+def handle_highscore_page_message(conn: socket.socket, page_msg):
+    """
+    A page of a ranking: of all the time, of today or of this week. The rankings are kept up to date as the users
+    score, so a page is found in O(log n) without sorting anything.
+    :param conn: A socket instance of the connection with the user
+    :param page_msg: window (see chatlib.HIGHSCORE_WINDOWS), 0 based position of the first user of the page or
+    chatlib.AROUND_ME for the page with the user in its middle, and the number of users of the page
+    """
+    try:
+        window, start, count = chatlib.split_data(page_msg, 2)
+        start = None if start == chatlib.AROUND_ME else int(start)
+        count = int(count)
+    except ValueError:
+        send_error(conn, "Error reading high score page request")
+        return
+    if window not in chatlib.HIGHSCORE_WINDOWS or (start is not None and start < 0) \
+            or not 0 < count <= LEADERBOARD_SIZE:
+        send_error(conn, "Error reading high score page request")
+        return
+    user_id = logged_users[conn]
+    if window == "all":
+        total, rank, start, page = leaderboard.page(user_id, count, start)
+    else:
+        total, rank, start, page = period_leaderboards.page(window, user_id, count, start)
+    records = [[window, str(total), str(rank + 1) if rank is not None else ""]]
+    records.extend([str(start + i + 1), username, str(score)] for i, (username, score) in enumerate(page))
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["highscore_page"], chatlib.join_records(records))
 
 
 def handle_logged_message(conn):
     """
-    Sending a list of all connected users
+    Sending a list of all connected users. The list is rebuilt only after a login or logout.
     :param conn: A socket instance of the connection with the user
     """
-    global logged_users
-    global users_collection
-    user_names = []
-    for user_id in logged_users.values():
-        user_names.append(users_collection.document(user_id).get().get("username"))
-    logged_users_list = ",".join(user_names)
-    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["logged_users"], logged_users_list)
+    send_cached_reply(conn, logged_users_reply)
 
 
-def create_random_question():
+def build_logged_users_list():
     """
-    Randomly selecting a question of the questions list
-    :return: a list containing question id, questions and answers
+    :return: the usernames of the logged in users separated by commas. If they don't all fit in a message, the
+    list ends with as many as fit followed by "+N more".
     """
-    global questions
-    selected_question = random.choice(questions)
-    selected_question_id = str(hash(selected_question["question"]))
-    answers_list = selected_question["incorrect_answers"] + [selected_question["correct_answer"]]
-    random.shuffle(answers_list)
-    return chatlib.join_data(
-        [selected_question_id, selected_question["question"]] + answers_list)
+    usernames = logged_users.usernames()
+    users_list = ",".join(usernames)
+    if len(users_list) <= chatlib.MAX_DATA_LENGTH:
+        return users_list
+    length = len(LIST_MORE % len(usernames))
+    for listed, username in enumerate(usernames):
+        length += len(username) + 1
+        if length > chatlib.MAX_DATA_LENGTH:
+            break
+    return ",".join(usernames[:listed] + [LIST_MORE % (len(usernames) - listed)])
+
+
+# Replies whose data is shared by all the requests until the state it shows changes
+highscore_reply = CachedPayload(chatlib.PROTOCOL_SERVER["highscore"], build_highscore_table,
+                                lambda: leaderboard.version)
+logged_users_reply = CachedPayload(chatlib.PROTOCOL_SERVER["logged_users"], build_logged_users_list,
+                                   lambda: logged_users.version)
+# Pushes of the same data to the subscribers of a topic
+TOPIC_PUSHES = {
+    "highscore": CachedPayload(chatlib.PROTOCOL_SERVER["highscore_push"], lambda: highscore_reply.data,
+                               lambda: leaderboard.version),
+    "logged": CachedPayload(chatlib.PROTOCOL_SERVER["logged_push"], lambda: logged_users_reply.data,
+                            lambda: logged_users.version),
+}
+
+
+def handle_subscribe_message(conn: socket.socket, topics_msg):
+    """
+    Subscribes the user to pushes of changes, so it doesn't have to poll for them. The topics are "highscore"
+    (HIGHSCORE_PUSH with the top of the leaderboard), "logged" (LOGGED_PUSH with the logged users) and "score"
+    (SCORE_PUSH with the user's score). The current high scores and logged users are pushed right away.
+    :param topics_msg: the topics, which replace the earlier ones. No topics unsubscribes from all of them.
+    """
+    topics = topics_msg.split(chatlib.DATA_DELIMITER) if topics_msg else []
+    if any(topic not in subscribers for topic in topics):
+        send_error(conn, "Unknown topic")
+        return
+    unsubscribe(conn)
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["subscribed"], chatlib.join_data(topics))
+    for topic in topics:
+        push = TOPIC_PUSHES.get(topic)
+        if push is not None:
+            if not subscribers[topic]:
+                pushed_versions[topic] = push.version
+            send_cached_reply(conn, push)
+        subscribers[topic].add(conn)
+
+
+def unsubscribe(conn):
+    for topic_subscribers in subscribers.values():
+        topic_subscribers.discard(conn)
+
+
+def push_updates():
+    """
+    Pushes the high scores and the logged users to their subscribers, if they changed since they were last pushed.
+    They are pushed at most every PUSH_INTERVAL seconds, with a frame shared by all the subscribers.
+    """
+    global last_push
+    if time.monotonic() - last_push < PUSH_INTERVAL:
+        return
+    last_push = time.monotonic()
+    for topic, push in TOPIC_PUSHES.items():
+        if subscribers[topic] and pushed_versions.get(topic) != push.version:
+            pushed_versions[topic] = push.version
+            for conn in subscribers[topic]:
+                send_cached_reply(conn, push)
 
 
 def handle_question_message(conn: socket.socket):
     """
-    Sending to user a random question with choices. the question id is saves in the user's record in order to no be
-    repeated.
+    Sending to user a random question with choices. The question is drawn from the user's deck of questions
+    it wasn't asked, and the bitmap of asked questions is saved in the user's record in order to no be repeated.
     :param conn: A socket instance of the connection with the user
     """
-    global users_collection
-    user = users_collection.document(logged_users[conn])
-    questions_asked = user.get().get("questions_asked")
-    if len(questions_asked) == 500:
+    user_id = logged_users[conn]
+    deck = get_question_deck(user_id)
+    deck.add_new_questions(questions)
+    question_index = deck.draw()
+    if question_index is None:
         build_and_send_message(conn, chatlib.PROTOCOL_SERVER["finished_game"], "")
-    while True:
-        question = create_random_question()
-        if not question.split("#")[0] in questions_asked:
-            break
-    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["question"], question)
-    user.update({"questions_asked": questions_asked + [question.split("#")[0]]})
+        return
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["question"], questions[question_index].payload())
+    user_cache.update(user_id, {"questions_seen": bytes(deck.seen)})
+
+
+def handle_questions_message(conn: socket.socket, count_msg):
+    """
+    Sending to user a batch of unseen questions in one message, one question per record.
+    The questions are marked as seen with a single change of the user's record.
+    :param conn: A socket instance of the connection with the user
+    :param count_msg: number of questions requested, at most QUESTIONS_BATCH_SIZE are sent
+    """
+    if not count_msg.isdigit() or int(count_msg) == 0:
+        send_error(conn, "Invalid number of questions")
+        return
+    count = min(int(count_msg), QUESTIONS_BATCH_SIZE)
+    user_id = logged_users[conn]
+    deck = get_question_deck(user_id)
+    deck.add_new_questions(questions)
+    payloads = []
+    question_ids = []
+    data_length = 0
+    while len(payloads) < count and deck.peek() is not None:
+        question = questions[deck.peek()]
+        payload = question.payload()
+        data_length += len(payload) + len(chatlib.RECORD_DELIMITER)
+        if payloads and data_length > chatlib.MAX_DATA_LENGTH:
+            break  # the rest doesn't fit in one message and stays in the deck
+        payloads.append(payload)
+        question_ids.append(question.question_id)
+        deck.draw()
+    if not payloads:
+        build_and_send_message(conn, chatlib.PROTOCOL_SERVER["finished_game"], "")
+        return
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["questions"], chatlib.RECORD_DELIMITER.join(payloads))
+    user_cache.update(user_id, {"questions_seen": bytes(deck.seen)})
+    unanswered_questions.setdefault(user_id, set()).update(question_ids)
+
+
+def get_question_deck(user_id):
+    """
+    :return: the QuestionDeck of a logged in user, built from its cached record the first time it's needed
+    """
+    deck = question_decks.get(user_id)
+    if deck is None:
+        deck = question_decks[user_id] = QuestionDeck(questions, user_cache.get(user_id, "questions_seen") or b"",
+                                                      user_cache.get(user_id, "questions_asked") or ())
+    return deck
 
 
 def handle_answer_message(conn: socket.socket, answer_msg):
     """
     checking the answer selected by the user. If correct, 5 points are added to score.
+    An answer to the current question of the user's room is an answer of the room's game.
     :param conn:
     :param answer_msg:
     """
     answer_data = chatlib.split_data(answer_msg, 1)
-    if not len(answer_data) == 2:
+    room = rooms.room_of(conn)
+    if room is not None and room.question is not None and answer_data[0] == room.question.question_id:
+        handle_room_answer(conn, room, answer_data[1])
+        return
+    code, data, points = check_answer(answer_data)
+    if points:
+        add_points(logged_users[conn], points)
+    build_and_send_message(conn, code, data)
+
+
+def handle_answers_message(conn: socket.socket, answers_msg):
+    """
+    checking a batch of answers, one answer per record, and sending the result of every answer in one message.
+    The points of all the correct answers are added to the score with a single change of the user's record.
+    Only the questions GET_QUESTIONS gave the user are checked, each of them once, so answering a question
+    again earns nothing.
+    :param conn: A socket instance of the connection with the user
+    :param answers_msg: records of question id and digest of the selected answer, at most QUESTIONS_BATCH_SIZE
+    """
+    answers = chatlib.split_records(answers_msg, 1)
+    if len(answers) > QUESTIONS_BATCH_SIZE:
+        send_error(conn, "At most " + str(QUESTIONS_BATCH_SIZE) + " answers can be sent at once")
+        return
+    user_id = logged_users[conn]
+    unanswered = unanswered_questions.get(user_id, set())
+    results = []
+    total_points = 0
+    for answer_data in answers:
+        if len(answer_data) == 2 and answer_data[0] not in unanswered:
+            code, data, points = chatlib.PROTOCOL_SERVER["error_msg"], "Question not asked or already answered", 0
+        else:
+            code, data, points = check_answer(answer_data)
+            if code != chatlib.PROTOCOL_SERVER["error_msg"]:
+                unanswered.discard(answer_data[0])
+        results.append([code, data] if data else [code])
+        total_points += points
+    if not results:
         send_error(conn, "Error reading answer data")
-    question_id = int(answer_data[0])
+        return
+    if total_points:
+        add_points(user_id, total_points)
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["answers_results"], chatlib.join_records(results))
+
+
+def check_answer(answer_data):
+    """
+    :param answer_data: question id and digest of the selected answer, as split by chatlib.split_data
+    :return: code and data of the answer to send back, and the points it earned
+    """
+    if not len(answer_data) == 2:
+        return chatlib.PROTOCOL_SERVER["error_msg"], "Error reading answer data", 0
     answer_id = answer_data[1]
     if len(answer_id) != 64:
-        send_error(conn, "Invalid answer identifier")
-    correct_answer = ""
-    for q in questions:
-        if hash(q["question"]) == question_id:
-            correct_answer = q["correct_answer"]
-            break
-    if hashlib.sha256(correct_answer.encode()).hexdigest() == answer_id:
-        user = users_collection.document(logged_users[conn])
-        score = user.get().get("score")
-        user.update({"score": score + 5})
-        build_and_send_message(conn, chatlib.PROTOCOL_SERVER["correct_answer"], "")
+        return chatlib.PROTOCOL_SERVER["error_msg"], "Invalid answer identifier", 0
+    question = questions.get(answer_data[0])
+    correct_answer = question.correct_answer if question else ""
+    if question and question.answer_digest == answer_id:
+        return chatlib.PROTOCOL_SERVER["correct_answer"], "", CORRECT_ANSWER_POINTS
+    return chatlib.PROTOCOL_SERVER["wrong_answer"], str(correct_answer), 0
+
+
+def add_points(user_id, points):
+    """
+    Adds points to the score of a logged in user, in its cached record and in the leaderboards
+    """
+    score = user_cache.get(user_id, "score") + points
+    score_timestamp = time.time()
+    username = user_cache.get(user_id, "username")
+    user_cache.update(user_id, {"score": score, "score_timestamp": score_timestamp})
+    leaderboard.update(user_id, username, score, score_timestamp)
+    period_leaderboards.add_points(user_id, username, points, score_timestamp)
+    if subscribers["score"]:
+        conn = logged_users.socket_of(user_id)
+        if conn in subscribers["score"]:
+            build_and_send_message(conn, chatlib.PROTOCOL_SERVER["score_push"], str(score))
+
+
+def handle_join_room_message(conn: socket.socket, room_msg):
+    """
+    Adds the user to a room. The room is created by the first player joining it, with the number of players it
+    waits for, and its game starts when they all joined.
+    Rooms are only played when the server runs in a single process: the players of a room must all be served
+    by the process that runs its game, and the port shared by worker processes hands each connection to any of them.
+    :param room_msg: room name, or room name and number of players (default ROOM_SIZE)
+    """
+    if reuse_port:
+        send_error(conn, "Rooms aren't available on this server")
+        return
+    fields = room_msg.split(chatlib.DATA_DELIMITER)
+    name = fields[0]
+    if not name or len(name) > MAX_ROOM_NAME_LENGTH or chatlib.RECORD_DELIMITER in name or len(fields) > 2:
+        send_error(conn, "Invalid room name")
+        return
+    size = ROOM_SIZE
+    if len(fields) == 2:
+        if not fields[1].isdigit() or not 2 <= int(fields[1]) <= MAX_ROOM_SIZE:
+            send_error(conn, "A room has 2 to " + str(MAX_ROOM_SIZE) + " players")
+            return
+        size = int(fields[1])
+    try:
+        room = rooms.join(conn, logged_users.username(conn), name, size)
+    except ValueError as err:
+        send_error(conn, str(err))
+        return
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["room_joined"], room.name)
+    send_room_state(room)
+    if len(room.members) >= room.size:
+        start_room_game(room)
+
+
+def handle_leave_room_message(conn: socket.socket):
+    if rooms.room_of(conn) is None:
+        send_error(conn, "not in a room")
+        return
+    leave_room(conn)
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["room_left"], "")
+
+
+def leave_room(conn):
+    """
+    Removes a player from its room, if it's in one, and tells the other players.
+    The current question ends if the players left all answered it.
+    """
+    room = rooms.leave(conn)
+    if room is None or not room.members:
+        return
+    send_room_state(room)
+    if room.state == ASKING and room.everyone_answered():
+        finish_room_question(room)
+
+
+def send_room_state(room):
+    """
+    Sends the players of a room its name, size and state, and every player's points
+    """
+    records = [[room.name, str(room.size), room.state]]
+    records += [[player.username, str(player.points)] for player in room.members.values()]
+    broadcast_message(room.members, chatlib.PROTOCOL_SERVER["room_state"], chatlib.join_records(records))
+
+
+def start_room_game(room):
+    room.start(len(questions))
+    if room.has_more_questions():
+        ask_room_question(room)
     else:
-        build_and_send_message(conn, chatlib.PROTOCOL_SERVER["wrong_answer"], str(correct_answer))
+        finish_room_game(room)
 
 
-def main():
-    # Initializes global users and questions dicionaries using load functions, will be used later
-    global users
-    global questions
-    global messages_to_send
-    questions = get_questions()["results"]
-    for question in questions:
-        question["question"] = html.unescape(question["question"])
-        question["correct_answer"] = html.unescape(question["correct_answer"])
-        for i in range(len(question["incorrect_answers"])):
-            question["incorrect_answers"][i] = html.unescape(question["incorrect_answers"][i])
-    print("Welcome to Trivia Server!")
+def ask_room_question(room):
+    """
+    Sends the next question of a room to all its players, who have ANSWER_TIME seconds to answer it
+    """
+    question = room.next_question(questions)
+    header = chatlib.join_data([str(room.question_number), str(len(room.question_indexes)), str(ANSWER_TIME)])
+    broadcast_message(room.members, chatlib.PROTOCOL_SERVER["room_question"],
+                      header + chatlib.RECORD_DELIMITER + question.payload())
+    rooms.set_deadline(room, time.monotonic() + ANSWER_TIME)
+
+
+def handle_room_answer(conn: socket.socket, room, answer_id):
+    """
+    Records a player's answer to the current question of its room. The result is only sent when the question
+    ends, to all the players together.
+    """
+    player = room.members[conn]
+    if room.state != ASKING:
+        send_error(conn, "The time to answer is over")
+        return
+    if player.answered:
+        send_error(conn, "Already answered")
+        return
+    player.answered = True
+    player.correct = room.question.answer_digest == answer_id
+    if player.correct:
+        player.points += CORRECT_ANSWER_POINTS
+        add_points(logged_users[conn], CORRECT_ANSWER_POINTS)
+    build_and_send_message(conn, chatlib.PROTOCOL_SERVER["answer_received"], "")
+    if room.everyone_answered():
+        finish_room_question(room)
+
+
+def finish_room_question(room):
+    """
+    Sends the players of a room the correct answer of the current question and the room's scoreboard, then waits
+    RESULTS_TIME seconds before the next question, or ends the game if it was the last one
+    """
+    room.state = SHOWING_RESULTS
+    records = [[room.question.question_id, room.question.correct_answer]]
+    records += [[player.username, str(player.points), "1" if player.correct else "0"] for player in room.scoreboard()]
+    broadcast_message(room.members, chatlib.PROTOCOL_SERVER["room_results"], chatlib.join_records(records))
+    if room.has_more_questions():
+        rooms.set_deadline(room, time.monotonic() + RESULTS_TIME)
+    else:
+        finish_room_game(room)
+
+
+def finish_room_game(room):
+    """
+    Sends the players of a room the final scoreboard and closes the room
+    """
+    records = [[room.name]] + [[player.username, str(player.points)] for player in room.scoreboard()]
+    broadcast_message(room.members, chatlib.PROTOCOL_SERVER["room_over"], chatlib.join_records(records))
+    rooms.close(room)
+
+
+def run_room_timers():
+    """
+    Moves on the rooms whose deadline passed: a question ends, or the next one is asked
+    """
+    for room in rooms.expired(time.monotonic()):
+        if room.state == ASKING:
+            finish_room_question(room)
+        else:
+            ask_room_question(room)
+
+
+# Command -> (handler, whether it gets the message data), built once instead of comparing every command in turn
+LOGGED_OUT_HANDLERS = {
+    chatlib.PROTOCOL_CLIENT["protocol"]: (handle_protocol_message, True),
+    chatlib.PROTOCOL_CLIENT["login_msg"]: (handle_login_message, True),
+    chatlib.PROTOCOL_CLIENT["signup_msg"]: (handle_sign_up_message, True),
+    chatlib.PROTOCOL_CLIENT["heartbeat"]: (handle_heartbeat_message, False),
+    chatlib.PROTOCOL_CLIENT["resume"]: (handle_resume_message, True),
+}
+LOGGED_IN_HANDLERS = {
+    chatlib.PROTOCOL_CLIENT["protocol"]: (handle_protocol_message, True),
+    chatlib.PROTOCOL_CLIENT["logout_msg"]: (handle_logout_request, False),
+    chatlib.PROTOCOL_CLIENT["highscore"]: (handle_highscore_message, False),
+    chatlib.PROTOCOL_CLIENT["highscore_page"]: (handle_highscore_page_message, True),
+    chatlib.PROTOCOL_CLIENT["user_score"]: (handle_getscore_message, False),
+    chatlib.PROTOCOL_CLIENT["logged_users"]: (handle_logged_message, False),
+    chatlib.PROTOCOL_CLIENT["question"]: (handle_question_message, False),
+    chatlib.PROTOCOL_CLIENT["send_answer"]: (handle_answer_message, True),
+    chatlib.PROTOCOL_CLIENT["questions"]: (handle_questions_message, True),
+    chatlib.PROTOCOL_CLIENT["send_answers"]: (handle_answers_message, True),
+    chatlib.PROTOCOL_CLIENT["heartbeat"]: (handle_heartbeat_message, False),
+    chatlib.PROTOCOL_CLIENT["join_room"]: (handle_join_room_message, True),
+    chatlib.PROTOCOL_CLIENT["leave_room"]: (handle_leave_room_message, False),
+    chatlib.PROTOCOL_CLIENT["subscribe"]: (handle_subscribe_message, True),
+}
+
+
+def run_periodic_tasks():
+    """
+    Runs the maintenance tasks that are due. Called from the loop of every server engine.
+    Each task is guarded on its own, so one that fails doesn't stop the others or the loop.
+    """
+    for task in PERIODIC_TASKS:
+        run_guarded(task)
+
+
+def run_guarded(task):
+    """
+    Runs a task of the server, logging what it raises instead of letting it stop the tasks after it
+    """
+    try:
+        task()
+    except Exception:
+        log.exception("[SERVER] %s failed", task.__name__)
+        metrics.count("periodic_task_errors")
+
+
+def maintain_leaderboards():
+    """
+    Reconciles the leaderboard with the store and takes the snapshot when they're due, on the first worker only
+    """
+    global last_reconcile
+    global last_snapshot
+    if worker_index != 0:
+        return
+    if time.monotonic() - last_reconcile >= LEADERBOARD_RECONCILE_INTERVAL:
+        last_reconcile = time.monotonic()
+        reconcile_leaderboard_in_background()
+    period_leaderboards.roll(time.time())  # so a new day starts empty even before anyone scores
+    if snapshot_file and time.monotonic() - last_snapshot >= snapshot_interval:
+        last_snapshot = time.monotonic()
+        take_snapshot()
+
+
+def refill_questions():
+    if question_refiller is None:
+        load_new_questions()
+    elif question_refiller.due(time.monotonic()):
+        start_question_refill()
+
+
+def flush_user_cache_if_due():
+    if user_cache.has_changes() and user_cache.flush_due():
+        flush_user_cache_in_background()
+
+
+def disconnect_timed_out_clients():
+    for conn in connection_manager.expired(time.monotonic()):
+        log.info("client timed out")
+        metrics.count("connections.timed_out")
+        handle_logout_message(conn)
+
+
+def log_pool_stats():
+    global last_pool_stats
+    if time.monotonic() - last_pool_stats >= POOL_STATS_INTERVAL:
+        last_pool_stats = time.monotonic()
+        log.info("[POOL] %s", worker_pool.stats())
+
+
+PERIODIC_TASKS = (maintain_leaderboards, refill_questions, flush_user_cache_if_due, disconnect_timed_out_clients,
+                  push_updates, log_pool_stats)
+
+
+def handle_received_messages(conn, messages):
+    """
+    Handles the messages parsed from a client in the order they were sent.
+    Messages that arrive while the storage works on an earlier message of the client wait for it to finish.
+    Disconnects the client if one of them is invalid.
+    """
+    try:
+        for i in range(len(messages)):
+            if worker_pool.is_busy(conn):
+                worker_pool.defer(conn, functools.partial(handle_received_messages, conn, messages[i:]))
+                break
+            cmd, data = messages[i]
+            if cmd is None:
+                raise Exception("invalid message")
+            handle_client_message(conn, cmd, data)
+            if conn not in client_sockets:
+                break  # logged out, the rest of the messages are dropped
+    except Exception as err:
+        handle_logout_message(conn)
+
+
+def limit_received(conn, messages):
+    """
+    Counts the messages received from a client against its read rate, see ConnectionManager.received
+    :return: seconds reading from the client is paused for by the rate limit, 0 if it isn't
+    """
+    wait = connection_manager.received(conn, len(messages), time.monotonic())
+    if wait:
+        metrics.count("connections.throttled")
+    return wait
+
+
+def disconnect_slow_clients():
+    """
+    Disconnects the clients whose outgoing data went over the limit, because they don't read it
+    """
+    while slow_sockets:
+        conn = slow_sockets.pop()
+        if conn in client_sockets:
+            log.info("client disconnected for not reading its messages")
+            metrics.count("connections.too_slow")
+            handle_logout_message(conn)
+
+
+def refuse_connection(conn):
+    """
+    Closes a new client connection because the server has the max number of connections. The client is told
+    why first, the frame fits an empty socket buffer so sending it doesn't block.
+    """
+    metrics.count("connections.refused")
+    try:
+        conn.send(chatlib.build_frame(chatlib.PROTOCOL_SERVER["error_msg"], "too many connections, try again later"))
+    except OSError:
+        pass
+    conn.close()
+
+
+def loop_timeout(timeout):
+    """
+    :param timeout: seconds between checks of the periodic tasks
+    :return: seconds the event loop may wait, so the periodic tasks run, and rate limited clients are read again
+    and the room timers run on time
+    """
+    for deadline in (connection_manager.next_resume(), rooms.next_deadline()):
+        if deadline is not None:
+            timeout = min(timeout, max(0, deadline - time.monotonic()))
+    return timeout
+
+
+def run_select_server():
+    """
+    Serves the clients from a single select() loop
+    """
     server_socket = setup_socket()
+    listening_sockets = [server_socket, worker_pool.wakeup_socket]
+    admin_socket = None
+    if admin_port is not None:
+        admin_socket = socket.create_server((ADMIN_IP, admin_port))
+        listening_sockets.append(admin_socket)
     while True:
-        ready_to_read, ready_to_write, in_error = select.select([server_socket] + client_sockets, client_sockets, [])
+        readable_sockets = client_sockets
+        if connection_manager.paused:
+            readable_sockets = [conn for conn in client_sockets if conn not in connection_manager.paused]
+        ready_to_read, ready_to_write, in_error = select.select(
+            listening_sockets + readable_sockets, list(sockets_to_write), [], loop_timeout(SELECT_TIMEOUT))
+        iteration_start = time.perf_counter()
+        connection_manager.resume_throttled(time.monotonic())
+        run_guarded(run_room_timers)
+        run_periodic_tasks()
         for curr_socket in ready_to_read:
-            if curr_socket is server_socket:
+            if curr_socket is worker_pool.wakeup_socket:
+                worker_pool.run_completions()
+            elif curr_socket is admin_socket:
+                send_metrics_report(admin_socket.accept()[0])
+            elif curr_socket.fileno() == -1:
+                continue  # disconnected while handling the sockets before it
+            elif curr_socket is server_socket:
                 client_socket, client_address = server_socket.accept()
-                print("new client joined")
+                if not connection_manager.can_accept():
+                    refuse_connection(client_socket)
+                    continue
+                client_socket.setblocking(False)  # a client that doesn't read must not stall the loop in send
+                log.debug("new client joined")
                 client_sockets.append(client_socket)
+                connection_manager.add(client_socket, time.monotonic())
                 print_client_sockets(client_sockets)
             else:
-                print("new data from client")
                 try:
-                    cmd, data = recv_message_and_parse(curr_socket)
-                    if cmd is None:
-                        raise Exception("invalid message")
-                    handle_client_message(curr_socket, cmd, data)
-                except Exception as err:
-                    handle_logout_message(curr_socket)
-            for message in messages_to_send:
-                current_socket, data = message
-                if current_socket in ready_to_write:
-                    current_socket.send(data.encode())
-                    messages_to_send.remove(message)
+                    messages = recv_messages_and_parse(curr_socket)
+                except OSError:
+                    messages = [(None, None)]
+                limit_received(curr_socket, messages)
+                handle_received_messages(curr_socket, messages)
+        for curr_socket in ready_to_write:
+            if curr_socket not in sockets_to_write:
+                continue  # disconnected while handling the read sockets
+            try:
+                send_queued_data(curr_socket)
+            except OSError:
+                handle_logout_message(curr_socket)
+        disconnect_slow_clients()
+        metrics.observe("loop.iteration", time.perf_counter() - iteration_start)
+
+
+def send_metrics_report(admin_conn: socket.socket):
+    """
+    Answers a connection to the admin port with the metrics report, then closes it.
+    The report is small, so it is sent with a blocking call.
+    """
+    try:
+        admin_conn.sendall(metrics.report().encode())
+    except OSError:
+        pass
+    finally:
+        admin_conn.close()
+
+
+def register_gauges():
+    """
+    Adds the gauges of the server's state to the metrics, they are only read when a report is made
+    """
+    metrics.add_gauge("clients", lambda: len(client_sockets))
+    metrics.add_gauge("logged_users", lambda: len(logged_users))
+    metrics.add_gauge("resume_tokens", lambda: len(resume_tokens))
+    metrics.add_gauge("outgoing_bytes", lambda: sum(len(buffer) for buffer in outgoing_data.values()))
+    metrics.add_gauge("sockets_to_write", lambda: len(sockets_to_write))
+    metrics.add_gauge("connections.paused", lambda: len(connection_manager.paused))
+    metrics.add_gauge("storage_jobs_pending", lambda: worker_pool.pending)
+    metrics.add_gauge("questions", lambda: len(questions))
+    metrics.add_gauge("rooms", lambda: len(rooms))
+    for topic in chatlib.PUSH_TOPICS:
+        metrics.add_gauge("subscribers." + topic, functools.partial(len, subscribers[topic]))
+    metrics.add_gauge("user_cache_has_changes", lambda: int(user_cache.has_changes()))
+
+
+class AsyncClientConnection:
+    """
+    A client connection of the asyncio engine. It is used by the message handlers the same way a client
+    socket is used by the select engine, and its outgoing data is written by its own writer task.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self.has_data = asyncio.Event()
+        self.drained = asyncio.Event()  # set when the writer task sent what was waiting
+
+    def getpeername(self):
+        return self.writer.get_extra_info("peername")
+
+    def close(self):
+        self.closed = True
+        self.has_data.set()
+        self.drained.set()
+
+    async def wait_resumed(self):
+        """
+        Waits while reading from the connection is paused, until the writer task sent enough of its output or its
+        rate limit pause ended
+        """
+        while self in connection_manager.paused and not self.closed:
+            self.drained.clear()
+            try:
+                await asyncio.wait_for(self.drained.wait(), PAUSE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            connection_manager.resume_throttled(time.monotonic())
+
+    async def write_loop(self):
+        """
+        Writes the connection's outgoing data to the client, in one write per wake up, until it is closed
+        """
+        try:
+            while True:
+                await self.has_data.wait()
+                self.has_data.clear()
+                if self.closed:
+                    break
+                buffer = outgoing_data.get(self)
+                if buffer:
+                    self.writer.write(bytes(buffer))
+                    buffer.clear()
+                await self.writer.drain()
+                if self in connection_manager.paused:
+                    connection_manager.output_changed(self, len(outgoing_data.get(self, b"")))
+                    self.drained.set()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.writer.close()
+
+
+def dispatch_async_messages():
+    """
+    Wakes up the writer tasks of the asyncio connections that have outgoing data
+    """
+    disconnect_slow_clients()
+    for conn in sockets_to_write:
+        conn.has_data.set()
+    sockets_to_write.clear()
+
+
+async def serve_async_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Reader task of a single client of the asyncio engine
+    """
+    if not connection_manager.can_accept():
+        metrics.count("connections.refused")
+        writer.write(chatlib.build_frame(chatlib.PROTOCOL_SERVER["error_msg"], "too many connections, try again later"))
+        writer.close()
+        return
+    conn = AsyncClientConnection(reader, writer)
+    async_client_tasks.add(asyncio.current_task())
+    client_sockets.append(conn)
+    connection_manager.add(conn, time.monotonic())
+    log.debug("new client joined")
+    writer_task = asyncio.create_task(conn.write_loop())
+    try:
+        while conn in client_sockets:
+            try:
+                messages = parse_received(conn, await reader.read(RECV_BUFFER_SIZE))
+            except (ConnectionError, OSError):
+                messages = [(None, None)]
+            if conn not in client_sockets:
+                break  # disconnected by the server while waiting, for a timeout or too much output
+            iteration_start = time.perf_counter()
+            wait = limit_received(conn, messages)
+            handle_received_messages(conn, messages)
+            dispatch_async_messages()
+            metrics.observe("loop.iteration", time.perf_counter() - iteration_start)
+            if wait:
+                await asyncio.sleep(wait)
+                connection_manager.resume_throttled(time.monotonic())
+            if conn in connection_manager.paused:
+                await conn.wait_resumed()
+    finally:
+        if conn in client_sockets:
+            handle_logout_message(conn)
+            dispatch_async_messages()
+        await writer_task
+        async_client_tasks.discard(asyncio.current_task())
+
+
+async def serve_async_admin(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Answers a connection to the admin port with the metrics report, in the asyncio engine
+    """
+    writer.write(metrics.report().encode())
+    try:
+        await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    writer.close()
+
+
+def run_async_completions():
+    worker_pool.run_completions()
+    dispatch_async_messages()
+
+
+async def run_periodic_tasks_async():
+    while True:
+        await asyncio.sleep(loop_timeout(PERIODIC_TASKS_INTERVAL))
+        run_guarded(run_room_timers)
+        run_periodic_tasks()
+        run_guarded(dispatch_async_messages)
+
+
+async def run_asyncio_server():
+    """
+    Serves the clients from an asyncio event loop, with a reader and a writer task per client.
+    SIGTERM and ^C cancel it, and it returns once its tasks are stopped.
+    """
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        if signal.getsignal(signum) is not signal.SIG_IGN:  # workers leave ^C to the main process
+            loop.add_signal_handler(signum, asyncio.current_task().cancel)
+    server = await asyncio.start_server(serve_async_client, SERVER_IP, SERVER_PORT, reuse_port=reuse_port)
+    loop.add_reader(worker_pool.wakeup_socket, run_async_completions)
+    if admin_port is not None:
+        await asyncio.start_server(serve_async_admin, ADMIN_IP, admin_port)
+    periodic_tasks = asyncio.create_task(run_periodic_tasks_async())
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        log.info("stopping")
+    finally:
+        periodic_tasks.cancel()
+        # The clients are disconnected so their tasks end by themselves, instead of being cancelled by asyncio.run
+        for conn in list(client_sockets):
+            handle_logout_message(conn)
+        dispatch_async_messages()
+        await asyncio.wait([periodic_tasks, *async_client_tasks], timeout=ASYNC_STOP_TIMEOUT)
+        loop.remove_reader(worker_pool.wakeup_socket)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Trivia game server")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="default: %(default)s")
+    parser.add_argument("--engine", choices=SERVER_ENGINES, default="select",
+                        help="how client connections are served (default: select)")
+    parser.add_argument("--storage", choices=user_storage.STORAGE_BACKENDS, default="firestore",
+                        help="where the users are kept (default: firestore)")
+    parser.add_argument("--storage-location",
+                        help="SQLite database file, or Firestore credentials file (default: the backend's default)")
+    parser.add_argument("--storage-workers", type=int, default=STORAGE_WORKERS,
+                        help="threads running storage calls (default: %(default)s)")
+    parser.add_argument("--questions-file", default=QUESTIONS_FILE,
+                        help="where the question bank is saved (default: %(default)s)")
+    parser.add_argument("--questions-source",
+                        help="JSON file to take questions from instead of the trivia API")
+    parser.add_argument("--admin-port", type=int,
+                        help="local port answering every connection with the metrics report. Worker processes use "
+                             "this port plus their index (default: disabled)")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="WARNING",
+                        help="DEBUG prints every message (default: %(default)s)")
+    parser.add_argument("--password-workers", type=int,
+                        help="processes hashing passwords (default: the CPUs divided between the worker processes)")
+    parser.add_argument("--password-iterations", type=int, default=HASH_ITERATIONS,
+                        help="PBKDF2 iterations of new password hashes, older hashes with less are made again on login "
+                             "(default: %(default)s)")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="client connections served at once by every worker process, more are refused "
+                             "(default: %(default)s)")
+    parser.add_argument("--login-timeout", type=float, default=LOGIN_TIMEOUT,
+                        help="seconds a new client has to log in before it's disconnected (default: %(default)s)")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds a logged in client may send nothing, PING included, before it's disconnected "
+                             "(default: %(default)s)")
+    parser.add_argument("--read-rate", type=float, default=READ_RATE,
+                        help="messages per second a client may send on average, reading from it is paused when it "
+                             "sends more (default: %(default)s)")
+    parser.add_argument("--max-outgoing-bytes", type=int, default=MAX_OUTGOING_BYTES,
+                        help="unsent bytes a client may have waiting before it's disconnected for not reading them "
+                             "(default: %(default)s)")
+    parser.add_argument("--snapshot-file", default=SNAPSHOT_FILE,
+                        help="where the leaderboards and the resume tokens are saved, and restored from at startup. "
+                             "An empty string disables the snapshots (default: %(default)s)")
+    parser.add_argument("--snapshot-interval", type=float, default=SNAPSHOT_INTERVAL,
+                        help="seconds between snapshots (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes serving the clients, sharing the port with SO_REUSEPORT. Rooms "
+                             "are only available with a single process (default: %(default)s)")
+    return parser.parse_args()
+
+
+def run_server(args):
+    """
+    Serves the clients with the chosen engine until interrupted, then writes the pending user changes
+    """
+    global storage
+    global worker_pool
+    global password_pool
+    global last_reconcile
+    global connection_manager
+    connection_manager = ConnectionManager(args.max_connections, args.login_timeout, args.idle_timeout,
+                                           read_rate=args.read_rate, read_burst=2 * args.read_rate,
+                                           outgoing_pause_bytes=min(OUTGOING_PAUSE_BYTES, args.max_outgoing_bytes // 2),
+                                           max_outgoing_bytes=args.max_outgoing_bytes)
+    storage = user_storage.open_storage(args.storage, args.storage_location)
+    worker_pool = WorkerPool(args.storage_workers, metrics=metrics)
+    password_pool = ProcessPoolExecutor(args.password_workers or max(1, (os.cpu_count() or 1) // args.processes),
+                                        multiprocessing.get_context("spawn"))
+    register_gauges()
+    if worker_index == 0 and not snapshot_loaded:
+        reconcile_leaderboard()  # a restored leaderboard is reconciled by the first periodic tasks instead
+        last_reconcile = time.monotonic()
+    try:
+        if args.engine == "asyncio":
+            asyncio.run(run_asyncio_server())  # returns when stopped by a signal, the client tasks cancelled
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)  # already stopping, like stop_worker does
+        else:
+            run_select_server()
+    finally:
+        # Each step is guarded on its own, so the pending user changes and the snapshot are saved even if one fails
+        cleanups = [worker_pool.shutdown, password_pool.shutdown, flush_user_cache]
+        if worker_index == 0 and snapshot_file:
+            cleanups.append(save_final_snapshot)
+        cleanups.append(storage.close)
+        for cleanup in cleanups:
+            run_guarded(cleanup)
+
+
+def save_final_snapshot():
+    """
+    Saves the snapshot when the server stops, blocking until it's written
+    """
+    try:
+        write_snapshot(snapshot_file, leaderboard.records(), resume_tokens.records(), time.time(),
+                       period_leaderboards.snapshot())
+    except Exception as err:
+        log.error("failed writing the snapshot: %s", err)
+
+
+def run_worker(index, args, coordinator_address, authkey, versions):
+    """
+    Entry point of a worker process. The logged users and the leaderboard are taken from the coordinator,
+    and only the first worker refills the question bank, which the others follow through the store.
+    """
+    global worker_index
+    global reuse_port
+    global logged_users
+    global leaderboard
+    global period_leaderboards
+    global resume_tokens
+    global question_refiller
+    global admin_port
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the main process stops the workers with SIGTERM
+    signal.signal(signal.SIGTERM, stop_worker)
+    worker_index = index
+    reuse_port = True
+    if admin_port is not None:
+        admin_port += index
+    state = connect_coordinator(coordinator_address, authkey)
+    logged_users = SharedSessions(state, versions, index)
+    leaderboard = SharedLeaderboard(state, versions)
+    period_leaderboards = SharedPeriodLeaderboards(state)
+    resume_tokens = SharedResumeTokens(state)
+    if index != 0:
+        question_refiller = None
+    questions.extend(question_store.load())  # what an earlier worker saved, when restarted
+    try:
+        run_server(args)
+    except KeyboardInterrupt:
+        pass
+
+
+def stop_worker(signum, frame):
+    """
+    SIGTERM handler of the server processes. Stops them like ^C does, so the pending user changes are written.
+    The asyncio engine replaces it while its loop runs, see run_asyncio_server.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def run_worker_processes(args):
+    """
+    Serves the clients from several worker processes. Each worker runs the chosen engine on its own listening
+    socket bound with SO_REUSEPORT, so the kernel spreads the new connections between them. The logged users and
+    the leaderboard are kept by a coordinator process all the workers call, so LOGGED and HIGHSCORE answer the
+    same at every worker. The snapshot is restored into the coordinator before the workers start, and saved by
+    the first worker. Workers that exit are started again.
+    """
+    global leaderboard
+    global period_leaderboards
+    global resume_tokens
+    global snapshot_loaded
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("running several worker processes needs SO_REUSEPORT, which this platform doesn't have")
+    signal.signal(signal.SIGTERM, stop_worker)  # stopping the main process stops the workers too
+    context = multiprocessing.get_context("fork")
+    manager, versions = start_coordinator()
+    authkey = multiprocessing.current_process().authkey
+    state = manager.get_state()
+    if snapshot_file:
+        leaderboard = SharedLeaderboard(state, versions)
+        period_leaderboards = SharedPeriodLeaderboards(state)
+        resume_tokens = SharedResumeTokens(state)
+        snapshot_loaded = load_snapshot()
+    workers = {}  # index -> worker process
+
+    def start_worker(index):
+        worker = context.Process(target=run_worker, name="worker-" + str(index),
+                                 args=(index, args, manager.address, bytes(authkey), versions))
+        worker.start()
+        workers[index] = worker
+
+    try:
+        for index in range(args.processes):
+            start_worker(index)
+        while True:
+            sentinels = {worker.sentinel: index for index, worker in workers.items()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels)):
+                index = sentinels[sentinel]
+                workers[index].join()
+                log.warning("worker %d exited with code %s, %d users logged out", index, workers[index].exitcode,
+                            state.logout_worker(index))
+                time.sleep(WORKER_RESTART_DELAY)
+                start_worker(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers.values():
+            worker.join()
+        manager.shutdown()
+
+
+def main():
+    # Initializes global users and questions dicionaries using load functions, will be used later
+    global users
+    global questions
+    global question_store
+    global question_refiller
+    global SERVER_PORT
+    global admin_port
+    global password_iterations
+    global snapshot_file
+    global snapshot_interval
+    global snapshot_loaded
+    args = parse_arguments()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    SERVER_PORT = args.port
+    admin_port = args.admin_port
+    password_iterations = args.password_iterations
+    snapshot_file = args.snapshot_file or None
+    snapshot_interval = args.snapshot_interval
+    question_store = QuestionStore(args.questions_file)
+    question_refiller = QuestionRefiller(question_store, FileFetcher(args.questions_source)
+                                         if args.questions_source else OpenTdbFetcher())
+    questions = QuestionBank(load_questions(question_store, question_refiller.fetcher))
+    print("Welcome to Trivia Server!")
+    if args.processes > 1:
+        run_worker_processes(args)
+    else:
+        signal.signal(signal.SIGTERM, stop_worker)  # so the password processes are stopped and the changes written
+        if snapshot_file:
+            snapshot_loaded = load_snapshot()
+        try:
+            run_server(args)
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+##############################################################################
+# sessions.py
+##############################################################################
+
+import hashlib
+import secrets
+
+RESUME_TOKEN_LIFETIME = 24 * 60 * 60  # seconds a resume token can be used for
+RESUME_TOKEN_BYTES = 24
+
+
+class SessionRegistry:
+    """
+    The logged in users, indexed both ways (socket <-> user id <-> username), so finding the user of a socket,
+    the socket of a user and whether a username is logged in are all dictionary lookups.
+    A user is logged in from one socket at a time.
+    """
+
+    def __init__(self):
+        self._by_socket = {}  # socket -> (user id, username)
+        self._by_user_id = {}  # user id -> socket
+        self._by_username = {}  # username -> user id
+        self.version = 0  # grows on every login and logout, so views of the logged users know when to rebuild
+
+    def __len__(self):
+        return len(self._by_socket)
+
+    def __contains__(self, conn):
+        return conn in self._by_socket
+
+    def __getitem__(self, conn):
+        """
+        :return: the user id logged in from the socket
+        """
+        return self._by_socket[conn][0]
+
+    def add(self, conn, user_id, username):
+        """
+        Logs a user in from a socket
+        :raise ValueError: if the socket or the user is already logged in
+        """
+        if conn in self._by_socket or user_id in self._by_user_id or username in self._by_username:
+            raise ValueError("already logged in")
+        self._by_socket[conn] = (user_id, username)
+        self._by_user_id[user_id] = conn
+        self._by_username[username] = user_id
+        self.version += 1
+
+    def remove(self, conn):
+        """
+        Logs out the user of a socket
+        :return: the user id that was logged in from the socket, or None if it wasn't logged in
+        """
+        session = self._by_socket.pop(conn, None)
+        if session is None:
+            return None
+        user_id, username = session
+        del self._by_user_id[user_id]
+        del self._by_username[username]
+        self.version += 1
+        return user_id
+
+    def username(self, conn):
+        return self._by_socket[conn][1]
+
+    def socket_of(self, user_id):
+        """
+        :return: the socket the user is logged in from, or None if it isn't logged in
+        """
+        return self._by_user_id.get(user_id)
+
+    def has_user(self, user_id):
+        return user_id in self._by_user_id
+
+    def has_username(self, username):
+        return username in self._by_username
+
+    def usernames(self):
+        return list(self._by_username)
+
+
+class ResumeTokens:
+    """
+    The resume tokens of the users, given on login so a client that lost its connection can log in again with
+    RESUME instead of its password. Only digests of the tokens are kept, so the snapshot they're saved in can't be
+    used to log in. A user has one token at a time, every login gives a new one, so a token works until the
+    user logs in again.
+    """
+
+    def __init__(self, lifetime=RESUME_TOKEN_LIFETIME):
+        self.lifetime = lifetime
+        self._tokens = {}  # token digest -> (user id, username, expiry as a wall clock time)
+        self._by_user_id = {}  # user id -> its token digest
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def issue(self, user_id, username, now):
+        """
+        Gives a user a new token, replacing its old one
+        :param now: time.time(), tokens outlive the server so their expiry is a wall clock time
+        :return: the token
+        """
+        self.revoke(user_id)
+        token = secrets.token_urlsafe(RESUME_TOKEN_BYTES)
+        digest = token_digest(token)
+        self._tokens[digest] = (user_id, username, now + self.lifetime)
+        self._by_user_id[user_id] = digest
+        return token
+
+    def find(self, token, now):
+        """
+        :return: (user id, username) of the token, None if there is no such token or it expired
+        """
+        session = self._tokens.get(token_digest(token))
+        if session is None:
+            return None
+        user_id, username, expiry = session
+        if expiry <= now:
+            self.revoke(user_id)
+            return None
+        return user_id, username
+
+    def revoke(self, user_id):
+        digest = self._by_user_id.pop(user_id, None)
+        if digest is not None:
+            del self._tokens[digest]
+
+    def records(self):
+        """
+        :return: list of (token digest, user id, username, expiry) of every token, as taken by load
+        """
+        return [(digest, user_id, username, expiry) for digest, (user_id, username, expiry) in self._tokens.items()]
+
+    def load(self, records, now):
+        """
+        Adds the tokens of records, skipping the expired ones
+        :return: number of tokens added
+        """
+        added = 0
+        for digest, user_id, username, expiry in records:
+            if expiry > now:
+                self.revoke(user_id)
+                self._tokens[digest] = (user_id, username, expiry)
+                self._by_user_id[user_id] = digest
+                added += 1
+        return added
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
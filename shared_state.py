@@ -0,0 +1,373 @@
+##############################################################################
+# shared_state.py
+##############################################################################
+
+import threading
+import multiprocessing
+from multiprocessing.managers import BaseManager
+from leaderboard import Leaderboard, PeriodLeaderboards
+from sessions import SessionRegistry, ResumeTokens
+
+SESSIONS_VERSION = 0  # index of the version of the logged users in the shared versions array
+LEADERBOARD_VERSION = 1  # index of the version of the leaderboard in the shared versions array
+
+_shared_state = None  # the SharedState of the coordinator process
+
+
+class SharedState:
+    """
+    The state every worker process of the server must see the same: who is logged in, the leaderboards and the
+    resume tokens.
+    It lives in the coordinator process and the workers call it through proxies. Its versions are also kept
+    in shared memory, so a worker can tell whether its cached view is still current without calling it.
+    """
+
+    def __init__(self, versions):
+        """
+        :param versions: shared multiprocessing.Array of the versions, see SESSIONS_VERSION and LEADERBOARD_VERSION
+        """
+        self._versions = versions
+        self._lock = threading.Lock()  # the manager serves every worker from its own thread
+        self._sessions = {}  # user id -> (username, index of the worker the user is logged in at)
+        self._usernames = {}  # username -> user id
+        self._leaderboard = Leaderboard()
+        self._periods = PeriodLeaderboards()
+        self._resume_tokens = ResumeTokens()
+
+    def _sessions_changed(self):
+        self._versions[SESSIONS_VERSION] += 1
+
+    def _leaderboard_changed(self):
+        self._versions[LEADERBOARD_VERSION] = self._leaderboard.version
+
+    def login(self, user_id, username, worker):
+        """
+        :return: True if the user was logged in, False if it's already logged in at some worker
+        """
+        with self._lock:
+            if user_id in self._sessions or username in self._usernames:
+                return False
+            self._sessions[user_id] = (username, worker)
+            self._usernames[username] = user_id
+            self._sessions_changed()
+            return True
+
+    def logout(self, user_id):
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session is not None:
+                del self._usernames[session[0]]
+                self._sessions_changed()
+
+    def logout_worker(self, worker):
+        """
+        Logs out all the users of a worker, used when the worker process exited
+        :return: number of users logged out
+        """
+        with self._lock:
+            user_ids = [user_id for user_id, (username, user_worker) in self._sessions.items() if user_worker == worker]
+            for user_id in user_ids:
+                del self._usernames[self._sessions.pop(user_id)[0]]
+            if user_ids:
+                self._sessions_changed()
+            return len(user_ids)
+
+    def has_username(self, username):
+        return username in self._usernames
+
+    def usernames(self):
+        with self._lock:
+            return list(self._usernames)
+
+    def update_score(self, user_id, username, score, timestamp, only_new=False):
+        """
+        See Leaderboard.update
+        :param only_new: change nothing if the user is already ranked
+        """
+        with self._lock:
+            if only_new and user_id in self._leaderboard:
+                return False
+            changed = self._leaderboard.update(user_id, username, score, timestamp)
+            self._leaderboard_changed()
+            return changed
+
+    def remove_score(self, user_id):
+        with self._lock:
+            self._leaderboard.remove(user_id)
+            self._leaderboard_changed()
+
+    def is_ranked(self, user_id):
+        return user_id in self._leaderboard
+
+    def rank(self, user_id):
+        with self._lock:
+            return self._leaderboard.rank(user_id)
+
+    def score(self, user_id):
+        with self._lock:
+            return self._leaderboard.score(user_id)
+
+    def top(self, count, start=0):
+        with self._lock:
+            return self._leaderboard.top(count, start)
+
+    def leaderboard_page(self, user_id, count, start):
+        with self._lock:
+            return self._leaderboard.page(user_id, count, start)
+
+    def reconcile(self, records, skip):
+        """
+        See Leaderboard.reconcile. The users logged in at any worker are skipped as well.
+        """
+        with self._lock:
+            changed = self._leaderboard.reconcile(records, set(skip) | set(self._sessions))
+            self._leaderboard_changed()
+            return changed
+
+    def load_leaderboard(self, records):
+        with self._lock:
+            self._leaderboard.load(records)
+            self._leaderboard_changed()
+
+    def leaderboard_records(self):
+        with self._lock:
+            return self._leaderboard.records()
+
+    def add_period_points(self, user_id, username, points, now):
+        with self._lock:
+            self._periods.add_points(user_id, username, points, now)
+
+    def roll_periods(self, now):
+        with self._lock:
+            self._periods.roll(now)
+
+    def period_page(self, name, user_id, count, start):
+        with self._lock:
+            return self._periods.page(name, user_id, count, start)
+
+    def period_snapshot(self):
+        with self._lock:
+            return self._periods.snapshot()
+
+    def restore_periods(self, snapshot, now):
+        with self._lock:
+            return self._periods.restore(snapshot, now)
+
+    def issue_token(self, user_id, username, now):
+        with self._lock:
+            return self._resume_tokens.issue(user_id, username, now)
+
+    def find_token(self, token, now):
+        with self._lock:
+            return self._resume_tokens.find(token, now)
+
+    def revoke_token(self, user_id):
+        with self._lock:
+            self._resume_tokens.revoke(user_id)
+
+    def token_count(self):
+        return len(self._resume_tokens)
+
+    def token_records(self):
+        with self._lock:
+            return self._resume_tokens.records()
+
+    def load_tokens(self, records, now):
+        with self._lock:
+            return self._resume_tokens.load(records, now)
+
+
+def _create_shared_state(versions):
+    global _shared_state
+    _shared_state = SharedState(versions)
+
+
+def _get_shared_state():
+    return _shared_state
+
+
+class SharedStateManager(BaseManager):
+    pass
+
+
+SharedStateManager.register("get_state", callable=_get_shared_state)
+
+
+def start_coordinator():
+    """
+    Starts the coordinator process, serving the SharedState to the workers over a UNIX socket
+    :return: the started SharedStateManager and the shared versions array
+    """
+    context = multiprocessing.get_context("fork")
+    versions = context.Array("q", 2, lock=False)
+    manager = SharedStateManager(ctx=context)
+    manager.start(_create_shared_state, (versions,))
+    return manager, versions
+
+
+def connect_coordinator(address, authkey):
+    """
+    :return: proxy of the SharedState of a running coordinator, for a worker process
+    """
+    manager = SharedStateManager(address, authkey)
+    manager.connect()
+    return manager.get_state()
+
+
+class SharedSessions:
+    """
+    The SessionRegistry of a worker process. The sockets of this worker are indexed locally, and logins,
+    the username index and the list of logged users go through the coordinator so they cover all the workers.
+    has_user and socket_of answer for the users logged in at this worker.
+    """
+
+    def __init__(self, state, versions, worker):
+        self._state = state
+        self._versions = versions
+        self._worker = worker
+        self._local = SessionRegistry()
+
+    @property
+    def version(self):
+        return self._versions[SESSIONS_VERSION]
+
+    def __len__(self):
+        return len(self._local)
+
+    def __contains__(self, conn):
+        return conn in self._local
+
+    def __getitem__(self, conn):
+        return self._local[conn]
+
+    def add(self, conn, user_id, username):
+        """
+        :raise ValueError: if the socket or the user is already logged in, at any worker
+        """
+        if conn in self._local or not self._state.login(user_id, username, self._worker):
+            raise ValueError("already logged in")
+        self._local.add(conn, user_id, username)
+
+    def remove(self, conn):
+        user_id = self._local.remove(conn)
+        if user_id is not None:
+            self._state.logout(user_id)
+        return user_id
+
+    def username(self, conn):
+        return self._local.username(conn)
+
+    def socket_of(self, user_id):
+        return self._local.socket_of(user_id)
+
+    def has_user(self, user_id):
+        return self._local.has_user(user_id)
+
+    def has_username(self, username):
+        return self._state.has_username(username)
+
+    def usernames(self):
+        return self._state.usernames()
+
+
+class SharedLeaderboard:
+    """
+    The Leaderboard of a worker process, kept by the coordinator so all the workers rank the same users
+    """
+
+    def __init__(self, state, versions):
+        self._state = state
+        self._versions = versions
+
+    @property
+    def version(self):
+        return self._versions[LEADERBOARD_VERSION]
+
+    def __contains__(self, user_id):
+        return self._state.is_ranked(user_id)
+
+    def update(self, user_id, username, score, timestamp):
+        return self._state.update_score(user_id, username, score, timestamp)
+
+    def add(self, user_id, username, score, timestamp):
+        """
+        Ranks a user that isn't ranked yet, in one call to the coordinator
+        """
+        return self._state.update_score(user_id, username, score, timestamp, True)
+
+    def remove(self, user_id):
+        self._state.remove_score(user_id)
+
+    def rank(self, user_id):
+        return self._state.rank(user_id)
+
+    def score(self, user_id):
+        return self._state.score(user_id)
+
+    def top(self, count, start=0):
+        return self._state.top(count, start)
+
+    def reconcile(self, records, skip=()):
+        records = list(records)
+        skipped = [record[0] for record in records if record[0] in skip]
+        return self._state.reconcile(records, skipped)
+
+    def load(self, records):
+        self._state.load_leaderboard(list(records))
+
+    def page(self, user_id, count, start=None):
+        return self._state.leaderboard_page(user_id, count, start)
+
+    def records(self):
+        return self._state.leaderboard_records()
+
+
+class SharedPeriodLeaderboards:
+    """
+    The PeriodLeaderboards of a worker process, kept by the coordinator
+    """
+
+    def __init__(self, state):
+        self._state = state
+
+    def roll(self, now):
+        self._state.roll_periods(now)
+
+    def add_points(self, user_id, username, points, now):
+        self._state.add_period_points(user_id, username, points, now)
+
+    def page(self, name, user_id, count, start=None):
+        return self._state.period_page(name, user_id, count, start)
+
+    def snapshot(self):
+        return self._state.period_snapshot()
+
+    def restore(self, snapshot, now):
+        return self._state.restore_periods(snapshot, now)
+
+
+class SharedResumeTokens:
+    """
+    The ResumeTokens of a worker process, kept by the coordinator so a client can resume its session at any worker
+    """
+
+    def __init__(self, state):
+        self._state = state
+
+    def __len__(self):
+        return self._state.token_count()
+
+    def issue(self, user_id, username, now):
+        return self._state.issue_token(user_id, username, now)
+
+    def find(self, token, now):
+        return self._state.find_token(token, now)
+
+    def revoke(self, user_id):
+        self._state.revoke_token(user_id)
+
+    def records(self):
+        return self._state.token_records()
+
+    def load(self, records, now):
+        return self._state.load_tokens(records, now)
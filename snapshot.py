@@ -0,0 +1,48 @@
+##############################################################################
+# snapshot.py
+##############################################################################
+
+import json
+import os
+
+SNAPSHOT_FILE = "server_snapshot.json"
+SNAPSHOT_INTERVAL = 60  # seconds between snapshots of the live state
+SNAPSHOT_FORMAT = 1  # version of the snapshot layout, snapshots of another version are ignored
+
+
+def write_snapshot(path, leaderboard_records, token_records, now, periods=None):
+    """
+    Saves the live state of the server, replacing the file in one step so a crash while writing leaves the last
+    snapshot whole. Meant to run off the event loop.
+    :param leaderboard_records: see Leaderboard.records
+    :param token_records: see ResumeTokens.records
+    :param now: time.time() the snapshot was taken at
+    :param periods: see PeriodLeaderboards.snapshot
+    """
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "saved_at": now,
+        "leaderboard": leaderboard_records,
+        "periods": periods or {},
+        "resume_tokens": token_records,
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(",", ":"))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    """
+    :return: the snapshot dictionary saved by write_snapshot, or None if there is none or it can't be used
+    """
+    try:
+        with open(path, encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+        return None
+    return snapshot
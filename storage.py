@@ -0,0 +1,295 @@
+##############################################################################
+# storage.py
+##############################################################################
+
+import json
+import sqlite3
+import threading
+
+FIRESTORE_CREDENTIALS_FILE = "serviceAccountKey.json"
+FIRESTORE_DATABASE_URL = "https://python-trivia-mor-default-rtdb.firebaseio.com/"
+FIRESTORE_BATCH_SIZE = 500  # Max writes in a single Firestore batch
+SQLITE_DB_FILE = "trivia.db"
+
+
+class UserStorage:
+    """
+    Interface of a store of the game's users. A user is identified by a string id and its record is a
+    dictionary with the fields username, password, score, score_timestamp and questions_seen (bitmap of the
+    asked questions, see question_bank.QuestionDeck). Older records may have a questions_asked list instead.
+    """
+
+    def find_user(self, username):
+        """
+        :return: (user_id, record) of the user with the given username, or None if there is no such user
+        """
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        """
+        :return: the record of the user, or None if there is no such user
+        """
+        raise NotImplementedError
+
+    def create_user(self, record: dict):
+        """
+        Saves a new user
+        :return: the id of the new user
+        """
+        raise NotImplementedError
+
+    def create_users(self, records: list):
+        """
+        Saves new users in a batch, used by bulk imports. The usernames must not be taken.
+        :return: list of the ids of the new users
+        """
+        return [self.create_user(record) for record in records]
+
+    def sign_up_user(self, record: dict):
+        """
+        Saves a new user if its username isn't taken
+        :return: the id of the new user, or None if the username is taken
+        """
+        if self.find_user(record["username"]):
+            return None
+        return self.create_user(record)
+
+    def update_users(self, changes: dict):
+        """
+        Writes changed fields of users (score, questions asked...) in a batch
+        :param changes: dictionary of user id -> dictionary of changed fields
+        """
+        raise NotImplementedError
+
+    def leaderboard_records(self):
+        """
+        :return: iterable of (user_id, username, score, score_timestamp) of all the users
+        """
+        raise NotImplementedError
+
+    def usernames(self):
+        """
+        :return: iterable of the usernames of all the users
+        """
+        raise NotImplementedError
+
+    def all_users(self):
+        """
+        :return: iterable of (user_id, record) of all the users, read from the store while it's iterated
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FirestoreStorage(UserStorage):
+    """
+    Users kept in the 'users' collection of Firestore
+    """
+
+    def __init__(self, credentials_file=FIRESTORE_CREDENTIALS_FILE, database_url=FIRESTORE_DATABASE_URL):
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_file), {"databaseURL": database_url})
+        self._db = firestore.client()
+        self._users_collection = self._db.collection("users")
+
+    def find_user(self, username):
+        users = self._users_collection.where("username", "==", username).limit(1).get()
+        if not users:
+            return None
+        return users[0].id, users[0].to_dict()
+
+    def get_user(self, user_id):
+        user = self._users_collection.document(user_id).get()
+        if not user.exists:
+            return None
+        return user.to_dict()
+
+    def create_user(self, record: dict):
+        doc_ref = self._users_collection.document()
+        doc_ref.set(record)
+        return doc_ref.id
+
+    def create_users(self, records: list):
+        user_ids = []
+        batch = self._db.batch()
+        for record in records:
+            doc_ref = self._users_collection.document()
+            batch.set(doc_ref, record)
+            user_ids.append(doc_ref.id)
+            if len(user_ids) % FIRESTORE_BATCH_SIZE == 0:
+                batch.commit()
+                batch = self._db.batch()
+        if len(user_ids) % FIRESTORE_BATCH_SIZE:
+            batch.commit()
+        return user_ids
+
+    def update_users(self, changes: dict):
+        batch = self._db.batch()
+        batch_size = 0
+        for user_id, fields in changes.items():
+            batch.update(self._users_collection.document(user_id), fields)
+            batch_size += 1
+            if batch_size == FIRESTORE_BATCH_SIZE:
+                batch.commit()
+                batch = self._db.batch()
+                batch_size = 0
+        if batch_size:
+            batch.commit()
+
+    def leaderboard_records(self):
+        for user in self._users_collection.select(["username", "score", "score_timestamp"]).stream():
+            user_data = user.to_dict()
+            yield user.id, user_data.get("username"), user_data.get("score", 0), user_data.get("score_timestamp")
+
+    def usernames(self):
+        for user in self._users_collection.select(["username"]).stream():
+            yield user.get("username")
+
+    def all_users(self):
+        for user in self._users_collection.stream():
+            yield user.id, user.to_dict()
+
+
+class SqliteStorage(UserStorage):
+    """
+    Users kept in a local SQLite file, for running the server without Firestore and for benchmarks.
+    Every thread gets its own connection, so the storage can be used from a pool of worker threads.
+    """
+
+    # record field -> (column type, encode to column, decode from column)
+    _COLUMNS = {
+        "username": ("TEXT NOT NULL UNIQUE", None, None),
+        "password": ("TEXT NOT NULL", None, None),
+        "score": ("INTEGER NOT NULL DEFAULT 0", None, None),
+        "score_timestamp": ("REAL", None, None),
+        "questions_asked": ("TEXT NOT NULL DEFAULT '[]'", json.dumps, json.loads),
+        "questions_seen": ("BLOB NOT NULL DEFAULT x''", bytes, bytes),
+    }
+
+    def __init__(self, path=SQLITE_DB_FILE):
+        self._path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(name + " " + column[0] for name, column in self._COLUMNS.items())
+        self._connection.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, " + columns + ")")
+        existing_columns = {row[1] for row in self._connection.execute("PRAGMA table_info(users)")}
+        for name, column in self._COLUMNS.items():
+            if name not in existing_columns:
+                self._connection.execute("ALTER TABLE users ADD COLUMN " + name + " " + column[0])
+        self._connection.execute("CREATE INDEX IF NOT EXISTS users_by_score ON users (score DESC, score_timestamp)")
+        self._connection.commit()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self._path, check_same_thread=False)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _encode(self, field, value):
+        encode = self._COLUMNS[field][1]
+        return encode(value) if encode else value
+
+    def _decode_row(self, row):
+        record = {}
+        for field, value in zip(self._COLUMNS, row):
+            decode = self._COLUMNS[field][2]
+            record[field] = decode(value) if decode and value is not None else value
+        return record
+
+    def find_user(self, username):
+        row = self._connection.execute("SELECT id, " + ", ".join(self._COLUMNS) + " FROM users WHERE username = ?",
+                                       (username,)).fetchone()
+        if row is None:
+            return None
+        return str(row[0]), self._decode_row(row[1:])
+
+    def get_user(self, user_id):
+        row = self._connection.execute("SELECT " + ", ".join(self._COLUMNS) + " FROM users WHERE id = ?",
+                                       (int(user_id),)).fetchone()
+        if row is None:
+            return None
+        return self._decode_row(row)
+
+    def _insert_user(self, record: dict):
+        fields = [field for field in record if field in self._COLUMNS]
+        cursor = self._connection.execute(
+            "INSERT INTO users (" + ", ".join(fields) + ") VALUES (" + ", ".join("?" * len(fields)) + ")",
+            [self._encode(field, record[field]) for field in fields])
+        return str(cursor.lastrowid)
+
+    def create_user(self, record: dict):
+        """
+        Raises sqlite3.IntegrityError if the username is taken
+        """
+        with self._connection:
+            return self._insert_user(record)
+
+    def create_users(self, records: list):
+        """
+        Saves the users in one transaction. Raises sqlite3.IntegrityError if a username is taken, and then none
+        of them are saved.
+        """
+        with self._connection:
+            return [self._insert_user(record) for record in records]
+
+    def sign_up_user(self, record: dict):
+        try:
+            return super().sign_up_user(record)
+        except sqlite3.IntegrityError:
+            return None  # taken by a sign up that ran at the same time
+
+    def update_users(self, changes: dict):
+        with self._connection:
+            for user_id, fields in changes.items():
+                names = [field for field in fields if field in self._COLUMNS]
+                if not names:
+                    continue
+                self._connection.execute(
+                    "UPDATE users SET " + ", ".join(name + " = ?" for name in names) + " WHERE id = ?",
+                    [self._encode(name, fields[name]) for name in names] + [int(user_id)])
+
+    def leaderboard_records(self):
+        cursor = self._connection.execute("SELECT id, username, score, score_timestamp FROM users")
+        for user_id, username, score, score_timestamp in cursor:
+            yield str(user_id), username, score, score_timestamp
+
+    def usernames(self):
+        for row in self._connection.execute("SELECT username FROM users"):
+            yield row[0]
+
+    def all_users(self):
+        for row in self._connection.execute("SELECT id, " + ", ".join(self._COLUMNS) + " FROM users"):
+            yield str(row[0]), self._decode_row(row[1:])
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+STORAGE_BACKENDS = {
+    "firestore": FirestoreStorage,
+    "sqlite": SqliteStorage,
+}
+
+
+def open_storage(backend, location=None):
+    """
+    Creates the storage of the given backend name
+    :param location: the SQLite file, or the Firestore credentials file. The backend's default if None
+    """
+    storage_class = STORAGE_BACKENDS[backend]
+    if location is None:
+        return storage_class()
+    return storage_class(location)
@@ -0,0 +1,84 @@
+import unittest
+import chatlib
+
+
+class BuildFrameTest(unittest.TestCase):
+
+    def test_text_frame(self):
+        self.assertEqual(chatlib.build_frame("LOGIN", "user#pass"), b"LOGIN           |0009|user#pass")
+
+    def test_too_long_data(self):
+        self.assertIsNone(chatlib.build_frame("LOGGED_ANSWER", "a" * (chatlib.MAX_DATA_LENGTH + 1)))
+        self.assertIsNotNone(chatlib.build_frame("LOGGED_ANSWER", "a" * chatlib.MAX_DATA_LENGTH))
+        self.assertIsNone(chatlib.build_frame_header("LOGGED_ANSWER", chatlib.MAX_DATA_LENGTH + 1, 0))
+        self.assertIsNone(chatlib.build_frame_header("LOGGED_ANSWER", 0, chatlib.COMPACT_MAX_DATA_LENGTH + 1,
+                                                     chatlib.COMPACT_FORMAT))
+
+    def test_unknown_command(self):
+        self.assertIsNone(chatlib.build_frame("NO_SUCH_COMMAND", ""))
+        self.assertIsNone(chatlib.build_frame("NO_SUCH_COMMAND", "", chatlib.COMPACT_FORMAT))
+
+
+class MessageDecoderTest(unittest.TestCase):
+    message_format = chatlib.TEXT_FORMAT
+
+    def frames(self, messages):
+        return b"".join(chatlib.build_frame(cmd, data, self.message_format) for cmd, data in messages)
+
+    def test_frames_split_at_every_byte(self):
+        messages = [("LOGIN", "user#pass"), ("MY_SCORE", ""), ("SEND_ANSWER", "id#שלום עולם"), ("LOGOUT", "")]
+        decoder = chatlib.make_decoder(self.message_format)
+        received = []
+        for byte in self.frames(messages):
+            received.extend(decoder.feed(bytes([byte])))
+        self.assertEqual(received, messages)
+
+    def test_frames_merged_in_one_read(self):
+        messages = [("LOGIN", "a|b"), ("MY_SCORE", "")] * 3
+        self.assertEqual(chatlib.make_decoder(self.message_format).feed(self.frames(messages)), messages)
+
+    def test_broken_frame_drops_the_rest(self):
+        decoder = chatlib.make_decoder(self.message_format)
+        broken = self.frames([("LOGIN", "user#pass")]) + b"\xff" * 20 + self.frames([("LOGOUT", "")])
+        self.assertEqual(decoder.feed(broken), [("LOGIN", "user#pass"), (None, None)])
+        self.assertEqual(decoder.feed(self.frames([("LOGOUT", "")])), [("LOGOUT", "")])
+
+    def test_format_switch_leaves_the_rest_undecoded(self):
+        decoder = chatlib.make_decoder(self.message_format)
+        compact = chatlib.build_frame("MY_SCORE", "", chatlib.COMPACT_FORMAT)
+        switch = chatlib.build_frame(chatlib.PROTOCOL_CLIENT["protocol"], chatlib.COMPACT_FORMAT)
+        self.assertEqual(decoder.feed(switch + compact),
+                         [(chatlib.PROTOCOL_CLIENT["protocol"], chatlib.COMPACT_FORMAT)])
+        self.assertEqual(decoder.take_remaining(), compact)
+
+
+class CompactMessageDecoderTest(MessageDecoderTest):
+    message_format = chatlib.COMPACT_FORMAT
+
+    def test_format_switch_leaves_the_rest_undecoded(self):
+        pass  # the switch is always negotiated in text messages
+
+    def test_data_length_is_in_bytes(self):
+        frame = chatlib.build_frame("SEND_ANSWER", "é", self.message_format)
+        self.assertEqual(len(frame), chatlib.COMPACT_HEADER.size + 2)
+        self.assertEqual(chatlib.make_decoder(self.message_format).feed(frame), [("SEND_ANSWER", "é")])
+
+    def test_too_long_message_is_refused_from_its_header(self):
+        decoder = chatlib.make_decoder(self.message_format, 10)
+        self.assertEqual(decoder.feed(chatlib.build_frame("SEND_ANSWER", "a" * 10, self.message_format)),
+                         [("SEND_ANSWER", "a" * 10)])
+        header = chatlib.build_frame("SEND_ANSWER", "a" * 11, self.message_format)[:chatlib.COMPACT_HEADER.size]
+        self.assertEqual(decoder.feed(header), [(None, None)])
+
+
+class UsernameTest(unittest.TestCase):
+
+    def test_valid_usernames(self):
+        self.assertTrue(chatlib.is_valid_username("alice4"))
+        self.assertTrue(chatlib.is_valid_username("a" * chatlib.MAX_USERNAME_LENGTH))
+        for username in ("", "abc", "a" * (chatlib.MAX_USERNAME_LENGTH + 1), "al ice", "alice#1", "alice|"):
+            self.assertFalse(chatlib.is_valid_username(username), username)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from connections import DeadlineHeap, TokenBucket
+
+
+class DeadlineHeapTest(unittest.TestCase):
+
+    def test_expires_in_deadline_order(self):
+        deadlines = DeadlineHeap()
+        deadlines.set("b", 20)
+        deadlines.set("a", 10)
+        deadlines.set("c", 30)
+        self.assertEqual(deadlines.next_deadline(), 10)
+        self.assertEqual(deadlines.pop_expired(25), ["a", "b"])
+        self.assertNotIn("a", deadlines)
+        self.assertIn("c", deadlines)
+
+    def test_moved_later_expires_at_the_new_deadline(self):
+        deadlines = DeadlineHeap()
+        deadlines.set("a", 10)
+        deadlines.set("a", 50)
+        self.assertEqual(deadlines.pop_expired(20), [])
+        self.assertIn("a", deadlines)
+        self.assertEqual(deadlines.next_deadline(), 50)
+        self.assertEqual(deadlines.pop_expired(50), ["a"])
+
+    def test_moved_earlier_expires_once(self):
+        deadlines = DeadlineHeap()
+        deadlines.set("a", 50)
+        deadlines.set("a", 10)
+        self.assertEqual(deadlines.pop_expired(20), ["a"])
+        self.assertEqual(deadlines.pop_expired(60), [])
+
+    def test_removed_keys_dont_expire(self):
+        deadlines = DeadlineHeap()
+        deadlines.set("a", 10)
+        deadlines.remove("a")
+        deadlines.remove("missing")
+        self.assertEqual(deadlines.pop_expired(20), [])
+        self.assertIsNone(deadlines.next_deadline())
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10, burst=20, now=0)
+        self.assertEqual(bucket.take(20, 0), 0)
+        self.assertAlmostEqual(bucket.take(5, 0), 0.5)  # 5 tokens short at 10 per second
+        self.assertEqual(bucket.take(5, 1.5), 0)
+
+    def test_refill_is_capped_at_the_burst(self):
+        bucket = TokenBucket(rate=10, burst=20, now=0)
+        bucket.take(20, 0)
+        self.assertEqual(bucket.take(20, 100), 0)
+        self.assertGreater(bucket.take(1, 100), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
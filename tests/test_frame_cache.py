@@ -0,0 +1,53 @@
+import unittest
+import chatlib
+from frame_cache import CachedPayload, static_frame
+
+
+class CachedPayloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.version = 1
+        self.builds = 0
+        self.text = "alice,bob"
+
+    def build(self):
+        self.builds += 1
+        return self.text
+
+    def make_payload(self):
+        return CachedPayload("LOGGED_ANSWER", self.build, lambda: self.version)
+
+    def test_built_again_only_when_the_version_changes(self):
+        payload = self.make_payload()
+        self.assertEqual(payload.frame(), chatlib.build_frame("LOGGED_ANSWER", "alice,bob"))
+        self.assertIs(payload.frame(), payload.frame())
+        self.text = "alice"
+        self.assertEqual(payload.data, "alice,bob")
+        self.version = 2
+        self.assertEqual(payload.data, "alice")
+        self.assertEqual(self.builds, 2)
+
+    def test_prefix_and_formats(self):
+        payload = self.make_payload()
+        self.assertEqual(payload.frame(prefix="2\n"), chatlib.build_frame("LOGGED_ANSWER", "2\nalice,bob"))
+        self.assertEqual(payload.frame(chatlib.COMPACT_FORMAT, "é"),
+                         chatlib.build_frame("LOGGED_ANSWER", "éalice,bob", chatlib.COMPACT_FORMAT))
+
+    def test_too_long_for_the_format(self):
+        self.text = "a" * chatlib.MAX_DATA_LENGTH
+        payload = self.make_payload()
+        self.assertIsNotNone(payload.frame())
+        self.assertIsNone(payload.frame(prefix="!"))
+        self.assertIsNotNone(payload.frame(chatlib.COMPACT_FORMAT, "!"))
+        self.text += "a"
+        self.version = 2
+        self.assertIsNone(payload.frame())
+
+    def test_static_frame(self):
+        self.assertIs(static_frame("LOGIN_OK"), static_frame("LOGIN_OK"))
+        self.assertEqual(static_frame("LOGIN_OK", chatlib.COMPACT_FORMAT),
+                         chatlib.build_frame("LOGIN_OK", "", chatlib.COMPACT_FORMAT))
+
+
+if __name__ == '__main__':
+    unittest.main()
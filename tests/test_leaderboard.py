@@ -0,0 +1,131 @@
+import random
+import unittest
+from leaderboard import IndexableSkipList, Leaderboard, PeriodLeaderboard, DAY
+
+
+class IndexableSkipListTest(unittest.TestCase):
+
+    def assert_matches(self, skip_list, expected):
+        self.assertEqual(len(skip_list), len(expected))
+        self.assertEqual([key for key, value in skip_list.items()], expected)
+        for position, key in enumerate(expected):
+            self.assertEqual(skip_list.index(key), position)
+            self.assertEqual(skip_list[position][0], key)
+
+    def test_random_inserts_and_removes_keep_order_and_positions(self):
+        generator = random.Random(1)
+        skip_list = IndexableSkipList()
+        expected = []
+        for _ in range(2000):
+            key = generator.randrange(500)
+            if key in expected:
+                skip_list.remove(key)
+                expected.remove(key)
+            else:
+                skip_list.insert(key, str(key))
+                expected.append(key)
+                expected.sort()
+        self.assert_matches(skip_list, expected)
+
+    def test_items_range(self):
+        skip_list = IndexableSkipList.from_sorted((key, None) for key in range(100))
+        self.assertEqual([key for key, value in skip_list.items(10, 15)], [10, 11, 12, 13, 14])
+        self.assertEqual([key for key, value in skip_list.items(95, 200)], [95, 96, 97, 98, 99])
+        self.assertEqual(list(skip_list.items(50, 50)), [])
+
+    def test_from_sorted_matches_inserts(self):
+        keys = list(range(0, 3000, 3))
+        skip_list = IndexableSkipList.from_sorted((key, -key) for key in keys)
+        self.assert_matches(skip_list, keys)
+        self.assertEqual(skip_list[7], (21, -21))
+        skip_list.insert(1)
+        skip_list.remove(0)
+        self.assert_matches(skip_list, [1] + keys[1:])
+
+    def test_from_sorted_rejects_unsorted_keys(self):
+        with self.assertRaises(ValueError):
+            IndexableSkipList.from_sorted([(2, None), (1, None)])
+        with self.assertRaises(ValueError):
+            IndexableSkipList.from_sorted([(1, None), (1, None)])
+
+    def test_missing_keys(self):
+        skip_list = IndexableSkipList.from_sorted([(1, None), (3, None)])
+        with self.assertRaises(KeyError):
+            skip_list.index(2)
+        with self.assertRaises(KeyError):
+            skip_list.remove(2)
+        with self.assertRaises(IndexError):
+            skip_list[2]
+
+
+class LeaderboardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.leaderboard = Leaderboard()
+        for number in range(10):
+            self.leaderboard.update("id" + str(number), "user" + str(number), number * 10, 100 + number)
+
+    def test_ranks_by_score_then_time(self):
+        self.leaderboard.update("late", "late", 90, 500)
+        self.assertEqual(self.leaderboard.top(3), [("user9", 90), ("late", 90), ("user8", 80)])
+        self.assertEqual(self.leaderboard.rank("late"), 1)
+        self.assertIsNone(self.leaderboard.rank("nobody"))
+
+    def test_update_moves_the_user(self):
+        version = self.leaderboard.version
+        self.assertTrue(self.leaderboard.update("id0", "user0", 1000, 200))
+        self.assertEqual(self.leaderboard.rank("id0"), 0)
+        self.assertEqual(self.leaderboard.score("id0"), 1000)
+        self.assertFalse(self.leaderboard.update("id0", "user0", 1000, 200))
+        self.assertEqual(self.leaderboard.version, version + 1)
+
+    def test_page_around_the_user_stays_full_at_the_ends(self):
+        total, rank, start, page = self.leaderboard.page("id5", 4)
+        self.assertEqual((total, rank, start), (10, 4, 2))
+        self.assertEqual([username for username, score in page], ["user7", "user6", "user5", "user4"])
+        self.assertEqual(self.leaderboard.page("id0", 4)[2], 6)
+        self.assertEqual(self.leaderboard.page("id9", 4)[2], 0)
+        self.assertEqual(self.leaderboard.page("nobody", 4)[1:3], (None, 0))
+        self.assertEqual(len(self.leaderboard.page("id9", 4, 8)[3]), 2)
+
+    def test_load_records_round_trip(self):
+        loaded = Leaderboard()
+        loaded.load(self.leaderboard.records())
+        self.assertEqual(loaded.records(), self.leaderboard.records())
+        self.assertEqual(loaded.rank("id3"), self.leaderboard.rank("id3"))
+        with self.assertRaises(ValueError):
+            loaded.load([])
+
+    def test_reconcile(self):
+        records = {user_id: record for user_id, *record in self.leaderboard.records()}
+        records["id5"] = ("user5", 55, 300)
+        records["id9"] = ("user9", 0, 300)
+        del records["id0"]
+        changed = self.leaderboard.reconcile([(user_id,) + tuple(record) for user_id, record in records.items()],
+                                             skip={"id9"})
+        self.assertEqual(changed, 2)  # id5 is moved and id0 removed, id9 is newer than the store
+        self.assertEqual(self.leaderboard.score("id5"), 55)
+        self.assertNotIn("id0", self.leaderboard)
+        self.assertEqual(self.leaderboard.score("id9"), 90)
+
+
+class PeriodLeaderboardTest(unittest.TestCase):
+
+    def test_starts_over_when_the_period_ends(self):
+        daily = PeriodLeaderboard(DAY)
+        daily.add_points("a", "alice", 5, 10 * DAY + 100)
+        daily.add_points("a", "alice", 5, 10 * DAY + 200)
+        self.assertEqual(daily.score("a"), 10)
+        self.assertTrue(daily.roll(11 * DAY))
+        self.assertEqual(len(daily), 0)
+
+    def test_restore_only_the_current_period(self):
+        daily = PeriodLeaderboard(DAY)
+        daily.add_points("a", "alice", 5, 10 * DAY + 100)
+        snapshot = daily.snapshot()
+        self.assertTrue(PeriodLeaderboard(DAY).restore(snapshot, 10 * DAY + 500))
+        self.assertFalse(PeriodLeaderboard(DAY).restore(snapshot, 11 * DAY + 500))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from passwords import hash_password, is_password_hash, check_password
+
+ITERATIONS = 1000  # keeps the tests fast, the server uses passwords.HASH_ITERATIONS
+
+
+class PasswordsTest(unittest.TestCase):
+
+    def test_hash_is_salted(self):
+        stored = hash_password("secret", ITERATIONS)
+        self.assertTrue(is_password_hash(stored))
+        self.assertNotIn("secret", stored)
+        self.assertNotEqual(stored, hash_password("secret", ITERATIONS))
+
+    def test_check_hash(self):
+        stored = hash_password("secret", ITERATIONS)
+        self.assertEqual(check_password("secret", stored, ITERATIONS), (True, None))
+        self.assertEqual(check_password("wrong", stored, ITERATIONS), (False, None))
+
+    def test_plaintext_password_is_hashed_on_login(self):
+        self.assertFalse(is_password_hash("secret"))
+        right, new_hash = check_password("secret", "secret", ITERATIONS)
+        self.assertTrue(right)
+        self.assertTrue(is_password_hash(new_hash))
+        self.assertEqual(check_password("secret", new_hash, ITERATIONS), (True, None))
+        self.assertEqual(check_password("wrong", "secret", ITERATIONS), (False, None))
+
+    def test_weaker_hash_is_made_again(self):
+        stored = hash_password("secret", ITERATIONS)
+        right, new_hash = check_password("secret", stored, ITERATIONS * 2)
+        self.assertTrue(right)
+        self.assertIn("$" + str(ITERATIONS * 2) + "$", new_hash)
+        self.assertEqual(check_password("wrong", stored, ITERATIONS * 2), (False, None))
+
+    def test_broken_hash_never_matches(self):
+        for stored in ("pbkdf2_sha256$", "pbkdf2_sha256$many$00$00", "pbkdf2_sha256$1000$zz$00"):
+            self.assertEqual(check_password("secret", stored, ITERATIONS), (False, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from question_bank import QuestionBank, QuestionDeck
+
+
+def make_raw_questions(count, first=0):
+    return [{"question": "question " + str(number), "correct_answer": "right",
+             "incorrect_answers": ["wrong 1", "wrong 2", "wrong 3"]} for number in range(first, first + count)]
+
+
+class QuestionBankTest(unittest.TestCase):
+
+    def test_skips_questions_it_has(self):
+        bank = QuestionBank(make_raw_questions(5))
+        self.assertEqual(bank.extend(make_raw_questions(5, 3)), 3)
+        self.assertEqual(len(bank), 8)
+        self.assertIs(bank.get(bank[6].question_id), bank[6])
+        self.assertIsNone(bank.get("missing"))
+
+    def test_payload_has_every_answer_in_some_order(self):
+        question = QuestionBank(make_raw_questions(1))[0]
+        orders = set()
+        for _ in range(100):
+            fields = question.payload().split("#")
+            self.assertEqual(fields[:2], [question.question_id, question.text])
+            self.assertEqual(sorted(fields[2:]), sorted(question.answers))
+            orders.add(tuple(fields[2:]))
+        self.assertGreater(len(orders), 1)
+
+
+class QuestionDeckTest(unittest.TestCase):
+
+    def test_draws_every_question_once(self):
+        bank = QuestionBank(make_raw_questions(50))
+        deck = QuestionDeck(bank)
+        drawn = []
+        while len(deck):
+            index = deck.peek()
+            drawn.append(deck.draw())
+            self.assertEqual(drawn[-1], index)
+        self.assertEqual(sorted(drawn), list(range(50)))
+        self.assertIsNone(deck.draw())
+        self.assertIsNone(deck.peek())
+        self.assertTrue(all(deck.is_seen(index) for index in range(50)))
+
+    def test_skips_seen_and_asked_questions(self):
+        bank = QuestionBank(make_raw_questions(20))
+        seen = bytes([0b00000101])  # questions 0 and 2
+        deck = QuestionDeck(bank, seen, [bank[10].question_id, "unknown id"])
+        self.assertEqual(len(deck), 17)
+        drawn = {deck.draw() for _ in range(17)}
+        self.assertFalse(drawn & {0, 2, 10})
+
+    def test_seen_bitmap_round_trip(self):
+        bank = QuestionBank(make_raw_questions(20))
+        deck = QuestionDeck(bank)
+        drawn = {deck.draw() for _ in range(7)}
+        self.assertEqual(len(QuestionDeck(bank, bytes(deck.seen))), 13)
+        self.assertEqual({index for index in range(20) if deck.is_seen(index)}, drawn)
+
+    def test_new_questions_are_added(self):
+        bank = QuestionBank(make_raw_questions(5))
+        deck = QuestionDeck(bank)
+        deck.draw()
+        bank.extend(make_raw_questions(5, 5))
+        deck.add_new_questions(bank)
+        self.assertEqual(len(deck), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import unittest
+from question_store import QuestionStore, QuestionRefiller, MAX_REFILL_INTERVAL
+
+
+def make_question(number):
+    return {"question": "question " + str(number), "correct_answer": "right",
+            "incorrect_answers": ["wrong 1", "wrong 2", "wrong 3"], "category": "", "difficulty": ""}
+
+
+class QuestionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "questions.jsonl")
+
+    def test_append_only_saves_new_questions(self):
+        store = QuestionStore(self.path)
+        self.assertEqual(len(store.append_new([make_question(0), make_question(1)])), 2)
+        self.assertEqual(store.append_new([make_question(1), make_question(2)]), [make_question(2)])
+        self.assertEqual(len(store), 3)
+        self.assertEqual(QuestionStore(self.path).load(), [make_question(number) for number in range(3)])
+
+    def test_load_only_reads_what_is_new(self):
+        writer = QuestionStore(self.path)
+        reader = QuestionStore(self.path)
+        self.assertEqual(reader.load(), [])
+        writer.append_new([make_question(0)])
+        self.assertTrue(reader.has_unloaded())
+        self.assertEqual(reader.load(), [make_question(0)])
+        self.assertFalse(reader.has_unloaded())
+        self.assertEqual(reader.load(), [])
+        writer.append_new([make_question(1), make_question(2)])
+        self.assertEqual(reader.load(), [make_question(1), make_question(2)])
+
+    def test_line_being_written_is_read_later(self):
+        line = json.dumps(make_question(0)) + "\n"
+        with open(self.path, "w") as questions_file:
+            questions_file.write(line[:10])
+        store = QuestionStore(self.path)
+        self.assertEqual(store.load(), [])
+        with open(self.path, "a") as questions_file:
+            questions_file.write(line[10:])
+        self.assertEqual(store.load(), [make_question(0)])
+
+    def test_line_cut_by_a_crash_is_kept_apart(self):
+        with open(self.path, "w") as questions_file:
+            questions_file.write(json.dumps(make_question(0)) + "\n" + json.dumps(make_question(1))[:10])
+        store = QuestionStore(self.path)
+        self.assertEqual(store.load(), [make_question(0)])
+        store.append_new([make_question(2)])
+        self.assertEqual(store.load(), [])  # the question was appended by this store, the cut line is skipped
+        self.assertEqual(QuestionStore(self.path).load(), [make_question(0), make_question(2)])
+
+
+class QuestionRefillerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = QuestionStore(os.path.join(directory.name, "questions.jsonl"))
+        self.batches = []
+
+    def fetch(self, amount):
+        return self.batches.pop(0)
+
+    def test_backs_off_while_nothing_is_new(self):
+        refiller = QuestionRefiller(self.store, self.fetch, batch_size=2, interval=10, max_size=100)
+        self.assertTrue(refiller.due(0))
+        self.batches = [[make_question(0)], [make_question(0)], [make_question(1)]]
+        refiller.finish(0, refiller.refill())
+        self.assertEqual(refiller.interval, 10)
+        self.assertFalse(refiller.due(5))
+        refiller.finish(10, refiller.refill())
+        self.assertEqual(refiller.interval, 20)
+        self.assertFalse(refiller.due(20))
+        self.assertTrue(refiller.due(30))
+        refiller.finish(30, refiller.refill())
+        self.assertEqual(refiller.interval, 10)
+
+    def test_back_off_is_capped(self):
+        refiller = QuestionRefiller(self.store, self.fetch, interval=MAX_REFILL_INTERVAL)
+        refiller.finish(0, [])
+        self.assertEqual(refiller.interval, MAX_REFILL_INTERVAL)
+
+    def test_stops_at_the_max_size(self):
+        refiller = QuestionRefiller(self.store, self.fetch, max_size=1)
+        self.batches = [[make_question(0)]]
+        refiller.finish(0, refiller.refill())
+        self.assertFalse(refiller.due(3600 * 24))
+
+
+if __name__ == '__main__':
+    unittest.main()
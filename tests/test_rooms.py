@@ -0,0 +1,102 @@
+import unittest
+from question_bank import QuestionBank
+from rooms import Room, RoomRegistry, WAITING, ASKING
+
+
+def make_bank(count):
+    return QuestionBank([{"question": "question " + str(number), "correct_answer": "right",
+                          "incorrect_answers": ["wrong 1", "wrong 2", "wrong 3"]} for number in range(count)])
+
+
+class RoomTest(unittest.TestCase):
+
+    def test_game_asks_different_questions(self):
+        bank = make_bank(10)
+        room = Room("lobby", 2)
+        room.start(len(bank), 5)
+        asked = []
+        while room.has_more_questions():
+            asked.append(room.next_question(bank).question_id)
+        self.assertEqual(len(set(asked)), 5)
+        self.assertEqual(room.question_number, 5)
+        self.assertEqual(room.state, ASKING)
+
+    def test_game_of_a_small_bank(self):
+        room = Room("lobby", 2)
+        room.start(3, 5)
+        self.assertEqual(sorted(room.question_indexes), [0, 1, 2])
+
+    def test_next_question_resets_the_answers(self):
+        registry = RoomRegistry()
+        room = registry.join("socket 1", "alice", "lobby")
+        registry.join("socket 2", "bob", "lobby")
+        room.start(5)
+        room.next_question(make_bank(5))
+        room.members["socket 1"].answered = True
+        room.members["socket 1"].correct = True
+        room.members["socket 1"].points = 10
+        self.assertFalse(room.everyone_answered())
+        room.members["socket 2"].answered = True
+        self.assertTrue(room.everyone_answered())
+        self.assertEqual([player.username for player in room.scoreboard()], ["alice", "bob"])
+        room.next_question(make_bank(5))
+        self.assertFalse(room.members["socket 1"].answered)
+        self.assertFalse(room.members["socket 1"].correct)
+        self.assertEqual(room.members["socket 1"].points, 10)
+
+
+class RoomRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = RoomRegistry()
+
+    def test_join_creates_the_room(self):
+        room = self.registry.join("socket 1", "alice", "lobby", 3)
+        self.assertIs(self.registry.join("socket 2", "bob", "lobby", 5), room)
+        self.assertEqual(room.size, 3)
+        self.assertEqual(room.state, WAITING)
+        self.assertEqual(len(self.registry), 1)
+        self.assertIs(self.registry.room_of("socket 2"), room)
+
+    def test_one_room_per_player(self):
+        self.registry.join("socket 1", "alice", "lobby")
+        with self.assertRaises(ValueError):
+            self.registry.join("socket 1", "alice", "other")
+
+    def test_started_game_cant_be_joined(self):
+        room = self.registry.join("socket 1", "alice", "lobby")
+        room.state = ASKING
+        with self.assertRaises(ValueError):
+            self.registry.join("socket 2", "bob", "lobby")
+
+    def test_last_player_leaving_closes_the_room(self):
+        room = self.registry.join("socket 1", "alice", "lobby")
+        self.registry.join("socket 2", "bob", "lobby")
+        self.registry.set_deadline(room, 10)
+        self.assertIs(self.registry.leave("socket 1"), room)
+        self.assertEqual(len(self.registry), 1)
+        self.registry.leave("socket 2")
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(self.registry.expired(20), [])
+        self.assertIsNone(self.registry.leave("socket 2"))
+
+    def test_close_removes_the_players(self):
+        room = self.registry.join("socket 1", "alice", "lobby")
+        self.registry.join("socket 2", "bob", "lobby")
+        self.registry.close(room)
+        self.assertIsNone(self.registry.room_of("socket 1"))
+        self.assertIsNot(self.registry.join("socket 1", "alice", "lobby"), room)
+
+    def test_expired_deadlines(self):
+        first = self.registry.join("socket 1", "alice", "first")
+        second = self.registry.join("socket 2", "bob", "second")
+        self.registry.set_deadline(first, 20)
+        self.registry.set_deadline(second, 10)
+        self.assertEqual(self.registry.next_deadline(), 10)
+        self.assertEqual(self.registry.expired(15), [second])
+        self.assertEqual(self.registry.expired(25), [first])
+        self.assertEqual(self.registry.expired(30), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
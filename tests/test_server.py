@@ -0,0 +1,194 @@
+import unittest
+from unittest import mock
+import chatlib
+import server
+from frame_cache import CachedPayload
+from leaderboard import Leaderboard, PeriodLeaderboards
+from question_bank import QuestionBank
+from sessions import SessionRegistry
+from user_cache import UserStateCache
+
+
+class FakeConnection:
+    """
+    Stands for a client socket, the sending functions only queue data for it
+    """
+
+
+class SendingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConnection()
+
+    def tearDown(self):
+        server.outgoing_data.pop(self.conn, None)
+        server.sockets_to_write.discard(self.conn)
+        server.slow_sockets.discard(self.conn)
+
+    def sent(self):
+        return chatlib.make_decoder().feed(bytes(server.outgoing_data.get(self.conn, b"")))
+
+    def test_queue_data_rejects_a_missing_frame(self):
+        with self.assertRaises(ValueError):
+            server.queue_data(self.conn, None)
+        self.assertNotIn(self.conn, server.sockets_to_write)
+
+    def test_too_long_reply_is_answered_with_an_error(self):
+        reply = CachedPayload(chatlib.PROTOCOL_SERVER["logged_users"], lambda: "a" * (chatlib.MAX_DATA_LENGTH + 1),
+                              lambda: 1)
+        with self.assertLogs("server", "WARNING"):
+            server.send_cached_reply(self.conn, reply)
+            server.build_and_send_message(self.conn, chatlib.PROTOCOL_SERVER["logged_users"], reply.data)
+        self.assertEqual([cmd for cmd, data in self.sent()], [chatlib.PROTOCOL_SERVER["error_msg"]] * 2)
+
+    def test_too_long_push_is_dropped(self):
+        push = CachedPayload(chatlib.PROTOCOL_SERVER["logged_push"], lambda: "a" * (chatlib.MAX_DATA_LENGTH + 1),
+                             lambda: 1)
+        other = FakeConnection()
+        self.addCleanup(server.outgoing_data.pop, other, None)
+        self.addCleanup(server.sockets_to_write.discard, other)
+        with self.assertLogs("server", "WARNING"):
+            server.send_cached_reply(self.conn, push)
+            server.build_and_send_message(self.conn, chatlib.PROTOCOL_SERVER["score_push"],
+                                          "1" * (chatlib.MAX_DATA_LENGTH + 1))
+            server.broadcast_message([self.conn, other], chatlib.PROTOCOL_SERVER["room_state"],
+                                     "a" * (chatlib.MAX_DATA_LENGTH + 1))
+        self.assertEqual(self.sent(), [])
+        self.assertNotIn(other, server.outgoing_data)
+
+    def test_long_logged_users_list_is_cut_to_fit(self):
+        sessions = SessionRegistry()
+        for number in range(2000):
+            sessions.add(FakeConnection(), "id" + str(number), "username" + str(number).zfill(6))
+        with mock.patch.object(server, "logged_users", sessions):
+            server.handle_logged_message(self.conn)
+        (cmd, data), = self.sent()
+        self.assertEqual(cmd, chatlib.PROTOCOL_SERVER["logged_users"])
+        usernames = data.split(",")
+        self.assertEqual(usernames[-1], server.LIST_MORE % (2000 - len(usernames) + 1))
+        self.assertTrue(usernames[-2].startswith("username"))
+
+    def test_long_high_score_table_is_cut_to_fit(self):
+        leaderboard = Leaderboard()
+        for number in range(server.LEADERBOARD_SIZE):
+            leaderboard.update("id" + str(number), "user" + str(number).zfill(300), number, 0)
+        with mock.patch.object(server, "leaderboard", leaderboard):
+            table = server.build_highscore_table()
+        lines = table.splitlines()
+        self.assertLessEqual(len(server.HIGHSCORE_RANK_LINE % ("9" * server.MAX_RANK_LENGTH)) + len(table),
+                             chatlib.MAX_DATA_LENGTH)
+        self.assertTrue(lines[0].startswith("1. user"))
+        self.assertEqual(lines[-1], server.LIST_MORE % (server.LEADERBOARD_SIZE - len(lines) + 1))
+
+
+class ReceivingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConnection()
+        self.addCleanup(server.message_decoders.pop, self.conn, None)
+
+    def test_compact_request_longer_than_the_limit_is_broken(self):
+        with mock.patch.dict(server.message_formats, {self.conn: chatlib.COMPACT_FORMAT}):
+            data = "a" * server.MAX_REQUEST_LENGTH
+            frame = chatlib.build_frame("SEND_ANSWERS", data, chatlib.COMPACT_FORMAT)
+            self.assertEqual(server.parse_received(self.conn, frame), [("SEND_ANSWERS", data)])
+            frame = chatlib.build_frame("SEND_ANSWERS", data + "a", chatlib.COMPACT_FORMAT)
+            self.assertEqual(server.parse_received(self.conn, frame[:chatlib.COMPACT_HEADER.size]), [(None, None)])
+
+
+class BatchedQuestionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConnection()
+        bank = QuestionBank([{"question": "question " + str(number), "correct_answer": "right",
+                              "incorrect_answers": ["wrong 1", "wrong 2", "wrong 3"]} for number in range(30)])
+        sessions = SessionRegistry()
+        sessions.add(self.conn, "1", "alice")
+        user_cache = UserStateCache(lambda changes: None)
+        user_cache.load("1", {"username": "alice", "score": 0, "questions_seen": b""})
+        for name, value in (("questions", bank), ("logged_users", sessions), ("user_cache", user_cache),
+                            ("leaderboard", Leaderboard()), ("period_leaderboards", PeriodLeaderboards()),
+                            ("question_decks", {}), ("unanswered_questions", {})):
+            patcher = mock.patch.object(server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(server.outgoing_data.pop, self.conn, None)
+        self.addCleanup(server.sockets_to_write.discard, self.conn)
+
+    def exchange(self, handler, data):
+        server.outgoing_data.pop(self.conn, None)
+        handler(self.conn, data)
+        (cmd, data), = chatlib.make_decoder().feed(bytes(server.outgoing_data[self.conn]))
+        return cmd, data
+
+    def get_questions(self, count):
+        cmd, data = self.exchange(server.handle_questions_message, str(count))
+        self.assertEqual(cmd, chatlib.PROTOCOL_SERVER["questions"])
+        return [record[0] for record in chatlib.split_records(data)]
+
+    def send_answers(self, question_ids):
+        answers = [[question_id, server.questions.get(question_id).answer_digest] for question_id in question_ids]
+        return self.exchange(server.handle_answers_message, chatlib.join_records(answers))
+
+    def test_only_given_questions_score_once(self):
+        given = self.get_questions(2)
+        other = next(question.question_id for question in server.questions if question.question_id not in given)
+        cmd, data = self.send_answers(given + [given[0], other])
+        self.assertEqual(cmd, chatlib.PROTOCOL_SERVER["answers_results"])
+        self.assertEqual([record[0] for record in chatlib.split_records(data)],
+                         [chatlib.PROTOCOL_SERVER["correct_answer"]] * 2 + [chatlib.PROTOCOL_SERVER["error_msg"]] * 2)
+        self.assertEqual(server.user_cache.get("1", "score"), 2 * server.CORRECT_ANSWER_POINTS)
+        self.send_answers(given)
+        self.assertEqual(server.user_cache.get("1", "score"), 2 * server.CORRECT_ANSWER_POINTS)
+
+    def test_too_many_answers(self):
+        given = self.get_questions(server.QUESTIONS_BATCH_SIZE) + self.get_questions(1)
+        cmd, data = self.send_answers(given)
+        self.assertEqual(cmd, chatlib.PROTOCOL_SERVER["error_msg"])
+        self.assertEqual(server.user_cache.get("1", "score"), 0)
+
+
+class SignUpTest(unittest.TestCase):
+
+    def test_invalid_usernames_are_refused(self):
+        conn = FakeConnection()
+        self.addCleanup(server.outgoing_data.pop, conn, None)
+        self.addCleanup(server.sockets_to_write.discard, conn)
+        for username in ("abc", "a" * (chatlib.MAX_USERNAME_LENGTH + 1), "al ice", "alice,bob", "alice\nbob"):
+            server.outgoing_data.pop(conn, None)
+            with mock.patch.object(server, "worker_pool") as worker_pool:
+                server.handle_sign_up_message(conn, username + "#secret")
+            worker_pool.submit.assert_not_called()
+            (cmd, data), = chatlib.make_decoder().feed(bytes(server.outgoing_data[conn]))
+            self.assertEqual(cmd, chatlib.PROTOCOL_SERVER["error_msg"])
+
+
+class RoomsTest(unittest.TestCase):
+
+    def test_rooms_are_refused_by_worker_processes(self):
+        conn = FakeConnection()
+        self.addCleanup(server.outgoing_data.pop, conn, None)
+        self.addCleanup(server.sockets_to_write.discard, conn)
+        with mock.patch.object(server, "reuse_port", True):
+            server.handle_join_room_message(conn, "lobby")
+        (cmd, data), = chatlib.make_decoder().feed(bytes(server.outgoing_data[conn]))
+        self.assertEqual(cmd, chatlib.PROTOCOL_SERVER["error_msg"])
+        self.assertIsNone(server.rooms.room_of(conn))
+
+
+class PeriodicTasksTest(unittest.TestCase):
+
+    def test_a_failing_task_doesnt_stop_the_others(self):
+        ran = []
+
+        def failing_task():
+            raise RuntimeError("failed")
+
+        with mock.patch.object(server, "PERIODIC_TASKS", (failing_task, lambda: ran.append(True))):
+            with self.assertLogs("server", "ERROR"):
+                server.run_periodic_tasks()
+        self.assertEqual(ran, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from sessions import SessionRegistry, ResumeTokens
+
+
+class SessionRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sessions = SessionRegistry()
+        self.sessions.add("socket 1", "1", "alice")
+        self.sessions.add("socket 2", "2", "bob")
+
+    def test_lookups_both_ways(self):
+        self.assertEqual(len(self.sessions), 2)
+        self.assertIn("socket 1", self.sessions)
+        self.assertEqual(self.sessions["socket 2"], "2")
+        self.assertEqual(self.sessions.username("socket 2"), "bob")
+        self.assertEqual(self.sessions.socket_of("1"), "socket 1")
+        self.assertIsNone(self.sessions.socket_of("3"))
+        self.assertTrue(self.sessions.has_user("2"))
+        self.assertTrue(self.sessions.has_username("alice"))
+        self.assertEqual(sorted(self.sessions.usernames()), ["alice", "bob"])
+
+    def test_one_login_at_a_time(self):
+        for conn, user_id, username in (("socket 1", "3", "carol"), ("socket 3", "1", "carol"),
+                                        ("socket 3", "3", "alice")):
+            with self.assertRaises(ValueError):
+                self.sessions.add(conn, user_id, username)
+        self.assertEqual(len(self.sessions), 2)
+
+    def test_remove(self):
+        version = self.sessions.version
+        self.assertEqual(self.sessions.remove("socket 1"), "1")
+        self.assertGreater(self.sessions.version, version)
+        self.assertIsNone(self.sessions.remove("socket 1"))
+        self.assertNotIn("socket 1", self.sessions)
+        self.assertFalse(self.sessions.has_user("1"))
+        self.assertFalse(self.sessions.has_username("alice"))
+        self.sessions.add("socket 3", "1", "alice")
+        self.assertEqual(self.sessions.socket_of("1"), "socket 3")
+
+
+class ResumeTokensTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tokens = ResumeTokens(lifetime=100)
+
+    def test_token_finds_its_user_until_it_expires(self):
+        token = self.tokens.issue("1", "alice", 1000)
+        self.assertEqual(self.tokens.find(token, 1099), ("1", "alice"))
+        self.assertIsNone(self.tokens.find(token, 1100))
+        self.assertEqual(len(self.tokens), 0)
+        self.assertIsNone(self.tokens.find("made up", 1000))
+
+    def test_new_token_replaces_the_old_one(self):
+        old_token = self.tokens.issue("1", "alice", 1000)
+        new_token = self.tokens.issue("1", "alice", 1010)
+        self.assertIsNone(self.tokens.find(old_token, 1010))
+        self.assertEqual(self.tokens.find(new_token, 1010), ("1", "alice"))
+        self.assertEqual(len(self.tokens), 1)
+
+    def test_revoke(self):
+        token = self.tokens.issue("1", "alice", 1000)
+        self.tokens.revoke("1")
+        self.tokens.revoke("1")
+        self.assertIsNone(self.tokens.find(token, 1000))
+
+    def test_records_hold_no_tokens(self):
+        token = self.tokens.issue("1", "alice", 1000)
+        records = self.tokens.records()
+        self.assertEqual([record[1:] for record in records], [("1", "alice", 1100)])
+        self.assertNotIn(token, str(records))
+
+    def test_load_skips_expired_tokens(self):
+        token = self.tokens.issue("1", "alice", 1000)
+        self.tokens.issue("2", "bob", 900)
+        loaded = ResumeTokens(lifetime=100)
+        self.assertEqual(loaded.load(self.tokens.records(), 1050), 1)
+        self.assertEqual(loaded.find(token, 1050), ("1", "alice"))
+        self.assertEqual(len(loaded), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from shared_state import SharedState, SharedSessions, SharedLeaderboard, SESSIONS_VERSION, LEADERBOARD_VERSION
+
+
+class SharedStateTest(unittest.TestCase):
+    """
+    The state is called directly, the way the coordinator's manager calls it for the workers
+    """
+
+    def setUp(self):
+        self.versions = [0, 0]
+        self.state = SharedState(self.versions)
+        self.workers = [SharedSessions(self.state, self.versions, worker) for worker in range(2)]
+
+    def test_a_user_is_logged_in_at_one_worker(self):
+        self.workers[0].add("socket 1", "1", "alice")
+        with self.assertRaises(ValueError):
+            self.workers[1].add("socket 2", "1", "alice")
+        self.assertNotIn("socket 2", self.workers[1])
+        self.assertTrue(self.workers[1].has_username("alice"))
+        self.assertFalse(self.workers[1].has_user("1"))
+        self.assertEqual(self.workers[1].usernames(), ["alice"])
+        self.workers[0].remove("socket 1")
+        self.workers[1].add("socket 2", "1", "alice")
+        self.assertEqual(self.workers[1].socket_of("1"), "socket 2")
+
+    def test_sessions_version_changes_on_login_and_logout(self):
+        self.workers[0].add("socket 1", "1", "alice")
+        version = self.workers[1].version
+        self.assertEqual(version, self.versions[SESSIONS_VERSION])
+        self.workers[0].remove("socket 1")
+        self.assertGreater(self.workers[1].version, version)
+
+    def test_logout_of_an_exited_worker(self):
+        self.workers[0].add("socket 1", "1", "alice")
+        self.workers[0].add("socket 2", "2", "bob")
+        self.workers[1].add("socket 3", "3", "carol")
+        self.assertEqual(self.state.logout_worker(0), 2)
+        self.assertEqual(self.state.usernames(), ["carol"])
+        self.assertEqual(self.state.logout_worker(0), 0)
+
+    def test_leaderboard_is_shared(self):
+        leaderboards = [SharedLeaderboard(self.state, self.versions) for _ in range(2)]
+        self.assertTrue(leaderboards[0].update("1", "alice", 5, 1.0))
+        self.assertTrue(leaderboards[1].add("2", "bob", 7, 2.0))
+        self.assertFalse(leaderboards[0].add("2", "bob", 0, 3.0))
+        self.assertEqual(leaderboards[0].top(2), [("bob", 7), ("alice", 5)])
+        self.assertEqual(leaderboards[1].rank("1"), 1)
+        self.assertEqual(leaderboards[0].version, self.versions[LEADERBOARD_VERSION])
+        leaderboards[1].remove("2")
+        self.assertNotIn("2", leaderboards[0])
+
+    def test_reconcile_skips_the_logged_users_of_every_worker(self):
+        leaderboard = SharedLeaderboard(self.state, self.versions)
+        leaderboard.update("1", "alice", 5, 1.0)
+        leaderboard.update("2", "bob", 7, 2.0)
+        self.workers[1].add("socket 1", "1", "alice")
+        leaderboard.reconcile([("1", "alice", 0, 0.5), ("2", "bob", 1, 0.5)])
+        self.assertEqual(leaderboard.score("1"), 5)
+        self.assertEqual(leaderboard.score("2"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
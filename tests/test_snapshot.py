@@ -0,0 +1,36 @@
+import json
+import os
+import tempfile
+import unittest
+from snapshot import write_snapshot, read_snapshot, SNAPSHOT_FORMAT
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "snapshot.json")
+
+    def test_round_trip(self):
+        leaderboard = [["1", "alice", 5, 1.5]]
+        tokens = [["digest", "1", "alice", 2000.0]]
+        write_snapshot(self.path, leaderboard, tokens, 1000.0)
+        snapshot = read_snapshot(self.path)
+        self.assertEqual(snapshot["leaderboard"], leaderboard)
+        self.assertEqual(snapshot["resume_tokens"], tokens)
+        self.assertEqual(snapshot["saved_at"], 1000.0)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["snapshot.json"])
+
+    def test_missing_file(self):
+        self.assertIsNone(read_snapshot(self.path))
+
+    def test_unusable_file(self):
+        for content in ('{"format": ', "[]", json.dumps({"format": SNAPSHOT_FORMAT + 1})):
+            with open(self.path, "w") as snapshot_file:
+                snapshot_file.write(content)
+            self.assertIsNone(read_snapshot(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
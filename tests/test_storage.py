@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from storage import SqliteStorage
+
+
+def make_record(username, score=0, score_timestamp=None):
+    return {"username": username, "password": "secret", "score": score, "score_timestamp": score_timestamp,
+            "questions_seen": b""}
+
+
+class SqliteStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "users.db")
+        self.storage = SqliteStorage(self.path)
+        self.addCleanup(self.storage.close)
+
+    def test_create_and_find(self):
+        user_id = self.storage.create_user(make_record("alice", 5, 1.5))
+        found_id, record = self.storage.find_user("alice")
+        self.assertEqual(found_id, user_id)
+        self.assertEqual(record["score"], 5)
+        self.assertEqual(record["questions_asked"], [])
+        self.assertEqual(self.storage.get_user(user_id), record)
+        self.assertIsNone(self.storage.find_user("bob"))
+        self.assertIsNone(self.storage.get_user("999"))
+
+    def test_update_users(self):
+        alice = self.storage.create_user(make_record("alice"))
+        bob = self.storage.create_user(make_record("bob"))
+        self.storage.update_users({alice: {"score": 10, "questions_seen": b"\x03", "unknown": 1},
+                                   bob: {"questions_asked": [4, 5]}})
+        self.assertEqual(self.storage.get_user(alice)["score"], 10)
+        self.assertEqual(self.storage.get_user(alice)["questions_seen"], b"\x03")
+        self.assertEqual(self.storage.get_user(bob)["questions_asked"], [4, 5])
+
+    def test_create_user_with_taken_username(self):
+        self.storage.create_user(make_record("alice"))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.storage.create_user(make_record("alice"))
+
+    def test_create_users_is_all_or_nothing(self):
+        self.storage.create_user(make_record("carol"))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.storage.create_users([make_record("alice"), make_record("bob"), make_record("carol")])
+        self.assertEqual(sorted(self.storage.usernames()), ["carol"])
+        user_ids = self.storage.create_users([make_record("alice"), make_record("bob")])
+        self.assertEqual(len(set(user_ids)), 2)
+        self.assertEqual(sorted(self.storage.usernames()), ["alice", "bob", "carol"])
+
+    def test_sign_up_with_taken_username(self):
+        self.assertIsNotNone(self.storage.sign_up_user(make_record("alice")))
+        self.assertIsNone(self.storage.sign_up_user(make_record("alice")))
+
+    def test_sign_ups_at_the_same_time(self):
+        results = []
+        barrier = threading.Barrier(8)
+
+        def sign_up():
+            barrier.wait()
+            results.append(self.storage.sign_up_user(make_record("alice")))
+
+        threads = [threading.Thread(target=sign_up) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(result is not None for result in results), 1)
+        self.assertEqual(list(self.storage.usernames()), ["alice"])
+
+    def test_leaderboard_records_and_all_users(self):
+        alice = self.storage.create_user(make_record("alice", 7, 2.0))
+        bob = self.storage.create_user(make_record("bob", 3))
+        self.assertEqual(sorted(self.storage.leaderboard_records()), [(alice, "alice", 7, 2.0), (bob, "bob", 3, None)])
+        self.assertEqual({user_id: record["username"] for user_id, record in self.storage.all_users()},
+                         {alice: "alice", bob: "bob"})
+
+    def test_reopen_keeps_users(self):
+        user_id = self.storage.create_user(make_record("alice", 4))
+        self.storage.close()
+        storage = SqliteStorage(self.path)
+        self.addCleanup(storage.close)
+        self.assertEqual(storage.get_user(user_id)["score"], 4)
+        indexes = [row[1] for row in storage._connection.execute("PRAGMA index_list(users)")]
+        self.assertIn("users_by_score", indexes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from user_cache import UserStateCache
+
+
+class UserStateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.fail_writes = False
+        self.cache = UserStateCache(self.write_batch, flush_interval=5)
+        self.cache.load("1", {"username": "alice", "score": 10})
+        self.cache.load("2", {"username": "bob", "score": 20})
+
+    def write_batch(self, changes):
+        if self.fail_writes:
+            raise OSError("store unavailable")
+        self.batches.append(changes)
+
+    def test_changes_are_written_in_one_batch(self):
+        self.cache.update("1", {"score": 15})
+        self.cache.update("2", {"score": 25})
+        self.cache.update("1", {"score": 20})
+        self.assertEqual(self.cache.get("1", "score"), 20)
+        self.cache.flush()
+        self.assertEqual(self.batches, [{"1": {"score": 20}, "2": {"score": 25}}])
+        self.assertFalse(self.cache.has_changes())
+
+    def test_load_keeps_the_cached_record(self):
+        self.cache.update("1", {"score": 15})
+        self.cache.load("1", {"username": "alice", "score": 10})
+        self.assertEqual(self.cache.get("1", "score"), 15)
+
+    def test_flush_of_some_users(self):
+        self.cache.update("1", {"score": 15})
+        self.cache.update("2", {"score": 25})
+        self.cache.flush(["2"])
+        self.assertEqual(self.batches, [{"2": {"score": 25}}])
+        self.assertEqual(self.cache.take_changes(), {"1": {"score": 15}})
+
+    def test_failed_write_is_retried(self):
+        self.cache.update("1", {"score": 15, "questions_seen": b"\x01"})
+        self.fail_writes = True
+        with self.assertRaises(OSError):
+            self.cache.flush()
+        self.assertTrue(self.cache.has_changes())
+        self.fail_writes = False
+        self.cache.flush()
+        self.assertEqual(self.batches, [{"1": {"score": 15, "questions_seen": b"\x01"}}])
+
+    def test_restored_changes_go_under_newer_ones(self):
+        self.cache.update("1", {"score": 15, "questions_seen": b"\x01"})
+        changes = self.cache.take_changes()
+        self.cache.update("1", {"score": 20})
+        self.cache.restore_changes(changes)
+        self.assertEqual(self.cache.take_changes(), {"1": {"score": 20, "questions_seen": b"\x01"}})
+
+    def test_discard_keeps_users_with_pending_changes(self):
+        self.cache.update("1", {"score": 15})
+        self.cache.discard("1")
+        self.cache.discard("2")
+        self.assertIn("1", self.cache)
+        self.assertNotIn("2", self.cache)
+
+    def test_flush_due(self):
+        self.assertFalse(self.cache.flush_due())
+        self.cache.flush_interval = 0
+        self.assertTrue(self.cache.flush_due())
+
+
+if __name__ == '__main__':
+    unittest.main()
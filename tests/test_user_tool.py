@@ -0,0 +1,98 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from passwords import check_password, is_password_hash
+from snapshot import read_snapshot
+from storage import SqliteStorage
+from user_tool import import_users, export_users, rebuild_leaderboard, decode_user, MISSING_SCORE_TIMESTAMP
+
+ITERATIONS = 1000  # keeps the tests fast
+
+
+class UserToolTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.storage = SqliteStorage(os.path.join(self.directory, "users.db"))
+        self.addCleanup(self.storage.close)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as users_file:
+            users_file.write(content)
+        return path
+
+    def import_file(self, path, file_format, password_pool=None):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return import_users(self.storage, path, file_format, password_pool, ITERATIONS)
+
+    def test_decode_user(self):
+        record = decode_user('{"username": "alice", "password": "secret", "score": "7", "questions_seen": "0a"}')
+        self.assertEqual(record["score"], 7)
+        self.assertIsNone(record["score_timestamp"])
+        self.assertEqual(record["questions_seen"], b"\n")
+        self.assertEqual(decode_user({"username": "bob", "password": "secret", "score_timestamp": "",
+                                      "questions_asked": "[1, 2]"})["questions_asked"], [1, 2])
+        for row in ('["alice"]', {"username": "alice"}, {"username": "al ice", "password": "secret"}):
+            with self.assertRaises(ValueError):
+                decode_user(row)
+
+    def test_import_skips_taken_usernames_and_invalid_rows(self):
+        self.storage.create_user({"username": "carol", "password": "secret"})
+        path = self.write_file("users.jsonl", "\n".join([
+            '{"username": "alice", "password": "secret", "score": 5}',
+            '{"username": "carol", "password": "secret"}',
+            'not json',
+            '{"username": "alice", "password": "other"}',
+            '{"username": "bob", "password": "secret", "score": "many"}',
+            '{"username": "dave", "password": "secret"}',
+        ]) + "\n")
+        self.assertEqual(self.import_file(path, "jsonl"), (2, 2, 2))
+        self.assertEqual(sorted(self.storage.usernames()), ["alice", "carol", "dave"])
+        self.assertEqual(self.storage.find_user("alice")[1]["password"], "secret")
+
+    def test_import_hashes_plaintext_passwords(self):
+        path = self.write_file("users.csv", "username,password\nalice,secret\nbob,pbkdf2_sha256$1$00$00\n")
+        with ThreadPoolExecutor(2) as password_pool:
+            self.assertEqual(self.import_file(path, "csv", password_pool), (2, 0, 0))
+        alice_password = self.storage.find_user("alice")[1]["password"]
+        self.assertTrue(is_password_hash(alice_password))
+        self.assertTrue(check_password("secret", alice_password, ITERATIONS)[0])
+        self.assertEqual(self.storage.find_user("bob")[1]["password"], "pbkdf2_sha256$1$00$00")
+
+    def test_export_then_import(self):
+        self.storage.create_user({"username": "alice", "password": "secret", "score": 5, "score_timestamp": 1.5,
+                                  "questions_seen": b"\x05"})
+        self.storage.create_user({"username": "bob", "password": "secret", "questions_asked": [3]})
+        for file_format in ("jsonl", "csv"):
+            path = os.path.join(self.directory, "users." + file_format)
+            self.assertEqual(export_users(self.storage, path, file_format), 2)
+            copy = SqliteStorage(os.path.join(self.directory, file_format + ".db"))
+            self.addCleanup(copy.close)
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(import_users(copy, path, file_format), (2, 0, 0))
+            alice = copy.find_user("alice")[1]
+            self.assertEqual((alice["score"], alice["score_timestamp"], alice["questions_seen"]), (5, 1.5, b"\x05"))
+            self.assertEqual(copy.find_user("bob")[1]["questions_asked"], [3])
+
+    def test_rebuild_leaderboard(self):
+        alice = self.storage.create_user({"username": "alice", "password": "secret", "score": 5, "score_timestamp": 9})
+        bob = self.storage.create_user({"username": "bob", "password": "secret", "score": 5})
+        self.storage.create_user({"username": "carol", "password": "secret", "score": 7, "score_timestamp": 20})
+        snapshot_file = os.path.join(self.directory, "snapshot.json")
+        leaderboard, filled = rebuild_leaderboard(self.storage, snapshot_file)
+        self.assertEqual(filled, 1)
+        self.assertEqual(self.storage.get_user(bob)["score_timestamp"], MISSING_SCORE_TIMESTAMP)
+        self.assertEqual(leaderboard.top(3), [("carol", 7), ("bob", 5), ("alice", 5)])
+        self.assertEqual(leaderboard.rank(alice), 2)
+        self.assertEqual(json.loads(json.dumps(leaderboard.records())), read_snapshot(snapshot_file)["leaderboard"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+from worker_pool import WorkerPool
+
+
+def run_until_idle(pool, timeout=5):
+    """
+    Runs the completions of the pool like the event loop does, until no job is pending
+    """
+    deadline = time.monotonic() + timeout
+    while pool.pending and time.monotonic() < deadline:
+        time.sleep(0.001)
+        pool.run_completions()
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(max_workers=4)
+        self.events = []
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def record(self, name):
+        return lambda result, error: self.events.append((name, result, error))
+
+    def test_jobs_of_a_key_run_in_order(self):
+        for number in range(20):
+            self.pool.submit("key", time.sleep, (0.001 * (20 - number),), self.record(number))
+        run_until_idle(self.pool)
+        self.assertEqual([name for name, result, error in self.events], list(range(20)))
+
+    def test_jobs_of_different_keys_run_at_once(self):
+        barrier = threading.Barrier(2, timeout=5)
+        self.pool.submit("a", barrier.wait, (), self.record("a"))
+        self.pool.submit("b", barrier.wait, (), self.record("b"))
+        run_until_idle(self.pool)
+        self.assertEqual(sorted(error is None for name, result, error in self.events), [True, True])
+
+    def test_errors_are_given_to_the_callback(self):
+        self.pool.submit(None, int, ("not a number",), self.record("job"))
+        run_until_idle(self.pool)
+        self.assertIsInstance(self.events[0][2], ValueError)
+
+    def test_deferred_work_waits_for_the_key(self):
+        self.pool.submit("key", time.sleep, (0.01,), self.record("job"))
+        self.pool.defer("key", lambda: self.events.append(("deferred", None, None)))
+        self.pool.defer("other", lambda: self.events.append(("other", None, None)))
+        self.assertEqual(self.events, [("other", None, None)])
+        self.assertTrue(self.pool.is_busy("key"))
+        run_until_idle(self.pool)
+        self.assertEqual([name for name, result, error in self.events], ["other", "job", "deferred"])
+        self.assertFalse(self.pool.is_busy("key"))
+
+    def test_work_given_by_a_callback_goes_before_the_waiting_work(self):
+        def first_done(result, error):
+            self.events.append(("first", result, error))
+            self.pool.submit("key", time.sleep, (0,), self.record("continued"))
+        self.pool.submit("key", time.sleep, (0.01,), first_done)
+        self.pool.submit("key", time.sleep, (0,), self.record("second"))
+        run_until_idle(self.pool)
+        self.assertEqual([name for name, result, error in self.events], ["first", "continued", "second"])
+
+    def test_cancel_drops_the_callbacks(self):
+        self.pool.submit("key", time.sleep, (0.01,), self.record("job"))
+        self.pool.submit("key", time.sleep, (0,), self.record("waiting"))
+        self.pool.cancel("key")
+        run_until_idle(self.pool)
+        self.assertEqual(self.events, [])
+        self.assertFalse(self.pool.is_busy("key"))
+
+    def test_shutdown_runs_the_waiting_jobs(self):
+        def first_done(result, error):
+            self.events.append(("first", result, error))
+            self.pool.submit("key", time.sleep, (0,), self.record("continued"))
+        self.pool.submit("key", time.sleep, (0.01,), first_done)
+        for number in range(3):
+            self.pool.submit("key", time.sleep, (0,), self.record(number))
+        self.pool.shutdown()
+        self.assertEqual([name for name, result, error in self.events], ["first", "continued", 0, 1, 2])
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_shutdown_drops_what_is_left_after_the_timeout(self):
+        self.pool.submit("key", time.sleep, (0.2,), self.record("slow"))
+        self.pool.submit("key", time.sleep, (0,), self.record("waiting"))
+        self.pool.shutdown(timeout=0.01)
+        self.assertEqual(self.events, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
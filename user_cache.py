@@ -0,0 +1,95 @@
+##############################################################################
+# user_cache.py
+##############################################################################
+
+import time
+
+USER_FLUSH_INTERVAL = 5  # Max seconds a change can wait before it's written to the store
+
+
+class UserStateCache:
+    """
+    In process copy of the records of the logged in users.
+    Handlers read and change the records here, and the changed fields are written to the store in batches,
+    at most flush_interval seconds after they were made, so a crash loses at most that window of progress.
+    """
+
+    def __init__(self, write_batch, flush_interval=USER_FLUSH_INTERVAL):
+        """
+        :param write_batch: function that gets a dictionary of user id -> changed fields and writes it to the store
+        :param flush_interval: max seconds between flushes
+        """
+        self._write_batch = write_batch
+        self.flush_interval = flush_interval
+        self._users = {}  # user id -> dictionary of the user's record
+        self._changes = {}  # user id -> dictionary of fields changed since the last flush
+        self._last_flush = time.monotonic()
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def load(self, user_id, user_record: dict):
+        """
+        Caches the record of a user that just logged in. A record which is already cached is kept as is,
+        since it may have changes the store doesn't have yet.
+        """
+        if user_id not in self._users:
+            self._users[user_id] = dict(user_record)
+
+    def get(self, user_id, field):
+        return self._users[user_id].get(field)
+
+    def update(self, user_id, fields: dict):
+        """
+        Changes fields of a cached user. The change is written on the next flush
+        """
+        self._users[user_id].update(fields)
+        self._changes.setdefault(user_id, {}).update(fields)
+
+    def has_changes(self):
+        return bool(self._changes)
+
+    def flush_due(self):
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def take_changes(self, user_ids=None):
+        """
+        Removes the pending changes from the cache so they can be written to the store.
+        If writing them fails they should be given back with restore_changes.
+        :param user_ids: take only the changes of these users. All changes are taken if None
+        :return: dictionary of user id -> changed fields
+        """
+        if user_ids is None:
+            self._last_flush = time.monotonic()
+            changes, self._changes = self._changes, {}
+            return changes
+        return {user_id: self._changes.pop(user_id) for user_id in user_ids if user_id in self._changes}
+
+    def restore_changes(self, changes: dict):
+        """
+        Gives back changes that failed to be written, under the changes made since, so the next flush retries them
+        """
+        for user_id, fields in changes.items():
+            fields.update(self._changes.get(user_id, {}))
+            self._changes[user_id] = fields
+
+    def flush(self, user_ids=None):
+        """
+        Writes the pending changes to the store in one batch
+        :param user_ids: write only the changes of these users. All changes are written if None
+        """
+        changes = self.take_changes(user_ids)
+        if not changes:
+            return
+        try:
+            self._write_batch(changes)
+        except Exception:
+            self.restore_changes(changes)
+            raise
+
+    def discard(self, user_id):
+        """
+        Removes a user from the cache, unless it has changes that weren't written yet
+        """
+        if user_id not in self._changes:
+            self._users.pop(user_id, None)
@@ -0,0 +1,283 @@
+##############################################################################
+# user_tool.py
+# Bulk maintenance of the users in the store: export them, import them, and rebuild the leaderboard.
+# Users are read and written as JSON lines or CSV, one user per line, in constant memory.
+# Usage: python user_tool.py --storage sqlite export users.jsonl
+#        python user_tool.py --storage sqlite import users.csv
+#        python user_tool.py --storage sqlite rebuild-leaderboard
+##############################################################################
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import storage as user_storage
+from leaderboard import Leaderboard
+from passwords import hash_password, is_password_hash, HASH_ITERATIONS
+from snapshot import write_snapshot, read_snapshot
+
+FILE_FORMATS = ("jsonl", "csv")
+USER_FIELDS = ("username", "password", "score", "score_timestamp", "questions_seen", "questions_asked")
+BATCH_SIZE = user_storage.FIRESTORE_BATCH_SIZE  # users written to the store in one commit
+HASH_CHUNK_SIZE = 16  # passwords sent to a hashing process at once
+MISSING_SCORE_TIMESTAMP = 0  # given to users without one, the leaderboard already ranks them as if they had it
+COMMANDS = ("export", "import", "rebuild-leaderboard")
+
+
+def file_format_of(path, file_format=None):
+    """
+    :return: the format asked for, or the one of the file's extension (JSON lines unless it's .csv)
+    """
+    if file_format:
+        return file_format
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def open_users_file(path, mode):
+    """
+    Opens a users file, - is the standard input or output
+    """
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def encode_user(record: dict, file_format):
+    """
+    :return: the fields of a user record as they're written to a users file. Bytes are written in hex, and in
+    CSV lists are written as JSON and missing values as empty strings.
+    """
+    row = {
+        "username": record.get("username"),
+        "password": record.get("password"),
+        "score": record.get("score", 0),
+        "score_timestamp": record.get("score_timestamp"),
+        "questions_seen": bytes(record.get("questions_seen") or b"").hex(),
+        "questions_asked": list(record.get("questions_asked") or []),
+    }
+    if file_format == "csv":
+        row["questions_asked"] = json.dumps(row["questions_asked"])
+        if row["score_timestamp"] is None:
+            row["score_timestamp"] = ""
+    return row
+
+
+def decode_user(row):
+    """
+    Makes the record of a new user from a row of a users file, in either format. Only username and password
+    are required, the password may be plaintext or a hash made by passwords.hash_password.
+    :param row: dictionary of the fields, or a JSON line of them
+    :raise ValueError: if the row can't be imported
+    :return: the record
+    """
+    if isinstance(row, str):
+        row = json.loads(row)
+        if not isinstance(row, dict):
+            raise ValueError("a user must be a JSON object")
+    username = row.get("username")
+    password = row.get("password")
+    if not username or not password:
+        raise ValueError("a username and a password are required")
+    if not str(username).isalnum():
+        raise ValueError("usernames contain only letters and digits")
+    record = {
+        "username": str(username),
+        "password": str(password),
+        "score": int(row.get("score") or 0),
+        "score_timestamp": float(row["score_timestamp"]) if row.get("score_timestamp") not in (None, "") else None,
+        "questions_seen": bytes.fromhex(row.get("questions_seen") or ""),
+    }
+    questions_asked = row.get("questions_asked")
+    if isinstance(questions_asked, str):
+        questions_asked = json.loads(questions_asked) if questions_asked else []
+    if questions_asked:
+        record["questions_asked"] = list(questions_asked)
+    return record
+
+
+def read_users(users_file, file_format):
+    """
+    :return: iterable of (line number, row) of a users file, read while it's iterated. A row is a dictionary,
+    or the line itself in JSON lines, so a line that isn't JSON is skipped by the caller like any invalid row.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(users_file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(users_file, 1):
+            if line.strip():
+                yield line_number, line
+
+
+def export_users(storage, path, file_format):
+    """
+    Writes every user of the store to a users file, as they're read from the store
+    :return: number of users written
+    """
+    count = 0
+    with open_users_file(path, "w") as users_file:
+        writer = csv.DictWriter(users_file, USER_FIELDS) if file_format == "csv" else None
+        if writer:
+            writer.writeheader()
+        for user_id, record in storage.all_users():
+            row = encode_user(record, file_format)
+            if writer:
+                writer.writerow(row)
+            else:
+                users_file.write(json.dumps(row, separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+
+def save_users(storage, records):
+    """
+    Saves a batch of new users in one commit. If the store refuses the batch since a username was taken meanwhile
+    (by a sign up on a running server), the users are saved one by one instead.
+    :return: number of users saved
+    """
+    try:
+        return len(storage.create_users(records))
+    except sqlite3.IntegrityError:
+        return sum(1 for record in records if storage.sign_up_user(record) is not None)
+
+
+def import_users(storage, path, file_format, password_pool=None, iterations=HASH_ITERATIONS):
+    """
+    Adds the users of a users file to the store in batches. A username which is already in the store, or earlier
+    in the file, is skipped. The usernames are kept in a set, so that's checked without a query per user.
+    :param password_pool: executor hashing the plaintext passwords, None to save them as they are (the server
+    hashes them on the first login)
+    :return: (users saved, duplicate usernames skipped, invalid rows skipped)
+    """
+    usernames = set(storage.usernames())
+    saved = duplicates = invalid = 0
+    batch = []
+    with open_users_file(path, "r") as users_file:
+        for line_number, row in read_users(users_file, file_format):
+            try:
+                record = decode_user(row)
+            except (ValueError, TypeError) as err:
+                invalid += 1
+                print("skipped line " + str(line_number) + ": " + str(err), file=sys.stderr)
+                continue
+            if record["username"] in usernames:
+                duplicates += 1
+                continue
+            usernames.add(record["username"])
+            batch.append(record)
+            if len(batch) == BATCH_SIZE:
+                saved += save_users(storage, hash_passwords(batch, password_pool, iterations))
+                batch = []
+        if batch:
+            saved += save_users(storage, hash_passwords(batch, password_pool, iterations))
+    return saved, duplicates, invalid
+
+
+def hash_passwords(records, password_pool, iterations):
+    """
+    Replaces the plaintext passwords of a batch of records with hashes, on the processes of password_pool
+    :return: the records
+    """
+    if password_pool is None:
+        return records
+    plaintext = [record for record in records if not is_password_hash(record["password"])]
+    hashes = password_pool.map(hash_password, [record["password"] for record in plaintext],
+                               [iterations] * len(plaintext), chunksize=HASH_CHUNK_SIZE)
+    for record, password_hash in zip(plaintext, hashes):
+        record["password"] = password_hash
+    return records
+
+
+def rebuild_leaderboard(storage, snapshot_file=None):
+    """
+    Ranks all the users in one pass over the store. Users without a score_timestamp get one, so the store
+    has what the server's leaderboard ranks them by.
+    :param snapshot_file: server snapshot to save the rebuilt leaderboard in, its daily and weekly rankings and resume
+    tokens are kept
+    :return: (the Leaderboard, number of users whose score_timestamp was filled in)
+    """
+    records = []
+    missing = []
+    for user_id, username, score, score_timestamp in storage.leaderboard_records():
+        if score_timestamp is None:
+            score_timestamp = MISSING_SCORE_TIMESTAMP
+            missing.append(user_id)
+        records.append((user_id, username, score or 0, score_timestamp))
+    for start in range(0, len(missing), BATCH_SIZE):
+        storage.update_users({user_id: {"score_timestamp": MISSING_SCORE_TIMESTAMP}
+                              for user_id in missing[start:start + BATCH_SIZE]})
+    records.sort(key=lambda record: (-record[2], record[3], record[0]))
+    leaderboard = Leaderboard()
+    leaderboard.load(records)
+    if snapshot_file:
+        snapshot = read_snapshot(snapshot_file) or {}
+        write_snapshot(snapshot_file, leaderboard.records(), snapshot.get("resume_tokens", []), time.time(),
+                       snapshot.get("periods"))
+    return leaderboard, len(missing)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Bulk export, import and leaderboard rebuild of the trivia users")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("file", nargs="?", default="-",
+                        help="users file to export to or import from, - for the standard output or input "
+                             "(default: %(default)s)")
+    parser.add_argument("--format", choices=FILE_FORMATS,
+                        help="format of the users file (default: csv for .csv files, jsonl otherwise)")
+    parser.add_argument("--storage", choices=user_storage.STORAGE_BACKENDS, default="firestore",
+                        help="where the users are kept (default: firestore)")
+    parser.add_argument("--storage-location",
+                        help="SQLite database file, or Firestore credentials file (default: the backend's default)")
+    parser.add_argument("--keep-plaintext-passwords", action="store_true",
+                        help="save the plaintext passwords of imported users as they are, instead of hashing them. "
+                             "The server hashes them when the users log in. Passwords which are hashes already are "
+                             "always saved as they are")
+    parser.add_argument("--password-workers", type=int,
+                        help="processes hashing passwords (default: the number of CPUs)")
+    parser.add_argument("--password-iterations", type=int, default=HASH_ITERATIONS,
+                        help="PBKDF2 iterations of the password hashes (default: %(default)s)")
+    parser.add_argument("--snapshot-file",
+                        help="server snapshot to save the rebuilt leaderboard in, so a server started from it "
+                             "ranks the users the same way. The server must be stopped (default: none)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    storage = user_storage.open_storage(args.storage, args.storage_location)
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            count = export_users(storage, args.file, file_format_of(args.file, args.format))
+            print("exported %d users" % count, file=sys.stderr)
+        elif args.command == "import":
+            password_pool = None
+            if not args.keep_plaintext_passwords:
+                password_pool = ProcessPoolExecutor(args.password_workers, multiprocessing.get_context("spawn"))
+            try:
+                saved, duplicates, invalid = import_users(storage, args.file, file_format_of(args.file, args.format),
+                                                          password_pool, args.password_iterations)
+            finally:
+                if password_pool is not None:
+                    password_pool.shutdown()
+            print("imported %d users, skipped %d taken usernames and %d invalid rows" % (saved, duplicates, invalid),
+                  file=sys.stderr)
+        else:
+            leaderboard, filled = rebuild_leaderboard(storage, args.snapshot_file)
+            print("ranked %d users, filled in the score timestamp of %d" % (len(leaderboard), filled),
+                  file=sys.stderr)
+            for place, (username, score) in enumerate(leaderboard.top(10), 1):
+                print("%d. %s: %d" % (place, username, score))
+    finally:
+        storage.close()
+    print("done in %.1f seconds" % (time.perf_counter() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+##############################################################################
+# worker_pool.py
+##############################################################################
+
+import functools
+import logging
+import queue
+import select
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+STORAGE_WORKERS = 8  # Threads running storage calls
+MAX_PENDING_JOBS = 1000  # Jobs waiting or running before new requests are turned away
+LATENCY_SAMPLES = 1000  # Latest jobs kept for the latency percentiles
+SHUTDOWN_TIMEOUT = 30  # seconds shutdown waits for the pending jobs before dropping the work waiting for them
+
+log = logging.getLogger("worker_pool")
+
+
+class WorkerPool:
+    """
+    Runs blocking calls (storage I/O) on a bounded pool of threads, so a slow call doesn't stall the event loop.
+    Results are handed back to the event loop thread, which is woken up through wakeup_socket and runs the
+    callbacks in run_completions. Jobs and deferred work with the same ordering key (usually a client connection)
+    run one at a time in the order they were given.
+    """
+
+    def __init__(self, max_workers=STORAGE_WORKERS, max_pending=MAX_PENDING_JOBS, metrics=None):
+        """
+        :param metrics: metrics.Metrics the run time of every job is recorded in, as "storage.<function name>"
+        """
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="storage")
+        self.max_pending = max_pending
+        self._completed = queue.SimpleQueue()  # (job, result, error, run seconds) put by the worker threads
+        self.wakeup_socket, self._wakeup_writer = socket.socketpair()
+        self.wakeup_socket.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._running = {}  # ordering key -> the job running for it
+        self._waiting = {}  # ordering key -> deque of functions to run once the key's job is done
+        self._held_back = None  # (key, its waiting work) while the callback of the key's job runs
+        self.pending = 0  # jobs handed to the threads and not completed yet
+        self.completed_jobs = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)  # seconds from submit to callback
+        self.metrics = metrics
+
+    def is_full(self):
+        return self.pending >= self.max_pending
+
+    def is_busy(self, key):
+        """
+        :return: True if work given with this ordering key hasn't finished yet
+        """
+        return key in self._running or key in self._waiting
+
+    def submit(self, key, function, args, on_done, executor=None):
+        """
+        Runs function(*args) on a worker thread. When it's done on_done(result, error) is called on the
+        event loop thread, where error is the exception it raised or None.
+        :param key: ordering key, the job starts only after the work given before it with the same key is done.
+        None if the job doesn't need ordering.
+        :param executor: concurrent.futures executor to run the job on instead of the pool's threads, like a process
+        pool for CPU bound work. The function and arguments must be picklable for a process pool.
+        """
+        job = [key, function, args, on_done, time.monotonic(), executor]
+        if key is not None and self.is_busy(key):
+            self._waiting.setdefault(key, deque()).append(lambda: self._start(job))
+        else:
+            self._start(job)
+
+    def defer(self, key, function):
+        """
+        Calls function() on the event loop thread once the work given before it with this key is done
+        """
+        if self.is_busy(key):
+            self._waiting.setdefault(key, deque()).append(function)
+        else:
+            function()
+
+    def cancel(self, key):
+        """
+        Drops the waiting work of the key, and the callback of its running job. Used when a client disconnects.
+        """
+        self._running.pop(key, None)
+        self._waiting.pop(key, None)
+        if self._held_back is not None and self._held_back[0] == key:
+            self._held_back = (None, None)  # cancelled by the callback of its job
+
+    def _start(self, job):
+        key = job[0]
+        if key is not None:
+            self._running[key] = job
+        self.pending += 1
+        if job[5] is None:
+            self._executor.submit(self._run, job)
+        else:
+            job[5].submit(job[1], *job[2]).add_done_callback(
+                functools.partial(self._finish_future, job, time.perf_counter()))
+
+    def _run(self, job):
+        start = time.perf_counter()
+        try:
+            result, error = job[1](*job[2]), None
+        except Exception as err:
+            result, error = None, err
+        self._complete(job, result, error, time.perf_counter() - start)
+
+    def _finish_future(self, job, start, future):
+        error = future.exception()
+        self._complete(job, None if error else future.result(), error, time.perf_counter() - start)
+
+    def _complete(self, job, result, error, run_time):
+        """
+        Hands a finished job to the event loop thread. Called on the thread the job ran on
+        """
+        self._completed.put((job, result, error, run_time))
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass  # the event loop has wake ups waiting already, or the pool was shut down
+
+    def run_completions(self):
+        """
+        Calls the callbacks of the jobs that finished, then continues the work that waited for them.
+        Must be called on the event loop thread when wakeup_socket is readable.
+        """
+        try:
+            while self.wakeup_socket.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                job, result, error, run_time = self._completed.get_nowait()
+            except queue.Empty:
+                break
+            key = job[0]
+            self.pending -= 1
+            self.completed_jobs += 1
+            self._latencies.append(time.monotonic() - job[4])
+            if self.metrics is not None:
+                self.metrics.observe("storage." + getattr(job[1], "__name__", "job"), run_time)
+            if key is not None:
+                if self._running.get(key) is not job:
+                    continue  # cancelled
+                del self._running[key]
+                # Work the callback gives with the key continues the job, so it goes before the work waiting for it
+                self._held_back = (key, self._waiting.pop(key, None))
+            try:
+                job[3](result, error)
+            except Exception as err:
+                log.exception("worker pool callback failed: %s", err)
+            if key is not None:
+                held_key, waiting = self._held_back
+                self._held_back = None
+                if waiting and held_key is not None:
+                    waiting.extendleft(reversed(self._waiting.pop(key, ())))
+                    self._waiting[key] = waiting
+                self._advance(key)
+
+    def _advance(self, key):
+        waiting = self._waiting.pop(key, None)
+        while waiting and key not in self._running:
+            waiting.popleft()()
+        if waiting:
+            # A job was started. Work given while running the functions continues them, so it goes first
+            waiting.extendleft(reversed(self._waiting.pop(key, ())))
+            self._waiting[key] = waiting
+
+    def stats(self):
+        """
+        :return: dictionary with the queue depth and the latency percentiles (in milliseconds) of the pool
+        """
+        latencies = sorted(self._latencies)
+        stats = {"pending": self.pending, "completed": self.completed_jobs}
+        for percentile in (50, 95, 99):
+            if latencies:
+                stats["p" + str(percentile) + "_ms"] = round(
+                    latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)] * 1000, 2)
+        return stats
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        Runs the pending jobs to the end, with their callbacks and the work waiting for them, then stops the threads.
+        Must be called on the event loop thread, instead of its loop.
+        :param timeout: seconds to wait for the jobs, the work still waiting after it is dropped
+        """
+        if self.wakeup_socket.fileno() == -1:
+            return  # shut down already
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            select.select([self.wakeup_socket], [], [], deadline - time.monotonic())
+            self.run_completions()
+        if self.pending:
+            log.warning("worker pool shut down with %d jobs unfinished", self.pending)
+        self._running.clear()  # callbacks of jobs finishing from now on aren't called
+        self._waiting.clear()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.wakeup_socket.close()
+        self._wakeup_writer.close()